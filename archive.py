@@ -0,0 +1,208 @@
+import argparse
+import json
+import os
+import re
+from dataclasses import dataclass
+import numpy as np
+import instrumentation
+import paths
+
+# Compact archive of all the light curves
+# The measurements are spread over hundreds of text files (.tbl, .dat, .csv and the .dat.csv copies) whose names encode
+# the target, the filter and the number of comparison stars. The archive stores every series (one file = one night of
+# one target through one filter, measured in one way) as slices of a few binary columns:
+#  - times.npy: float64 offsets in days from the epoch of the series (its first julian date)
+#  - mags.npy, errors.npy: float32 magnitudes and their errors (NaN where unknown)
+#  - flags.npy: uint8 quality flags (see quality.py, 0 is a good frame)
+# index.json lists every series with its target, filter, night, mode and the rows it occupies. The series are sorted
+# by target, so the season of a star is one contiguous block of every column. The columns are memory-mapped when
+# reading, so a query only reads the bytes of the series it selects and the arrays it returns are views, not copies.
+# Modes are how the magnitudes were measured: "astroimagej" (calibrated magnitudes of the .tbl tables), and the
+# directory of the Siril exports ("auto_aperture", "fixed_aperture") with the number of comparison stars of the
+# relative magnitudes in the .dat files appended (e.g. "auto_aperture_3ref").
+# Usage: python archive.py [--root lightcurves] [--output lightcurve_archive]
+
+ARCHIVE_DIR = "lightcurve_archive"
+INDEX_FILE = "index.json"
+# Bump when the layout of the archive changes
+ARCHIVE_VERSION = 1
+COLUMNS = {"times": np.float64, "mags": np.float32, "errors": np.float32, "flags": np.uint8}
+INDEX_FIELDS = ("target", "filter", "night", "mode")
+COMPARISONS_REGEX = re.compile(r"(\d+ref)$")
+
+
+@dataclass
+class Series:
+    target: str
+    filter: str
+    night: str
+    mode: str
+    # "mag" for calibrated magnitudes, "relmag" for magnitudes relative to the comparison stars
+    quantity: str
+    epoch: float
+    times: np.ndarray
+    mags: np.ndarray
+    errors: np.ndarray
+    flags: np.ndarray
+
+    def __len__(self):
+        return len(self.times)
+
+    @property
+    def julian_dates(self):
+        return self.epoch + self.times
+
+
+class Archive:
+    def __init__(self, archive_dir=ARCHIVE_DIR):
+        self.archive_dir = archive_dir
+        with open(os.path.join(archive_dir, INDEX_FILE)) as file:
+            index = json.load(file)
+        if index.get("version") != ARCHIVE_VERSION:
+            raise ValueError("Archive {} has version {}, expected {}".format(archive_dir, index.get("version"), ARCHIVE_VERSION))
+        self.entries = index["series"]
+        self.columns = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def column(self, name):
+        # Memory-mapped on first use, nothing but the header is read until the map is sliced
+        if name not in self.columns:
+            self.columns[name] = np.load(os.path.join(self.archive_dir, "{}.npy".format(name)), mmap_mode="r")
+        return self.columns[name]
+
+    def values(self, field):
+        # e.g. archive.values("target") for all the targets in the archive
+        return sorted({entry[field] for entry in self.entries if entry[field] is not None})
+
+    def select(self, **query):
+        # Index entries matching the query, e.g. select(target="VW Cep", mode="astroimagej")
+        # A value can also be a list or set of accepted values, fields that aren't given match everything
+        for field in query:
+            if field not in INDEX_FIELDS:
+                raise KeyError("Unknown index field {}, expected one of {}".format(field, ", ".join(INDEX_FIELDS)))
+        accepted = {field: {value} if isinstance(value, str) or value is None else set(value) for field, value in query.items()}
+        return [entry for entry in self.entries if all(entry[field] in values for field, values in accepted.items())]
+
+    def series(self, entry):
+        rows = slice(entry["start"], entry["stop"])
+        return Series(
+            target=entry["target"], filter=entry["filter"], night=entry["night"], mode=entry["mode"],
+            quantity=entry["quantity"], epoch=entry["epoch"],
+            **{name: self.column(name)[rows] for name in COLUMNS},
+        )
+
+    def read(self, **query):
+        return [self.series(entry) for entry in self.select(**query)]
+
+    def concatenated(self, **query):
+        # All the selected series as one set of arrays with full julian dates, e.g. the season of a star
+        # This is the only read that copies, as the times of different series have different epochs
+        series = self.read(**query)
+        if not series:
+            return {name: np.empty(0, dtype=dtype) for name, dtype in dict(COLUMNS, julian_dates=np.float64).items()}
+        arrays = {name: np.concatenate([getattr(part, name) for part in series]) for name in COLUMNS}
+        arrays["julian_dates"] = np.concatenate([part.julian_dates for part in series])
+        return arrays
+
+
+def series_key(file_path, kind):
+    # (target, filter, mode) of a light curve file
+    from calibration import filter_of
+    from designations import FILE_SUFFIX_REGEX, designation_from_file_name
+
+    stem = os.path.basename(file_path).split(".")[0]
+    target = designation_from_file_name(file_path) or FILE_SUFFIX_REGEX.sub("", stem)
+    directory = os.path.basename(os.path.dirname(file_path))
+    if kind == "binary_tbl":
+        return target, None, "astroimagej"
+    if kind == "ref_tbl":
+        return target, filter_of(file_path), "astroimagej"
+    comparisons = COMPARISONS_REGEX.search(stem)
+    mode = "{}_{}".format(directory, comparisons.group(1)) if comparisons else directory
+    return target, filter_of(file_path), mode
+
+
+def read_series(file_path, kind):
+    # Full julian dates, magnitudes, errors, flags and the quantity of the magnitudes of a light curve file
+    # The tables go through the same cached reductions as the plots, so importing them again is fast
+    import batch
+    from calibration import FLUX_TO_MAG_ERROR
+    import plot_binary_astroimagej
+    from siril_reader import read_siril
+    from tbl_reader import read_columns, read_tbl
+
+    if kind in ("siril_dat", "siril_csv"):
+        lightcurve = read_siril(file_path)
+        return lightcurve.julian_dates, lightcurve.relmags, lightcurve.errors, np.zeros(len(lightcurve), dtype=np.uint8), "relmag"
+    if kind == "binary_tbl":
+        arrays = plot_binary_astroimagej.reduce_file(file_path)
+        JULIAN_DATES, MAGS, FLAGS = arrays["JULIAN_DATES"], arrays["MAGS"], arrays["REJECTED_BY"]
+    else:
+        JULIAN_DATES, MAGS, _, _, _ = batch.reduce_ref_tbl(file_path)
+        FLAGS = np.zeros(len(MAGS), dtype=np.uint8)
+    # The error of a magnitude follows from the SNR AstroImageJ computed, if the table has it
+    ERRORS = np.full(len(MAGS), np.nan)
+    if "Source_SNR_T1" in read_columns(file_path):
+        with np.errstate(divide="ignore"):
+            ERRORS = FLUX_TO_MAG_ERROR/read_tbl(file_path, ["Source_SNR_T1"])["Source_SNR_T1"]
+    # The tables are in J.D.-2400000
+    return JULIAN_DATES + 2400000, MAGS, ERRORS, FLAGS, "mag"
+
+
+@instrumentation.timed()
+def import_lightcurves(root=paths.LIGHTCURVE_ROOT, archive_dir=ARCHIVE_DIR):
+    # Build the archive from all the light curves below root, the .dat.csv copies are skipped as duplicates
+    from batch import find_lightcurves
+    from calibration import night_of
+
+    parts = []
+    for file_path, kind in find_lightcurves(root):
+        JULIAN_DATES, MAGS, ERRORS, FLAGS, quantity = read_series(file_path, kind)
+        if not len(JULIAN_DATES):
+            continue
+        target, filter_letter, mode = series_key(file_path, kind)
+        epoch = float(JULIAN_DATES[0])
+        entry = {
+            "target": target, "filter": filter_letter, "night": night_of(epoch), "mode": mode, "quantity": quantity,
+            "epoch": epoch, "source": os.path.relpath(file_path, root),
+        }
+        parts.append((entry, {"times": JULIAN_DATES - epoch, "mags": MAGS, "errors": ERRORS, "flags": FLAGS}))
+    instrumentation.count("series", len(parts))
+    # Sorted so every star's series are next to each other in the columns
+    parts.sort(key=lambda part: tuple(part[0][field] or "" for field in ("target", "mode", "filter", "night")) + (part[0]["source"],))
+
+    os.makedirs(archive_dir, exist_ok=True)
+    start = 0
+    for entry, arrays in parts:
+        entry["start"], entry["stop"] = start, start + len(arrays["times"])
+        start = entry["stop"]
+    instrumentation.count("rows", start)
+    for name, dtype in COLUMNS.items():
+        VALUES = np.concatenate([np.asarray(arrays[name], dtype=dtype) for _, arrays in parts]) if parts else np.empty(0, dtype=dtype)
+        np.save(os.path.join(archive_dir, "{}.npy".format(name)), VALUES)
+    # Write to a temporary file first so an interrupted import never leaves a half written index behind
+    index_path = os.path.join(archive_dir, INDEX_FILE)
+    with open(index_path + ".tmp", "w") as file:
+        json.dump({"version": ARCHIVE_VERSION, "rows": start, "series": [entry for entry, _ in parts]}, file, indent=1)
+    os.replace(index_path + ".tmp", index_path)
+    return Archive(archive_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import all the light curves into a memory-mapped archive")
+    parser.add_argument("--root", default=paths.LIGHTCURVE_ROOT, help="directory that is searched recursively for light curves")
+    parser.add_argument("--output", default=ARCHIVE_DIR, help="directory of the archive")
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    instrumentation.configure(args)
+
+    archive = import_lightcurves(args.root, args.output)
+    rows = sum(entry["stop"] - entry["start"] for entry in archive.entries)
+    size = sum(os.path.getsize(os.path.join(args.output, "{}.npy".format(name))) for name in COLUMNS)
+    print("Imported {} series with {} frames of {} targets into {} ({:.1f} kB)".format(len(archive), rows, len(archive.values("target")), args.output, size/1e3))
+
+
+if __name__ == "__main__":
+    main()
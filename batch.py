@@ -0,0 +1,160 @@
+import argparse
+import glob
+import json
+import os
+
+# Headless batch mode: reduce every light curve below a directory without any user input
+# Every file is handled by a worker process that renders its figure with the non-interactive Agg backend
+# and writes a .json file with its statistics next to it. A summary of all the files is written at the end.
+# Usage: python batch.py [--root lightcurves] [--output ../Figures/batch_results] [--workers N]
+
+import numpy as np
+
+import calibration
+import instrumentation
+import paths
+from designations import target_metadata
+import plot_binary_astroimagej
+import plot_ref_calculated_astroimagej
+import product_cache
+import rendering
+from rolling import smoothing_stage
+from siril_reader import siril_stage
+
+DEFAULT_ROOT = paths.LIGHTCURVE_ROOT
+DEFAULT_OUTPUT_DIR = paths.figure_path("batch_results")
+DEFAULT_DPI = rendering.DEFAULT_DPI
+MOVING_AVERAGE_WINDOW_SIZE = 20
+
+
+def classify(file_path):
+    # Decide how a file has to be reduced from its location and extension, None for files that are skipped
+    parts = file_path.replace("\\", "/").split("/")
+    if file_path.endswith(".tbl"):
+        return "binary_tbl" if "binary_stars" in parts else "ref_tbl"
+    if file_path.endswith(".dat"):
+        return "siril_dat"
+    # The .dat.csv files are comma separated copies of the .dat files and would only be processed twice
+    if file_path.endswith(".csv") and not file_path.endswith(".dat.csv"):
+        return "siril_csv"
+    return None
+
+
+def find_lightcurves(root):
+    FILES = sorted(glob.glob(os.path.join(root, "**", "*"), recursive=True))
+    return [(file_path, classify(file_path)) for file_path in FILES if os.path.isfile(file_path) and classify(file_path)]
+
+
+def reduce_binary_tbl(file_path):
+    arrays = plot_binary_astroimagej.reduce_file(file_path)
+    # The frames the quality filter rejected are left out of the figure and the statistics
+    GOOD = arrays["REJECTED_BY"] == 0
+    return arrays["JULIAN_DATES"][GOOD], arrays["MAGS"][GOOD], arrays["SMOOTHED_MAGS"][GOOD], "Julian Date -2400000", "mag"
+
+
+def reduce_ref_tbl(file_path):
+    arrays = plot_ref_calculated_astroimagej.reduce_file(file_path)
+    return arrays["JULIAN_DATES"], arrays["MAGS"], arrays["SMOOTHED_MAGS"], "Julian Date -2400000", "mag"
+
+
+def reduce_siril(file_path):
+    arrays = product_cache.default_cache().run(file_path, [siril_stage(file_path), smoothing_stage("RELMAGS", MOVING_AVERAGE_WINDOW_SIZE)])
+    julian_date_prefix = int(arrays["JULIAN_DATES"][0]) if len(arrays["JULIAN_DATES"]) else 0
+    return arrays["JULIAN_DATES"] - julian_date_prefix, arrays["RELMAGS"], arrays["SMOOTHED_MAGS"], "Julian Date ({}+)".format(julian_date_prefix), "Relative magnitude"
+
+
+def lightcurve_stats(JULIAN_DATES, MAGS, SMOOTHED_MAGS):
+    DEVS_FROM_MEAN = MAGS - SMOOTHED_MAGS
+    return {
+        "frames": int(len(MAGS)),
+        "jd_start": float(np.min(JULIAN_DATES)),
+        "jd_end": float(np.max(JULIAN_DATES)),
+        "mag_max": float(np.nanmax(MAGS)),
+        "mag_min": float(np.nanmin(MAGS)),
+        "mag_median": float(np.nanmedian(MAGS)),
+        "smoothed_mag_max": float(np.nanmax(SMOOTHED_MAGS)),
+        "smoothed_mag_min": float(np.nanmin(SMOOTHED_MAGS)),
+        "average_deviation": float(np.nanmean(DEVS_FROM_MEAN)),
+        "standard_deviation": float(np.nanstd(DEVS_FROM_MEAN)),
+    }
+
+
+def json_safe(metadata):
+    # Missing catalog values are NaN, which isn't valid JSON
+    if metadata is None:
+        return None
+    return {key: None if isinstance(value, float) and np.isnan(value) else value for key, value in metadata.items()}
+
+
+def output_stem(file_path, root, output_dir):
+    # Keep the directory structure in the file name, e.g. ref_stars/astroimagej/36PerseiB.tbl -> ref_stars_astroimagej_36PerseiB.tbl
+    relative_path = os.path.relpath(file_path, root)
+    return os.path.join(output_dir, relative_path.replace(os.sep, "_").replace("/", "_"))
+
+
+def process_file(file_path, kind, root, output_dir, dpi, figure_format):
+    with instrumentation.stage("process_file", file=file_path, kind=kind) as timer:
+        if kind == "binary_tbl":
+            JULIAN_DATES, MAGS, SMOOTHED_MAGS, x_label, y_label = reduce_binary_tbl(file_path)
+        elif kind == "ref_tbl":
+            JULIAN_DATES, MAGS, SMOOTHED_MAGS, x_label, y_label = reduce_ref_tbl(file_path)
+        else:
+            JULIAN_DATES, MAGS, SMOOTHED_MAGS, x_label, y_label = reduce_siril(file_path)
+        timer.count("frames", len(MAGS))
+
+        stem = output_stem(file_path, root, output_dir)
+        # Every worker reuses its one figure for all the files it handles
+        spec = rendering.FigureSpec(stem, "LC for sequence {}".format(os.path.basename(file_path)), x_label, y_label, JULIAN_DATES, MAGS, SMOOTHED_MAGS, invert_y=True)
+        figure_path = rendering.render(spec, dpi, figure_format)
+
+        stats = lightcurve_stats(JULIAN_DATES, MAGS, SMOOTHED_MAGS)
+        stats.update({"file": file_path, "kind": kind, "figure": figure_path, "catalog": json_safe(target_metadata(file_path))})
+        with open(stem + ".json", "w") as file:
+            json.dump(stats, file, indent=1)
+        return stats
+
+
+def run_batch(root=DEFAULT_ROOT, output_dir=DEFAULT_OUTPUT_DIR, workers=None, dpi=DEFAULT_DPI, figure_format=rendering.DEFAULT_FORMAT):
+    os.makedirs(output_dir, exist_ok=True)
+    # Bring the calibration up to date once, instead of every worker noticing a stale cache on its own
+    for source in calibration.SOURCES:
+        calibration.load_calibration(source)
+    results = []
+    errors = []
+    LIGHTCURVES = find_lightcurves(root)
+    with rendering.RenderPool(workers, dpi, figure_format) as pool:
+        for file_path, kind in LIGHTCURVES:
+            pool.submit(process_file, file_path, kind, root, output_dir, dpi, figure_format)
+        for (file_path, _), (stats, exception) in zip(LIGHTCURVES, pool.results()):
+            if exception is None:
+                results.append(stats)
+            else:
+                # A broken file shouldn't stop the reduction of all the others
+                errors.append({"file": file_path, "error": repr(exception)})
+    results.sort(key=lambda stats: stats["file"])
+    summary = {"root": root, "files": results, "errors": errors}
+    with open(os.path.join(output_dir, "summary.json"), "w") as file:
+        json.dump(summary, file, indent=1)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reduce every light curve below a directory without user input")
+    parser.add_argument("--root", default=DEFAULT_ROOT, help="directory that is searched recursively for light curves")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT_DIR, help="directory the figures and statistics are written to")
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes (default: number of cores, 0 runs everything in this process)")
+    parser.add_argument("--dpi", type=int, default=DEFAULT_DPI)
+    parser.add_argument("--format", default=rendering.DEFAULT_FORMAT, help="figure format, e.g. png, pdf or svg")
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    instrumentation.configure(args)
+
+    with instrumentation.stage("batch", root=args.root):
+        summary = run_batch(args.root, args.output, args.workers, args.dpi, args.format)
+    print("Reduced {} files, {} failed".format(len(summary["files"]), len(summary["errors"])))
+    for error in summary["errors"]:
+        print("{}: {}".format(error["file"], error["error"]))
+
+
+if __name__ == "__main__":
+    main()
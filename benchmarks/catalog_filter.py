@@ -0,0 +1,58 @@
+# Benchmark for the columnar catalog filter
+# Generates synthetic catalogs with the columns get_candidates.py filters on and times the filter for growing catalog sizes
+# Run from the repository root with: python -m benchmarks.catalog_filter
+
+import time
+import numpy as np
+from catalog_filter import apply_constraints
+from get_candidates import EXCLUSION_CONSTRAINTS, FILTER_CONSTRAINTS
+
+CATALOG_SIZES = [10**3, 10**4, 10**5, 10**6]
+REPEATS = 5
+
+
+def synthetic_catalog(n_rows, seed=0):
+    rng = np.random.default_rng(seed)
+    PERIODS = rng.lognormal(mean=0.0, sigma=1.5, size=n_rows)
+    # Roughly 20% of the real catalog has an unknown period
+    PERIODS[rng.random(n_rows) < 0.2] = 0
+    MIN_I = rng.uniform(5, 18, n_rows)
+    MIN_II = np.where(rng.random(n_rows) < 0.5, 99.99, MIN_I - rng.uniform(0, 1, n_rows))
+    return {
+        "Period [d]": PERIODS,
+        "MinI": MIN_I,
+        "MinII": MIN_II,
+        # The coordinate columns get_candidates.py adds before filtering: declination in degrees and RA in decimal hours
+        "DE [deg]": np.degrees(np.arcsin(rng.uniform(-1, 1, n_rows))),
+        "RA [h]": rng.uniform(0, 24, n_rows),
+    }
+
+
+def time_filter(catalog):
+    constraints = EXCLUSION_CONSTRAINTS + FILTER_CONSTRAINTS
+    timings = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        apply_constraints(catalog, constraints)
+        timings.append(time.perf_counter() - start)
+    # The minimum is the least disturbed by other processes
+    return min(timings)
+
+
+def main():
+    SIZES = []
+    TIMINGS = []
+    print("{:>10} {:>12} {:>14}".format("rows", "time [ms]", "ns per row"))
+    for n_rows in CATALOG_SIZES:
+        elapsed = time_filter(synthetic_catalog(n_rows))
+        SIZES.append(n_rows)
+        TIMINGS.append(elapsed)
+        print("{:>10} {:>12.3f} {:>14.2f}".format(n_rows, elapsed*1e3, elapsed/n_rows*1e9))
+    # A slope of ~1 in log-log space means the filter scales linearly with the catalog size
+    # The smallest catalog is left out of the fit as it is dominated by fixed overhead
+    slope = np.polyfit(np.log10(SIZES[1:]), np.log10(TIMINGS[1:]), 1)[0]
+    print("Scaling exponent (log-log slope): {:.2f}".format(slope))
+
+
+if __name__ == "__main__":
+    main()
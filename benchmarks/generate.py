@@ -0,0 +1,188 @@
+# Synthetic input files for the benchmarks
+# Writes measurement tables (.tbl) like AstroImageJ exports them, Siril .dat files and catalogs with the layout of
+# CATALOGF_edited_final.CSV, for any number of rows. The light curves are those of an eclipsing binary observed
+# through changing airmass and transparency: frames follow each other at the exposure time plus readout, with gaps
+# during the day and random gaps from clouds, and photon and sky noise on every measurement.
+# Run from the repository root with: python -m benchmarks.generate --rows 100000 --output [DIRECTORY]
+
+import argparse
+import os
+import numpy as np
+import pandas as pd
+from catalog_cache import CATALOG_FILE
+
+# The first frame, in J.D.-2400000 (autumn 2023, when the real observations were made)
+START_DATE = 60180.3
+EXPTIME = 40.0
+READOUT_TIME = 5.0
+# Part of every day (in days) that can be observed
+NIGHT_LENGTH = 8/24
+# Probability that a frame is followed by a gap (clouds, refocusing, ...) and the mean length of a gap in days
+GAP_PROBABILITY = 0.002
+GAP_LENGTH = 20/1440
+CLOUD_PROBABILITY = 0.005
+# The eclipsing binary: period and epoch in days, depth of the primary and secondary eclipse in mag
+# and the duration of an eclipse as a fraction of the period
+PERIOD = 0.278316
+EPOCH = 60180.41
+PRIMARY_DEPTH = 0.75
+SECONDARY_DEPTH = 0.55
+ECLIPSE_WIDTH = 0.035
+EXTINCTION = 0.25
+N_SKY_PIXELS = 3822
+SATURATION = 65535
+# Rows generated and written at once, so writing 10^7 rows doesn't need all of them in memory
+CHUNK_SIZE = 10**5
+APERTURE_COLUMNS = ["Source-Sky_{}", "Source_SNR_{}", "Peak_{}", "Sky/Pixel_{}", "N_Sky_Pixels_{}"]
+
+
+def frame_times(n_rows, exptime=EXPTIME, seed=0):
+    # J.D.-2400000 of every frame
+    rng = np.random.default_rng(seed)
+    cadence = (exptime + READOUT_TIME)/86400
+    STEPS = cadence*(1 + 0.02*rng.standard_normal(n_rows))
+    GAPS = rng.random(n_rows) < GAP_PROBABILITY
+    STEPS[GAPS] += rng.exponential(GAP_LENGTH, np.count_nonzero(GAPS))
+    # The night ends after a fixed number of frames, the next one starts a day later
+    frames_per_night = max(int(NIGHT_LENGTH/cadence), 1)
+    STEPS[frames_per_night::frames_per_night] += 1 - NIGHT_LENGTH
+    STEPS[0] = 0
+    return START_DATE + np.cumsum(STEPS)
+
+
+def eclipse_magnitudes(TIMES, period=PERIOD, epoch=EPOCH):
+    # Change in magnitude of the binary, a gaussian dip at phase 0 (primary) and 0.5 (secondary)
+    PHASES = ((TIMES - epoch)/period) % 1
+    PRIMARY = np.minimum(PHASES, 1 - PHASES)
+    SECONDARY = np.abs(PHASES - 0.5)
+    return PRIMARY_DEPTH*np.exp(-0.5*(PRIMARY/ECLIPSE_WIDTH)**2) + SECONDARY_DEPTH*np.exp(-0.5*(SECONDARY/ECLIPSE_WIDTH)**2)
+
+
+def airmasses(TIMES):
+    # The target rises during the first half of the night and sets during the second half
+    NIGHT_FRACTIONS = np.clip((TIMES - START_DATE) % 1/NIGHT_LENGTH, 0, 1)
+    ALTITUDES = np.radians(25 + 55*np.sin(np.pi*NIGHT_FRACTIONS))
+    return 1/np.sin(ALTITUDES)
+
+
+def aperture_measurements(FLUX, TRANSPARENCY, SKY_LEVEL, exptime, rng):
+    # Source-Sky, SNR, peak, sky per pixel and number of sky pixels for stars of the given flux (ADU/s)
+    # The sky per pixel is the mean over the sky annulus, so its noise is that of one pixel over sqrt(N_SKY_PIXELS)
+    SKY_PER_PIXEL = SKY_LEVEL + np.sqrt(SKY_LEVEL/N_SKY_PIXELS)*rng.standard_normal(len(FLUX))
+    BACKGROUND = SKY_PER_PIXEL*N_SKY_PIXELS
+    SIGNAL = FLUX*TRANSPARENCY*exptime
+    NOISE = np.sqrt(SIGNAL + 2*BACKGROUND)
+    # The readers subtract Sky/Pixel*N_Sky_Pixels from Source-Sky, so the background is included to get the flux back
+    SOURCE_COUNTS = SIGNAL + BACKGROUND + NOISE*rng.standard_normal(len(FLUX))
+    # About 1/120 of the counts fall on the brightest pixel
+    PEAK = np.minimum(SIGNAL/120, SATURATION)
+    return SOURCE_COUNTS, SIGNAL/NOISE, np.round(PEAK), SKY_PER_PIXEL, np.full(len(FLUX), N_SKY_PIXELS)
+
+
+def tbl_chunk(TIMES, first_frame, n_comparisons, exptime, rng):
+    n = len(TIMES)
+    AIRMASS = airmasses(TIMES)
+    # Extinction and thin clouds dim all the stars of a frame by the same factor
+    TRANSPARENCY = 10**(-0.4*EXTINCTION*AIRMASS)*np.clip(1 - np.abs(0.03*rng.standard_normal(n)), 0.5, 1)
+    # Now and then a thicker cloud, which the SNR shows
+    CLOUDS = rng.random(n) < CLOUD_PROBABILITY
+    TRANSPARENCY[CLOUDS] *= rng.uniform(0.2, 0.6, np.count_nonzero(CLOUDS))
+    # The sky gets brighter towards the horizon
+    SKY_LEVEL = 5 + 8*AIRMASS
+    columns = {
+        "Label": ["r_pp_light_{:05d}.fits".format(i) for i in range(first_frame + 1, first_frame + n + 1)],
+        "Saturated": np.zeros(n, dtype=int),
+        "J.D.-2400000": TIMES,
+        "JD_UTC": TIMES + 2400000,
+        "JD_SOBS": np.full(n, np.nan),
+        "HJD_UTC": np.full(n, np.nan),
+        "BJD_TDB": np.zeros(n, dtype=int),
+        "AIRMASS": AIRMASS,
+        "ALT_OBJ": np.full(n, np.nan),
+        "CCD-TEMP": np.round(-10.3 + 0.1*rng.standard_normal(n), 1),
+        "EXPTIME": np.full(n, exptime),
+        "RAOBJ2K": np.full(n, np.nan),
+        "DECOBJ2K": np.full(n, np.nan),
+    }
+    # The target (T1) is the binary, the comparison stars (C2, C3, ...) are constant and between 0.2 and 2.2 times as bright,
+    # the brightest one saturates when the transparency is best
+    FLUXES = [100000*10**(-0.4*eclipse_magnitudes(TIMES))] + [np.full(n, 100000*factor) for factor in np.geomspace(0.2, 2.2, n_comparisons)]
+    for i, FLUX in enumerate(FLUXES):
+        aperture = "T1" if i == 0 else "C{}".format(i + 1)
+        for column, VALUES in zip(APERTURE_COLUMNS, aperture_measurements(FLUX, TRANSPARENCY, SKY_LEVEL, exptime, rng)):
+            columns[column.format(aperture)] = VALUES
+        # A frame is flagged if any of its apertures reached the saturation level
+        columns["Saturated"] |= columns["Peak_{}".format(aperture)] >= SATURATION
+    return pd.DataFrame(columns)
+
+
+def write_tbl(file_path, n_rows, n_comparisons=4, exptime=EXPTIME, seed=0):
+    rng = np.random.default_rng(seed)
+    TIMES = frame_times(n_rows, exptime, seed)
+    with open(file_path, "w", newline="") as file:
+        for start in range(0, n_rows, CHUNK_SIZE):
+            chunk = tbl_chunk(TIMES[start:start + CHUNK_SIZE], start, n_comparisons, exptime, rng)
+            chunk.to_csv(file, sep="\t", index=False, header=start == 0, na_rep="NaN", lineterminator="\n")
+    return file_path
+
+
+def write_siril_dat(file_path, n_rows, exptime=EXPTIME, seed=0):
+    # Magnitude of the binary relative to the comparison stars, the extinction cancels out
+    rng = np.random.default_rng(seed)
+    TIMES = frame_times(n_rows, exptime, seed)
+    with open(file_path, "w") as file:
+        file.write("# JD_UT V-C err\n")
+        for start in range(0, n_rows, CHUNK_SIZE):
+            CHUNK_TIMES = TIMES[start:start + CHUNK_SIZE]
+            ERRORS = 0.003*(1 + 0.3*rng.random(len(CHUNK_TIMES)))
+            RELMAGS = -0.45 + eclipse_magnitudes(CHUNK_TIMES) + ERRORS*rng.standard_normal(len(CHUNK_TIMES))
+            np.savetxt(file, np.column_stack((CHUNK_TIMES + 2400000, RELMAGS, ERRORS)), fmt="%.6f")
+    return file_path
+
+
+def write_catalog(file_path, n_rows, source=CATALOG_FILE, seed=0):
+    # Rows of the real catalog drawn with replacement, with new coordinates, periods and brightnesses,
+    # so the text columns and placeholder values stay as realistic as the real ones
+    rng = np.random.default_rng(seed)
+    with open(source, encoding="UTF-8-sig") as catalog:
+        catalog_df = pd.read_csv(catalog, dtype=str, keep_default_na=False)
+    with open(file_path, "w", newline="") as file:
+        for start in range(0, n_rows, CHUNK_SIZE):
+            n = min(CHUNK_SIZE, n_rows - start)
+            chunk = catalog_df.iloc[rng.integers(0, len(catalog_df), n)].reset_index(drop=True)
+            DECLINATIONS = np.degrees(np.arcsin(rng.uniform(-1, 1, n)))
+            chunk["RAh"] = rng.integers(0, 24, n)
+            chunk["RAm"] = rng.integers(0, 60, n)
+            chunk["RAs"] = np.round(rng.uniform(0, 60, n), 1)
+            chunk["DE-"] = np.where(DECLINATIONS < 0, "-", "+")
+            chunk["DEd"] = np.abs(DECLINATIONS).astype(int)
+            chunk["DEm"] = rng.integers(0, 60, n)
+            chunk["DEs"] = rng.integers(0, 60, n)
+            # Unknown periods (0) stay unknown
+            PERIODS = chunk["Period [d]"].astype(float).to_numpy()
+            chunk["Period [d]"] = np.where(PERIODS > 0, PERIODS*rng.lognormal(0, 0.1, n), 0)
+            MIN_I = chunk["MinI"].astype(float).to_numpy()
+            chunk["MinI"] = np.round(MIN_I + rng.normal(0, 0.5, n), 2)
+            chunk.to_csv(file, index=False, header=start == 0, lineterminator="\n")
+    return file_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write synthetic light curves and catalogs for the benchmarks")
+    parser.add_argument("--rows", type=int, default=10**5, help="rows of every file")
+    parser.add_argument("--output", default=".", help="directory the files are written to")
+    parser.add_argument("--comparisons", type=int, default=4, help="comparison stars in the .tbl file")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    os.makedirs(args.output, exist_ok=True)
+    for write, file_name in ((write_tbl, "synthetic_{}.tbl"), (write_siril_dat, "synthetic_{}.dat"), (write_catalog, "catalog_{}.csv")):
+        file_path = os.path.join(args.output, file_name.format(args.rows))
+        if write is write_tbl:
+            write(file_path, args.rows, args.comparisons, seed=args.seed)
+        else:
+            write(file_path, args.rows, seed=args.seed)
+        print("Wrote {} ({:.1f} MB)".format(file_path, os.path.getsize(file_path)/1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+# Benchmarks for every stage of the reduction, on synthetic files of growing size (see generate.py)
+# Every stage is timed (the best of a few repeats, as that's the least disturbed by other processes) and then run once
+# more under tracemalloc to measure the peak memory it allocates. The results are written as JSON together with the
+# commit they were measured on, so two runs can be compared with --compare to find regressions.
+# Run from the repository root with: python -m benchmarks.run [--max-rows 1000000] [--compare OLD.json]
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+from benchmarks import generate
+import calibration
+import catalog_cache
+from catalog_filter import filter_catalog
+from ensemble import comparison_columns, comparison_matrices
+from get_candidates import EXCLUSION_CONSTRAINTS, FILTER_CONSTRAINTS, add_coordinate_columns
+from plot_binary_astroimagej import adjust_t1_source_counts
+import quality
+import rendering
+from rolling import rolling_mean, rolling_median
+from siril_reader import read_siril
+from tbl_reader import load_lightcurve
+from time_correction import corrected_times
+
+# 10^7 rows need several GB of disk for the input files, so they are only benchmarked with --max-rows 10000000
+ROW_COUNTS = [10**3, 10**4, 10**5, 10**6, 10**7]
+DEFAULT_MAX_ROWS = 10**6
+REPEATS = 3
+RESULTS_DIR = os.path.join("benchmarks", "results")
+WINDOW_SIZE = 20
+# A low resolution keeps the plotting benchmark about the drawing and not about compressing the png
+PLOT_DPI = 100
+# Coordinates of the synthetic target for the time correction (RS Vul), in radians
+TARGET_COORDINATES = (5.0513, 0.3917)
+# A ratio to the old timing above this is reported as a regression by --compare
+REGRESSION_THRESHOLD = 1.2
+
+
+def input_files(data_dir, n_rows):
+    # Generates the input files of a size unless they already exist in data_dir
+    paths = {}
+    for kind, file_name, write in (("tbl", "synthetic_{}.tbl", generate.write_tbl), ("dat", "synthetic_{}.dat", generate.write_siril_dat), ("catalog", "catalog_{}.csv", generate.write_catalog)):
+        paths[kind] = os.path.join(data_dir, file_name.format(n_rows))
+        if not os.path.isfile(paths[kind]):
+            write(paths[kind], n_rows)
+    return paths
+
+
+def reduced_arrays(tbl_path):
+    # The inputs of the stages after the flux, computed once outside of the timings
+    apertures, count_columns, snr_columns = comparison_columns(tbl_path)
+    lightcurve = load_lightcurve(tbl_path, aperture="T1", extra_columns=count_columns + snr_columns)
+    COMPARISON_COUNTS, COMPARISON_SNR = comparison_matrices(lightcurve.columns, apertures)
+    FLUX = lightcurve.adjusted_flux(adjust_t1_source_counts(lightcurve.source_counts, COMPARISON_COUNTS, COMPARISON_SNR))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        INSTRUMENTAL = -2.5*np.log10(FLUX)
+    return lightcurve, apertures, INSTRUMENTAL
+
+
+def stages(paths, work_dir):
+    # (name, function) of every benchmarked stage, the functions only do the work that is timed
+    cache_dir = os.path.join(work_dir, "catalog_cache")
+    catalog_cache.compile_catalog(paths["catalog"], cache_dir)
+    catalog_df = catalog_cache.load_catalog(source=paths["catalog"], cache_dir=cache_dir)
+    lightcurve, apertures, INSTRUMENTAL = reduced_arrays(paths["tbl"])
+    extra_columns = list(lightcurve.columns)
+    zero_points = {"zero_point": 17.9, "slope": 1.0}
+    MAGS = calibration.apply_calibration(INSTRUMENTAL, zero_points)
+    # Reference stars for the fit: the synthetic magnitudes with a known zero point and some scatter
+    rng = np.random.default_rng(0)
+    REFERENCE_MAGS = MAGS + rng.normal(0, 0.02, len(MAGS))
+    WEIGHTS = np.full(len(MAGS), 1/0.02**2)
+    FINITE = np.isfinite(INSTRUMENTAL)
+    quality_values = quality.read_quality_columns(paths["tbl"])
+
+    def flux():
+        COMPARISON_COUNTS, COMPARISON_SNR = comparison_matrices(lightcurve.columns, apertures)
+        return lightcurve.adjusted_flux(adjust_t1_source_counts(lightcurve.source_counts, COMPARISON_COUNTS, COMPARISON_SNR))
+
+    def catalog_filter():
+        return filter_catalog(add_coordinate_columns(catalog_df), EXCLUSION_CONSTRAINTS + FILTER_CONSTRAINTS)
+
+    def calibrate():
+        calibration.weighted_fit(INSTRUMENTAL[FINITE], REFERENCE_MAGS[FINITE], WEIGHTS[FINITE])
+        return calibration.apply_calibration(INSTRUMENTAL, zero_points)
+
+    def plot():
+        spec = rendering.FigureSpec(
+            path=os.path.join(work_dir, "lightcurve"), title="Benchmark", x_label="Julian Date -2400000", y_label="mag",
+            X=lightcurve.julian_dates, Y=MAGS, SMOOTHED=rolling_mean(MAGS, WINDOW_SIZE), invert_y=True,
+        )
+        return rendering.render(spec, dpi=PLOT_DPI)
+
+    return [
+        ("catalog_compile", lambda: catalog_cache.compile_catalog(paths["catalog"], cache_dir)),
+        ("catalog_load", lambda: catalog_cache.load_catalog(source=paths["catalog"], cache_dir=cache_dir)),
+        ("catalog_filter", catalog_filter),
+        ("tbl_ingest", lambda: load_lightcurve(paths["tbl"], aperture="T1", extra_columns=extra_columns)),
+        ("siril_ingest", lambda: read_siril(paths["dat"])),
+        ("flux", flux),
+        ("time_correction", lambda: corrected_times(lightcurve.julian_dates, *TARGET_COORDINATES)),
+        ("quality", lambda: quality.quality_flags(quality_values, MAGS)),
+        ("rolling_mean", lambda: rolling_mean(MAGS, WINDOW_SIZE)),
+        ("rolling_median", lambda: rolling_median(MAGS, WINDOW_SIZE)),
+        ("calibration", calibrate),
+        ("plot", plot),
+    ]
+
+
+def measure(function, repeats=REPEATS):
+    # Best time of the repeats in seconds and the peak memory of one more run in bytes
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        function()
+        _, peak_bytes = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return min(timings), peak_bytes
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run_benchmarks(row_counts, data_dir, selected=None, repeats=REPEATS):
+    results = []
+    print("{:<16} {:>10} {:>12} {:>14} {:>12}".format("stage", "rows", "time [ms]", "ns per row", "peak [MB]"))
+    for n_rows in row_counts:
+        paths = input_files(data_dir, n_rows)
+        with tempfile.TemporaryDirectory() as work_dir:
+            for stage, function in stages(paths, work_dir):
+                if selected and stage not in selected:
+                    continue
+                seconds, peak_bytes = measure(function, repeats)
+                results.append({"stage": stage, "rows": n_rows, "seconds": seconds, "peak_bytes": peak_bytes})
+                print("{:<16} {:>10} {:>12.3f} {:>14.2f} {:>12.1f}".format(stage, n_rows, seconds*1e3, seconds/n_rows*1e9, peak_bytes/1e6))
+    return {
+        "commit": git_commit(),
+        "date": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "machine": platform.platform(),
+        "repeats": repeats,
+        "results": results,
+    }
+
+
+def compare(old, new, threshold=REGRESSION_THRESHOLD):
+    # Print the ratio of every timing and peak memory to the one in the old results, returns the regressed stages
+    previous = {(result["stage"], result["rows"]): result for result in old["results"]}
+    regressions = []
+    print("Compared to commit {}:".format(old.get("commit")))
+    print("{:<16} {:>10} {:>12} {:>12}".format("stage", "rows", "time ratio", "peak ratio"))
+    for result in new["results"]:
+        before = previous.get((result["stage"], result["rows"]))
+        if before is None:
+            continue
+        time_ratio = result["seconds"]/before["seconds"]
+        peak_ratio = result["peak_bytes"]/before["peak_bytes"] if before["peak_bytes"] else float("nan")
+        regressed = time_ratio > threshold or peak_ratio > threshold
+        if regressed:
+            regressions.append((result["stage"], result["rows"]))
+        print("{:<16} {:>10} {:>12.2f} {:>12.2f}{}".format(result["stage"], result["rows"], time_ratio, peak_ratio, "  <-" if regressed else ""))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark every stage of the reduction on synthetic data")
+    parser.add_argument("--max-rows", type=int, default=DEFAULT_MAX_ROWS, help="largest input size (up to 10^7)")
+    parser.add_argument("--stages", nargs="*", help="only run these stages")
+    parser.add_argument("--repeats", type=int, default=REPEATS)
+    parser.add_argument("--data-dir", help="keep the generated input files here and reuse them in later runs")
+    parser.add_argument("--output", help="JSON file for the results (default: {}/[COMMIT].json)".format(RESULTS_DIR))
+    parser.add_argument("--compare", help="JSON file of an earlier run to compare the results to")
+    args = parser.parse_args()
+
+    row_counts = [n_rows for n_rows in ROW_COUNTS if n_rows <= args.max_rows]
+    if args.data_dir:
+        os.makedirs(args.data_dir, exist_ok=True)
+        report = run_benchmarks(row_counts, args.data_dir, args.stages, args.repeats)
+    else:
+        with tempfile.TemporaryDirectory() as data_dir:
+            report = run_benchmarks(row_counts, data_dir, args.stages, args.repeats)
+
+    output = args.output or os.path.join(RESULTS_DIR, "{}.json".format(report["commit"]))
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as file:
+        json.dump(report, file, indent=1)
+    print("Results written to {}".format(output))
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare(json.load(file), report)
+        print("{} regressions above {:.0%}".format(len(regressions), REGRESSION_THRESHOLD - 1))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+# Startup time of the commands of cli.py
+# Every command is started in a fresh interpreter that imports cli.py and the modules the command needs before it
+# starts working (cli.COMMAND_MODULES), which is the time a user waits before anything happens. The best of a few
+# runs is taken, and the heavy modules (pandas, scipy, matplotlib) that got loaded are listed. The commands that
+# don't draw figures should start well within STARTUP_LIMIT. The total time of a typical run of every command
+# (with the caches warm) is measured as well, for comparison with the interpreter starting and importing numpy.
+# Run from the repository root with: python -m benchmarks.startup [--repeats 10]
+
+import argparse
+import json
+import subprocess
+import sys
+import tempfile
+import time
+import cli
+
+REPEATS = 10
+STARTUP_LIMIT = 0.2
+PLOTTING_COMMANDS = {"plot", "batch"}
+BINARY_TABLE = "lightcurves/binary_stars/RSVulObs1.tbl"
+# Imports the modules of a command and prints the heavy modules that were loaded
+STARTUP_SCRIPT = "import json, sys, cli; cli.import_command({!r}); print(json.dumps([name for name in cli.HEAVY_MODULES if name in sys.modules]))"
+
+
+def best_time(command, repeats=REPEATS):
+    # Best wall time of running a command in a new process, and its output of the last run
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+        timings.append(time.perf_counter() - start)
+    return min(timings), output
+
+
+def typical_runs(work_dir):
+    # (command, arguments) of a run of every command that doesn't take long by itself
+    return [
+        ("catalog filter", ["catalog", "filter", "--output", "{}/candidates.csv".format(work_dir)]),
+        ("reduce", ["reduce", BINARY_TABLE]),
+        ("calibrate", ["calibrate", "--source", "astroimagej", "--output", "{}/calibration.json".format(work_dir)]),
+        ("plot", ["--figures", work_dir, "plot", BINARY_TABLE, "--dpi", "100"]),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure how long the commands of cli.py take to start")
+    parser.add_argument("--repeats", type=int, default=REPEATS)
+    args = parser.parse_args()
+
+    baseline, _ = best_time([sys.executable, "-c", "pass"], args.repeats)
+    numpy_baseline, _ = best_time([sys.executable, "-c", "import numpy"], args.repeats)
+    print("Interpreter: {:.0f} ms, with numpy: {:.0f} ms".format(baseline*1e3, numpy_baseline*1e3))
+
+    print("{:<16} {:>14} {:<28} {}".format("command", "startup [ms]", "heavy modules", ""))
+    slow = []
+    for command in cli.COMMAND_MODULES:
+        seconds, output = best_time([sys.executable, "-c", STARTUP_SCRIPT.format(command)], args.repeats)
+        heavy_modules = json.loads(output)
+        plotting = command in PLOTTING_COMMANDS
+        if not plotting and (seconds > STARTUP_LIMIT or heavy_modules):
+            slow.append(command)
+        verdict = "(plots)" if plotting else "ok" if command not in slow else "SLOW"
+        print("{:<16} {:>14.0f} {:<28} {}".format(command, seconds*1e3, ", ".join(heavy_modules) or "-", verdict))
+
+    print("{:<16} {:>14}".format("typical run", "total [ms]"))
+    with tempfile.TemporaryDirectory() as work_dir:
+        for command, arguments in typical_runs(work_dir):
+            # A first run fills the caches
+            subprocess.run([sys.executable, "cli.py"] + arguments, capture_output=True, check=True)
+            seconds, _ = best_time([sys.executable, "cli.py"] + arguments, max(1, args.repeats//2))
+            print("{:<16} {:>14.0f}".format(command, seconds*1e3))
+
+    if slow:
+        print("Commands that start slower than {:.0f} ms or load heavy modules: {}".format(STARTUP_LIMIT*1e3, ", ".join(slow)))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
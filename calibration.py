@@ -0,0 +1,279 @@
+import argparse
+import glob
+import json
+import os
+import re
+import numpy as np
+from designations import FILE_SUFFIX_REGEX, FILTER_LETTERS
+from ensemble import robust_std
+import instrumentation
+import paths
+from siril_reader import read_siril
+from tbl_reader import load_lightcurve
+
+# Photometric calibration from the reference stars
+# Every reference star was observed through B, V and R, its catalog magnitude is known. The instrumental magnitude
+# of a sequence (-2.5*log10(flux) for AstroImageJ tables, the relative magnitude for Siril exports) is related to the
+# catalog magnitude by MAG = ZERO_POINT + SLOPE*INSTRUMENTAL. The zero point is fitted per filter and per night
+# with a closed-form weighted least squares fit, the uncertainties come from a bootstrap over the reference stars.
+# The results are kept in a cache file that the light curve scripts look up instead of using hard-coded constants.
+# The cache remembers the mtime and size of every reference file and is rebuilt automatically when one of them changes.
+
+REFERENCE_DIR = paths.lightcurve_path("ref_stars")
+CALIBRATION_FILE = os.path.join(REFERENCE_DIR, "calibration.json")
+CALIBRATION_VERSION = 1
+# The directory of every kind of reference measurement and the pattern of its files
+# (the Siril directories also hold the per-comparison .dat exports and their .dat.csv copies, which aren't used)
+SOURCES = {
+    "astroimagej": "*.tbl",
+    "auto_aperture": "*[{}].csv".format(FILTER_LETTERS),
+    "fixed_aperture": "*[{}].csv".format(FILTER_LETTERS),
+}
+# The relative magnitudes Siril computes don't scale 1:1 with the catalog magnitudes (the brightest stars are
+# close to saturation), so for them the slope is fitted as well. For the fluxes the slope is fixed to 1.
+FREE_SLOPE = {"astroimagej": False, "auto_aperture": True, "fixed_aperture": True}
+# Catalog magnitudes of the reference stars per filter
+REFERENCE_MAGNITUDES = {
+    "36Persei": {"B": 5.73, "V": 5.32, "R": 4.91},
+    "alfCephei": {"B": 2.68, "V": 2.46, "R": 2.22},
+    "alfLacertae": {"B": 3.78, "V": 3.77, "R": 3.77},
+    "etaPersei": {"B": 5.48, "V": 3.79, "R": 2.56},
+    "gamDraconis": {"B": 3.76, "V": 2.23, "R": 1.08},
+    "tauDraconis": {"B": 5.7, "V": 4.45, "R": 3.55},
+}
+# The catalog magnitudes are given to two decimals
+CATALOG_MAGNITUDE_ERROR = 0.01
+BOOTSTRAP_SAMPLES = 1000
+# Key for fits over all filters or all nights of the season
+ALL = "all"
+# Converts a relative flux error to a magnitude error (2.5/ln(10))
+FLUX_TO_MAG_ERROR = 1.0857
+
+
+def night_of(julian_date):
+    # The julian date changes at noon UT, so all the frames of a night in Europe have the same integer part
+    # Accepts both full julian dates and J.D.-2400000 as in the AstroImageJ tables
+    julian_date = float(julian_date)
+    if julian_date < 2400000:
+        julian_date += 2400000
+    return str(int(np.floor(julian_date)))
+
+
+def split_reference_name(file_name):
+    # e.g. "alfCepheiV" -> ("alfCephei", "V"), "36PerseiB3ref.dat" -> ("36Persei", "B"), None for other files
+    stem = FILE_SUFFIX_REGEX.sub("", re.split(r"[\\/]", file_name)[-1].split(".")[0])
+    if len(stem) > 1 and stem[-1] in FILTER_LETTERS:
+        return stem[:-1], stem[-1]
+    return None
+
+
+def filter_of(file_name):
+    parts = split_reference_name(file_name)
+    return parts[1] if parts else None
+
+
+def instrumental_magnitude(file_path):
+    # Median instrumental magnitude of a sequence, its uncertainty and the night it was taken in
+    if file_path.endswith(".tbl"):
+        lightcurve = load_lightcurve(file_path)
+        FLUX_PER_SECOND = lightcurve.flux
+        flux_median = np.median(FLUX_PER_SECOND)
+        error = FLUX_TO_MAG_ERROR*robust_std(FLUX_PER_SECOND, axis=None)/flux_median/np.sqrt(len(FLUX_PER_SECOND))
+        return -2.5*np.log10(flux_median), error, night_of(lightcurve.julian_dates[0])
+    lightcurve = read_siril(file_path)
+    RELMAGS = lightcurve.relmags
+    return np.median(RELMAGS), robust_std(RELMAGS, axis=None)/np.sqrt(len(RELMAGS)), night_of(lightcurve.julian_dates[0])
+
+
+def reference_files(source):
+    return sorted(glob.glob(os.path.join(REFERENCE_DIR, source, SOURCES[source])))
+
+
+def reference_measurements(source):
+    # One entry per reference sequence with a known catalog magnitude
+    STARS, FILTERS, NIGHTS, INSTRUMENTAL, ERRORS, MAGS = [], [], [], [], [], []
+    for file_path in reference_files(source):
+        parts = split_reference_name(file_path)
+        if parts is None or parts[0] not in REFERENCE_MAGNITUDES:
+            continue
+        star, filter_letter = parts
+        instrumental, error, night = instrumental_magnitude(file_path)
+        STARS.append(star)
+        FILTERS.append(filter_letter)
+        NIGHTS.append(night)
+        INSTRUMENTAL.append(instrumental)
+        ERRORS.append(error)
+        MAGS.append(REFERENCE_MAGNITUDES[star][filter_letter])
+    return {
+        "stars": np.array(STARS),
+        "filters": np.array(FILTERS),
+        "nights": np.array(NIGHTS),
+        "instrumental": np.array(INSTRUMENTAL, dtype=float),
+        "errors": np.array(ERRORS, dtype=float),
+        "mags": np.array(MAGS, dtype=float),
+    }
+
+
+def weighted_fit(INSTRUMENTAL, MAGS, WEIGHTS, slope=None):
+    # Closed-form weighted least squares for MAGS = ZERO_POINT + SLOPE*INSTRUMENTAL along the last axis
+    # With slope=None the slope is fitted too, otherwise only the zero point for the given slope
+    # Works on stacks of samples (e.g. all the bootstrap samples at once), fits that are degenerate give NaN
+    Sw = np.sum(WEIGHTS, axis=-1)
+    Sx = np.sum(WEIGHTS*INSTRUMENTAL, axis=-1)
+    Sy = np.sum(WEIGHTS*MAGS, axis=-1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        if slope is None:
+            Sxx = np.sum(WEIGHTS*INSTRUMENTAL**2, axis=-1)
+            Sxy = np.sum(WEIGHTS*INSTRUMENTAL*MAGS, axis=-1)
+            DETERMINANT = Sw*Sxx - Sx**2
+            SLOPES = np.where(np.abs(DETERMINANT) > 1e-12*np.abs(Sw*Sxx), (Sw*Sxy - Sx*Sy)/DETERMINANT, np.nan)
+        else:
+            SLOPES = np.full(np.shape(Sw), float(slope))
+        ZERO_POINTS = (Sy - SLOPES*Sx)/Sw
+    return ZERO_POINTS, SLOPES
+
+
+def bootstrap_fit(INSTRUMENTAL, MAGS, WEIGHTS, slope=None, n_samples=BOOTSTRAP_SAMPLES, seed=0):
+    # Resample the reference stars with replacement, all the samples are fitted in one call
+    rng = np.random.default_rng(seed)
+    INDICES = rng.integers(0, len(MAGS), size=(n_samples, len(MAGS)))
+    ZERO_POINTS, SLOPES = weighted_fit(INSTRUMENTAL[INDICES], MAGS[INDICES], WEIGHTS[INDICES], slope)
+    with np.errstate(invalid="ignore"):
+        zero_point_error = float(np.nanstd(ZERO_POINTS)) if np.isfinite(ZERO_POINTS).any() else float("nan")
+        slope_error = float(np.nanstd(SLOPES)) if slope is None and np.isfinite(SLOPES).any() else 0.0
+    return zero_point_error, slope_error
+
+
+def calibrate_group(measurements, SELECTED, slope=None):
+    INSTRUMENTAL = measurements["instrumental"][SELECTED]
+    MAGS = measurements["mags"][SELECTED]
+    WEIGHTS = 1/(measurements["errors"][SELECTED]**2 + CATALOG_MAGNITUDE_ERROR**2)
+    zero_point, fitted_slope = (float(value) for value in weighted_fit(INSTRUMENTAL, MAGS, WEIGHTS, slope))
+    zero_point_error, slope_error = bootstrap_fit(INSTRUMENTAL, MAGS, WEIGHTS, slope)
+    RESIDUALS = MAGS - (zero_point + fitted_slope*INSTRUMENTAL)
+    return {
+        "zero_point": zero_point,
+        "zero_point_error": zero_point_error,
+        "slope": fitted_slope,
+        "slope_error": slope_error,
+        "rms": float(np.sqrt(np.mean(RESIDUALS**2))),
+        "stars": sorted(set(measurements["stars"][SELECTED])),
+    }
+
+
+def calibration_key(filter_letter=None, night=None):
+    return "{}/{}".format(filter_letter or ALL, night or ALL)
+
+
+def calibrate(source="astroimagej", free_slope=None):
+    # Zero points for the whole season, per filter, and per filter and night
+    # A night only has a few reference stars, so the slope of a night is the one of its filter over the whole season
+    measurements = reference_measurements(source)
+    free_slope = FREE_SLOPE[source] if free_slope is None else free_slope
+    zero_points = {}
+    if len(measurements["mags"]) == 0:
+        return zero_points
+    FILTERS = measurements["filters"]
+    NIGHTS = measurements["nights"]
+    season = calibrate_group(measurements, np.ones(len(FILTERS), dtype=bool), None if free_slope else 1.0)
+    zero_points[calibration_key()] = season
+    for night in np.unique(NIGHTS):
+        zero_points[calibration_key(None, night)] = calibrate_group(measurements, NIGHTS == night, season["slope"])
+    for filter_letter in np.unique(FILTERS):
+        filter_season = calibrate_group(measurements, FILTERS == filter_letter, None if free_slope else 1.0)
+        zero_points[calibration_key(filter_letter)] = filter_season
+        for night in np.unique(NIGHTS[FILTERS == filter_letter]):
+            SELECTED = (FILTERS == filter_letter) & (NIGHTS == night)
+            zero_points[calibration_key(filter_letter, night)] = calibrate_group(measurements, SELECTED, filter_season["slope"])
+    return zero_points
+
+
+def source_signature(source):
+    # mtime and size of every reference file, the calibration is redone when any of them changes
+    return {os.path.basename(file_path): [os.stat(file_path).st_mtime_ns, os.stat(file_path).st_size] for file_path in reference_files(source)}
+
+
+def read_cache(calibration_file=CALIBRATION_FILE):
+    if not os.path.isfile(calibration_file):
+        return {"version": CALIBRATION_VERSION, "sources": {}}
+    with open(calibration_file) as file:
+        cache = json.load(file)
+    if cache.get("version") != CALIBRATION_VERSION:
+        return {"version": CALIBRATION_VERSION, "sources": {}}
+    return cache
+
+
+def write_cache(cache, calibration_file=CALIBRATION_FILE):
+    # Write to a temporary file first so an interrupted write doesn't leave a broken cache behind
+    # A light curve root without reference stars (see paths.py) doesn't have the directory yet
+    os.makedirs(os.path.dirname(calibration_file) or ".", exist_ok=True)
+    temporary_path = "{}.{}.tmp".format(calibration_file, os.getpid())
+    with open(temporary_path, "w") as file:
+        json.dump(cache, file, indent=2)
+    os.replace(temporary_path, calibration_file)
+
+
+@instrumentation.timed()
+def calibrate_all(sources=tuple(SOURCES), calibration_file=CALIBRATION_FILE):
+    # Recalibrate the whole season for every kind of reference measurement in one call and store the results
+    cache = read_cache(calibration_file)
+    for source in sources:
+        cache["sources"][source] = {"files": source_signature(source), "zero_points": calibrate(source)}
+    write_cache(cache, calibration_file)
+    return cache
+
+
+def load_calibration(source="astroimagej", calibration_file=CALIBRATION_FILE):
+    # The zero points of one source, recalibrated first if the reference files changed since the last calibration
+    cache = read_cache(calibration_file)
+    entry = cache["sources"].get(source)
+    if entry is None or entry["files"] != source_signature(source):
+        entry = calibrate_all((source,), calibration_file)["sources"][source]
+    return entry["zero_points"]
+
+
+def lookup(source="astroimagej", filter_letter=None, night=None, calibration_file=CALIBRATION_FILE):
+    # The most specific calibration that exists: filter and night, then the filter over the season,
+    # then all the filters of the night, and finally the whole season
+    zero_points = load_calibration(source, calibration_file)
+    for key in (calibration_key(filter_letter, night), calibration_key(filter_letter), calibration_key(None, night), calibration_key()):
+        if key in zero_points:
+            return zero_points[key]
+    raise KeyError("No calibration for {} in {}".format(source, calibration_file))
+
+
+def apply_calibration(INSTRUMENTAL, calibration):
+    return calibration["zero_point"] + calibration["slope"]*np.asarray(INSTRUMENTAL, dtype=float)
+
+
+def flux_to_magnitude(FLUX_PER_SECOND, filter_letter=None, night=None, source="astroimagej"):
+    INSTRUMENTAL = -2.5*np.log10(np.asarray(FLUX_PER_SECOND, dtype=float))
+    return apply_calibration(INSTRUMENTAL, lookup(source, filter_letter, night))
+
+
+def relmag_to_magnitude(RELMAGS, filter_letter=None, night=None, source="auto_aperture"):
+    return apply_calibration(RELMAGS, lookup(source, filter_letter, night))
+
+
+def print_calibration(source, zero_points):
+    print("========== Calibration ({}) ==========".format(source))
+    for key, calibration in zero_points.items():
+        print("{:>12}: ZP {:.3f} +- {:.3f}, slope {:.3f} +- {:.3f}, rms {:.3f}mag, {} stars".format(
+            key, calibration["zero_point"], calibration["zero_point_error"], calibration["slope"],
+            calibration["slope_error"], calibration["rms"], len(calibration["stars"])))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fit the photometric zero points of the season from the reference stars.")
+    parser.add_argument("--source", choices=list(SOURCES), action="append", help="Only calibrate these sources (default: all)")
+    parser.add_argument("--output", default=CALIBRATION_FILE, help="Calibration cache file")
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    instrumentation.configure(args)
+    cache = calibrate_all(tuple(args.source or SOURCES), args.output)
+    for source in args.source or SOURCES:
+        print_calibration(source, cache["sources"][source]["zero_points"])
+
+
+if __name__ == "__main__":
+    main()
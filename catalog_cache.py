@@ -0,0 +1,237 @@
+import csv
+import hashlib
+import json
+import os
+import numpy as np
+import instrumentation
+import paths
+
+# Binary columnar cache of the variable star catalog
+# Parsing the .csv file on every run is slow and leaves the padded text fields and the placeholder values to every script.
+# Instead, the catalog is compiled once into one .npy file per column:
+#  - text fields are stripped and stored as categoricals (integer codes + list of categories)
+#  - placeholder values are turned into proper missing values (NaN for numbers, code -1 for text)
+# The compiled columns are memory-mapped when loading, so only the columns that are actually used get read from disk.
+# The columns that cleaning changes are also kept as they were parsed (raw_file), so the filtered catalog can be
+# exported with the original values (export_rows writes the same file pandas' to_csv did before the cache).
+# The cache remembers the mtime, size and hash of the source file and is rebuilt automatically when the catalog changes.
+
+CATALOG_FILE = paths.CATALOG_FILE
+CACHE_DIR = ".catalog_cache"
+MANIFEST_FILE = "manifest.json"
+# Bump when the layout of the cache or the cleaning rules change, so old caches get rebuilt
+CACHE_VERSION = 2
+
+# Placeholder values the catalog uses for missing information, per column
+NUMERIC_SENTINELS = {
+    "MinII": 99.99,
+    "A2": 9.99,
+    "dA": 9.99,
+    # 0 is the placeholder for an unknown period
+    "Period [d]": 0,
+    "Log10.P [d]": -9.0,
+    "DI": 999,
+    "dI": 999,
+    "DII": 999,
+    "dII": 999,
+    "MinII-MinI": 999,
+    "DI [h]": 999,
+    "DII [h]": 999,
+}
+TEXT_SENTINELS = {"#", "-----", "======="}
+
+
+def file_digest(file_path):
+    sha256 = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def source_signature(source):
+    stat = os.stat(source)
+    return {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+
+
+def read_json(file_path, default=None):
+    # The content of a JSON file, default if it doesn't exist or can't be parsed
+    try:
+        with open(file_path) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return default
+
+
+def write_json(file_path, data, **options):
+    # Write to a temporary file first so an interrupted write never leaves a half written file behind
+    # The temporary file is named after the process, so several processes can write the same file at once
+    temporary_path = "{}.{}.tmp".format(file_path, os.getpid())
+    with open(temporary_path, "w") as file:
+        json.dump(data, file, **options)
+    os.replace(temporary_path, file_path)
+
+
+def read_manifest(cache_dir):
+    return read_json(os.path.join(cache_dir, MANIFEST_FILE))
+
+
+def write_manifest(cache_dir, manifest):
+    write_json(os.path.join(cache_dir, MANIFEST_FILE), manifest, indent=1)
+
+
+def encode_categorical(VALUES, MISSING):
+    # Integer codes into the sorted categories, -1 for the missing values
+    categories, codes = np.unique(VALUES[~MISSING], return_inverse=True)
+    CODES = np.full(len(VALUES), -1, dtype=np.int32)
+    CODES[~MISSING] = codes
+    return CODES, categories.tolist()
+
+
+def clean_text_column(values):
+    # Strip the padding and turn the placeholders into missing values, then encode as a categorical
+    STRIPPED = np.char.strip(np.asarray(values, dtype=str))
+    MISSING = np.isin(STRIPPED, list(TEXT_SENTINELS)) | (STRIPPED == "") | (STRIPPED == "nan")
+    return encode_categorical(STRIPPED, MISSING)
+
+
+def raw_text_column(values):
+    # The text as pandas parsed it (padding and placeholders included), only empty fields are missing
+    VALUES = np.asarray(values, dtype=object)
+    MISSING = np.array([not isinstance(value, str) for value in VALUES], dtype=bool)
+    return encode_categorical(np.where(MISSING, "", VALUES).astype(str), MISSING)
+
+
+def save_column(cache_dir, file_name, VALUES):
+    # Write to a temporary file first so a concurrent reader never maps a partially written column
+    file_path = os.path.join(cache_dir, file_name)
+    temporary_path = "{}.{}.tmp".format(file_path, os.getpid())
+    with open(temporary_path, "wb") as file:
+        np.save(file, VALUES)
+    os.replace(temporary_path, file_path)
+
+
+def clean_numeric_column(name, values):
+    VALUES = np.asarray(values)
+    if name in NUMERIC_SENTINELS:
+        VALUES = VALUES.astype(float)
+        VALUES[np.isclose(VALUES, NUMERIC_SENTINELS[name])] = np.nan
+    return VALUES
+
+
+@instrumentation.timed()
+def compile_catalog(source=CATALOG_FILE, cache_dir=CACHE_DIR):
+    # pandas is only needed to parse the .csv file, loading the compiled cache doesn't depend on it
+    import pandas as pd
+
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(source, encoding="UTF-8-sig") as catalog:
+        catalog_df = pd.read_csv(catalog)
+    instrumentation.count("rows", len(catalog_df))
+
+    columns = {}
+    for i, name in enumerate(catalog_df.columns):
+        file_name = "col_{:03d}.npy".format(i)
+        raw_file_name = "raw_{:03d}.npy".format(i)
+        RAW = catalog_df[name].to_numpy()
+        if pd.api.types.is_numeric_dtype(catalog_df[name]):
+            VALUES = clean_numeric_column(name, RAW)
+            columns[name] = {"file": file_name, "kind": "numeric"}
+            if name in NUMERIC_SENTINELS:
+                save_column(cache_dir, raw_file_name, RAW)
+                columns[name]["raw_file"] = raw_file_name
+        else:
+            VALUES, categories = clean_text_column(RAW)
+            RAW_CODES, raw_categories = raw_text_column(RAW)
+            columns[name] = {"file": file_name, "kind": "categorical", "categories": categories, "raw_file": raw_file_name, "raw_categories": raw_categories}
+            save_column(cache_dir, raw_file_name, RAW_CODES)
+        save_column(cache_dir, file_name, VALUES)
+
+    manifest = {
+        "version": CACHE_VERSION,
+        "source": os.path.abspath(source),
+        "sha256": file_digest(source),
+        "rows": len(catalog_df),
+        "order": list(catalog_df.columns),
+        "columns": columns,
+    }
+    manifest.update(source_signature(source))
+    write_manifest(cache_dir, manifest)
+    return manifest
+
+
+def ensure_cache(source=CATALOG_FILE, cache_dir=CACHE_DIR):
+    # Returns the manifest of an up to date cache, compiling the catalog first if necessary
+    manifest = read_manifest(cache_dir)
+    if manifest is None or manifest.get("version") != CACHE_VERSION or manifest.get("source") != os.path.abspath(source):
+        return compile_catalog(source, cache_dir)
+    signature = source_signature(source)
+    if manifest["mtime_ns"] == signature["mtime_ns"] and manifest["size"] == signature["size"]:
+        return manifest
+    # The file was touched, only rebuild if its contents actually changed
+    if manifest["size"] == signature["size"] and manifest["sha256"] == file_digest(source):
+        manifest.update(signature)
+        write_manifest(cache_dir, manifest)
+        return manifest
+    return compile_catalog(source, cache_dir)
+
+
+def load_columns(columns=None, source=CATALOG_FILE, cache_dir=CACHE_DIR, decode=True, raw=False, manifest=None):
+    # Returns a dict of numpy arrays for the requested columns (all columns if None)
+    # Numeric columns are read-only memory maps of the cache files
+    # Text columns are decoded into object arrays with None for missing values, unless decode is False,
+    # in which case the categorical codes are returned
+    # raw=True returns the values as they are in the .csv file (padded text, placeholders instead of missing values)
+    if manifest is None:
+        manifest = ensure_cache(source, cache_dir)
+    if columns is None:
+        columns = manifest["order"]
+    arrays = {}
+    for name in columns:
+        if name not in manifest["columns"]:
+            raise KeyError("Column {} is not part of the catalog".format(name))
+        info = manifest["columns"][name]
+        use_raw = raw and "raw_file" in info
+        VALUES = np.load(os.path.join(cache_dir, info["raw_file" if use_raw else "file"]), mmap_mode="r")
+        if info["kind"] == "categorical" and decode:
+            # Code -1 picks the trailing None
+            VALUES = np.array(info["raw_categories" if use_raw else "categories"] + [None], dtype=object)[VALUES]
+        arrays[name] = VALUES
+    return arrays
+
+
+def load_catalog(columns=None, source=CATALOG_FILE, cache_dir=CACHE_DIR):
+    # Same as load_columns, but as a pandas dataframe with categorical text columns
+    import pandas as pd
+
+    manifest = ensure_cache(source, cache_dir)
+    if columns is None:
+        columns = manifest["order"]
+    CODES = load_columns(columns, source, cache_dir, decode=False, manifest=manifest)
+    data = {}
+    for name in columns:
+        info = manifest["columns"][name]
+        if info["kind"] == "categorical":
+            data[name] = pd.Categorical.from_codes(np.asarray(CODES[name]), categories=info["categories"])
+        else:
+            data[name] = np.asarray(CODES[name])
+    return pd.DataFrame(data, columns=columns)
+
+
+def export_rows(ROWS, output_path, source=CATALOG_FILE, cache_dir=CACHE_DIR):
+    # Write the given rows of the catalog as a .csv file with their original values, as pandas' to_csv would
+    # (missing numbers as empty fields, floats with their shortest representation)
+    manifest = ensure_cache(source, cache_dir)
+    order = manifest["order"]
+    columns = load_columns(order, source, cache_dir, raw=True, manifest=manifest)
+    ROWS = np.asarray(ROWS, dtype=int)
+    selected = [[None if isinstance(value, float) and np.isnan(value) else value for value in np.asarray(columns[name])[ROWS].tolist()] for name in order]
+    with open(output_path, "w", newline="", encoding="UTF-8") as file:
+        writer = csv.writer(file, lineterminator="\n")
+        writer.writerow(order)
+        writer.writerows(zip(*selected))
+
+
+if __name__ == "__main__":
+    manifest = compile_catalog()
+    print("Compiled {} rows and {} columns into {}".format(manifest["rows"], len(manifest["columns"]), CACHE_DIR))
@@ -0,0 +1,59 @@
+import operator
+import numpy as np
+
+# Columnar filter engine for the variable star catalog
+# Instead of walking the catalog row by row, every constraint is evaluated on a whole column at once
+# and turned into a boolean mask. The masks are then combined, so filtering is a single linear pass per constraint.
+
+# A constraint is a tuple of (name, column, operator, value)
+# Several constraints can share a name (e.g. a lower and an upper declination bound), their rejections are counted together
+OPERATORS = {
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "==": operator.eq,
+    "!=": operator.ne,
+    "in": lambda column, values: np.isin(column, list(values)),
+    "not in": lambda column, values: ~np.isin(column, list(values)),
+}
+
+
+def evaluate_constraint(catalog, constraint):
+    # Returns the mask of all the rows that satisfy the constraint
+    # The catalog can be anything that returns an array-like for catalog[column] (a pandas dataframe or a dict of numpy arrays)
+    _, column, op, value = constraint
+    if op not in OPERATORS:
+        raise ValueError("Unknown operator {} in constraint on column {}".format(op, column))
+    # Comparisons involving NaN are always False, so rows with missing values never pass a constraint
+    return np.asarray(OPERATORS[op](np.asarray(catalog[column]), value), dtype=bool)
+
+
+def apply_constraints(catalog, constraints):
+    # Combine all the constraints into one mask of the rows that are kept
+    # Every rejected row is attributed to the first constraint it fails, in the order the constraints are given
+    KEEP = None
+    rejection_counts = {}
+    for constraint in constraints:
+        passed = evaluate_constraint(catalog, constraint)
+        if KEEP is None:
+            KEEP = np.ones(len(passed), dtype=bool)
+        name = constraint[0]
+        rejection_counts[name] = rejection_counts.get(name, 0) + int(np.count_nonzero(KEEP & ~passed))
+        KEEP &= passed
+    return KEEP, rejection_counts
+
+
+def filter_catalog(catalog_df, constraints):
+    # Convenience wrapper for pandas dataframes, returns the filtered dataframe together with the rejection counts
+    KEEP, rejection_counts = apply_constraints(catalog_df, constraints)
+    if KEEP is None:
+        return catalog_df, rejection_counts
+    return catalog_df[KEEP], rejection_counts
+
+
+def print_rejection_counts(rejection_counts, total_rows):
+    print("========== Catalog filter ==========")
+    for name, count in rejection_counts.items():
+        print("Removed {} entries due to constraint {}".format(count, name))
+    print("Kept {} of {} entries".format(total_rows - sum(rejection_counts.values()), total_rows))
@@ -0,0 +1,168 @@
+import argparse
+import importlib
+import os
+import sys
+
+# One command line for the reductions of the project
+#     python cli.py catalog filter [--output candidates.csv]
+#     python cli.py reduce lightcurves/binary_stars/RSVulObs1.tbl [...]
+#     python cli.py calibrate [--source astroimagej]
+#     python cli.py plot lightcurves/binary_stars/RSVulObs1.tbl [...]
+#     python cli.py batch [--workers N]
+# The options before the command move the light curves, the catalog and the figures (see paths.py).
+# Nothing but the standard library is imported before the command is known, every command imports the modules it
+# needs when it runs. pandas, scipy and matplotlib are only loaded by the commands that parse text files (and only if
+# the products aren't cached yet) or draw figures, so the other commands start in the time it takes to import numpy.
+# benchmarks/startup.py measures how long every command takes to start.
+
+# Option, environment variable (see paths.py) and help of the configurable paths
+PATH_OPTIONS = [
+    ("--lightcurves", "LIGHTCURVE_ROOT", "directory of the light curves (default: lightcurves)"),
+    ("--catalog", "LIGHTCURVE_CATALOG", "variable star catalog (default: CATALOGF_edited_final.CSV)"),
+    ("--figures", "LIGHTCURVE_FIGURES", "directory the figures are written to (default: ../Figures)"),
+]
+DEFAULT_CANDIDATES_FILE = "candidates.csv"
+# The modules every command imports before it starts working, benchmarks/startup.py times importing them
+COMMAND_MODULES = {
+    "catalog filter": ["numpy", "catalog_cache", "catalog_filter", "get_candidates", "sky_coords"],
+    "reduce": ["numpy", "plot_binary_astroimagej", "quality"],
+    "calibrate": ["calibration"],
+    "plot": ["batch", "paths"],
+    "batch": ["batch", "instrumentation"],
+}
+# Only the commands that draw figures may load these when they start
+HEAVY_MODULES = ["pandas", "scipy", "matplotlib"]
+
+
+def catalog_filter(args):
+    # The catalog is filtered on the memory-mapped columns of the catalog cache, without pandas
+    import numpy as np
+    import catalog_cache
+    from catalog_filter import apply_constraints, print_rejection_counts
+    from get_candidates import EXCLUSION_CONSTRAINTS, FILTER_CONSTRAINTS
+    from sky_coords import catalog_coordinates
+
+    columns = catalog_cache.load_columns()
+    RA_RAD, DEC_RAD = catalog_coordinates(columns)
+    catalog = dict(columns, **{"DE [deg]": np.degrees(DEC_RAD), "RA [h]": np.degrees(RA_RAD)/15})
+    KEEP, rejection_counts = apply_constraints(catalog, EXCLUSION_CONSTRAINTS + FILTER_CONSTRAINTS)
+    print_rejection_counts(rejection_counts, len(KEEP))
+
+    ROWS = np.flatnonzero(KEEP)
+    # Same file as get_candidates.py writes, with the values of the catalog file
+    catalog_cache.export_rows(ROWS, args.output)
+    print("{} candidates written to {}".format(len(ROWS), args.output))
+
+
+def reduce(args):
+    import numpy as np
+    import plot_binary_astroimagej
+    import quality
+
+    for file_path in args.files:
+        arrays = plot_binary_astroimagej.reduce_file(file_path)
+        GOOD = arrays["REJECTED_BY"] == 0
+        print("========== {} ==========".format(file_path))
+        quality.print_quality_report(quality.rejection_counts(arrays["REJECTED_BY"]), len(GOOD))
+        if np.any(GOOD):
+            plot_binary_astroimagej.print_stats(arrays["MAGS"][GOOD], arrays["SMOOTHED_MAGS"][GOOD])
+
+
+def calibrate(args):
+    import calibration
+
+    sources = tuple(args.source or calibration.SOURCES)
+    cache = calibration.calibrate_all(sources, args.output or calibration.CALIBRATION_FILE)
+    for source in sources:
+        calibration.print_calibration(source, cache["sources"][source]["zero_points"])
+
+
+def plot(args):
+    import batch
+    import paths
+
+    output_dir = args.output or batch.DEFAULT_OUTPUT_DIR
+    os.makedirs(output_dir, exist_ok=True)
+    for file_path in args.files:
+        kind = batch.classify(file_path)
+        if kind is None:
+            print("{}: not a light curve".format(file_path))
+            continue
+        stats = batch.process_file(file_path, kind, paths.LIGHTCURVE_ROOT, output_dir, args.dpi, args.format)
+        print("{}: {}".format(file_path, stats["figure"]))
+
+
+def run_batch(args):
+    import batch
+    import instrumentation
+
+    with instrumentation.stage("batch", root=batch.DEFAULT_ROOT):
+        summary = batch.run_batch(batch.DEFAULT_ROOT, args.output or batch.DEFAULT_OUTPUT_DIR, args.workers, args.dpi, args.format)
+    print("Reduced {} files, {} failed".format(len(summary["files"]), len(summary["errors"])))
+    for error in summary["errors"]:
+        print("{}: {}".format(error["file"], error["error"]))
+
+
+def import_command(command):
+    return [importlib.import_module(module) for module in COMMAND_MODULES[command]]
+
+
+def add_figure_arguments(parser):
+    # The defaults of rendering.py, which isn't imported just to build the parser
+    parser.add_argument("--output", help="directory the figures and statistics are written to (default: FIGURES/batch_results)")
+    parser.add_argument("--dpi", type=int, default=300)
+    parser.add_argument("--format", default="png", help="figure format, e.g. png, pdf or svg")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Reduce, calibrate and plot the light curves of the project")
+    for option, _, help_text in PATH_OPTIONS:
+        parser.add_argument(option, help=help_text)
+    parser.add_argument("--trace", metavar="FILE", help="write a trace of the stages to FILE (.jsonl for JSON lines, Chrome trace otherwise)")
+    parser.add_argument("--trace-memory", action="store_true", help="also measure the peak memory of every stage (slower)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    catalog_parser = commands.add_parser("catalog", help="query the variable star catalog")
+    catalog_commands = catalog_parser.add_subparsers(dest="catalog_command", required=True)
+    filter_parser = catalog_commands.add_parser("filter", help="select the candidates with the constraints of get_candidates.py")
+    filter_parser.add_argument("--output", default=DEFAULT_CANDIDATES_FILE)
+    filter_parser.set_defaults(function=catalog_filter, name="catalog filter")
+
+    reduce_parser = commands.add_parser("reduce", help="flux, magnitudes, quality flags and statistics of binary star tables")
+    reduce_parser.add_argument("files", nargs="+")
+    reduce_parser.set_defaults(function=reduce, name="reduce")
+
+    calibrate_parser = commands.add_parser("calibrate", help="fit the zero points from the reference stars")
+    calibrate_parser.add_argument("--source", choices=["astroimagej", "auto_aperture", "fixed_aperture"], action="append", help="only calibrate these sources (default: all)")
+    calibrate_parser.add_argument("--output", help="calibration cache file (default: LIGHTCURVES/ref_stars/calibration.json)")
+    calibrate_parser.set_defaults(function=calibrate, name="calibrate")
+
+    plot_parser = commands.add_parser("plot", help="reduce light curves and render their figures")
+    plot_parser.add_argument("files", nargs="+")
+    add_figure_arguments(plot_parser)
+    plot_parser.set_defaults(function=plot, name="plot")
+
+    batch_parser = commands.add_parser("batch", help="reduce and plot every light curve below the light curve directory")
+    batch_parser.add_argument("--workers", type=int, default=None, help="number of worker processes (default: number of cores, 0 runs everything in this process)")
+    add_figure_arguments(batch_parser)
+    batch_parser.set_defaults(function=run_batch, name="batch")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    # The paths are set before any of the modules that read them is imported, worker processes inherit them
+    for option, variable, _ in PATH_OPTIONS:
+        value = getattr(args, option.lstrip("-"))
+        if value is not None:
+            os.environ[variable] = value
+    if args.trace:
+        import instrumentation
+
+        instrumentation.enable(args.trace, args.trace_memory)
+    import_command(args.name)
+    args.function(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
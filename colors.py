@@ -0,0 +1,132 @@
+import argparse
+import csv
+import numpy as np
+import archive
+import instrumentation
+
+# Color indices (B-V and V-R) from the sequences of a star taken through different filters
+# The filters are observed one after the other, so the frames of two bands never have the same time. Every V frame
+# gets the magnitude of the other band at its time: interpolated between the two frames around it if both are within
+# the tolerance, otherwise taken from the nearest frame if that one is, and NaN if there's none. The frames around
+# every time are found with a binary search over the sorted times of the other band (like pandas.merge_asof), so a
+# join costs O(n log m) and never compares all pairs of frames, also over whole archives.
+# The errors of the magnitudes are propagated into the interpolated magnitudes and the color indices.
+# Usage: python colors.py [--archive lightcurve_archive] [--target "36 Per"] [--mode astroimagej] [--tolerance 5]
+
+# Frames of the other band further away than this (in minutes) aren't used
+DEFAULT_TOLERANCE = 5.0
+# (name, first band, second band) of the color indices, both are computed on the times of the V frames
+COLOR_INDICES = [("B-V", "B", "V"), ("V-R", "V", "R")]
+REFERENCE_BAND = "V"
+
+
+def align(TIMES, OTHER_TIMES, OTHER_VALUES, OTHER_ERRORS, tolerance, interpolate=True):
+    # Values and errors of another band at TIMES, OTHER_TIMES has to be sorted
+    # Returns NaN where no frame of the other band is within the tolerance
+    VALUES = np.full(len(TIMES), np.nan)
+    ERRORS = np.full(len(TIMES), np.nan)
+    if not len(OTHER_TIMES) or not len(TIMES):
+        return VALUES, ERRORS
+    # The frame of the other band at or after every time and the one before it
+    RIGHT = np.searchsorted(OTHER_TIMES, TIMES)
+    LEFT = np.clip(RIGHT - 1, 0, len(OTHER_TIMES) - 1)
+    RIGHT = np.clip(RIGHT, 0, len(OTHER_TIMES) - 1)
+    LEFT_DISTANCES = np.abs(TIMES - OTHER_TIMES[LEFT])
+    RIGHT_DISTANCES = np.abs(OTHER_TIMES[RIGHT] - TIMES)
+
+    NEAREST = np.where(LEFT_DISTANCES <= RIGHT_DISTANCES, LEFT, RIGHT)
+    MATCHED = np.minimum(LEFT_DISTANCES, RIGHT_DISTANCES) <= tolerance
+    VALUES[MATCHED] = OTHER_VALUES[NEAREST[MATCHED]]
+    ERRORS[MATCHED] = OTHER_ERRORS[NEAREST[MATCHED]]
+    if interpolate:
+        BRACKETED = (LEFT != RIGHT) & (LEFT_DISTANCES <= tolerance) & (RIGHT_DISTANCES <= tolerance)
+        L, R = LEFT[BRACKETED], RIGHT[BRACKETED]
+        # Weight of the frame after the time, the one before gets the rest
+        WEIGHTS = (TIMES[BRACKETED] - OTHER_TIMES[L])/(OTHER_TIMES[R] - OTHER_TIMES[L])
+        VALUES[BRACKETED] = (1 - WEIGHTS)*OTHER_VALUES[L] + WEIGHTS*OTHER_VALUES[R]
+        ERRORS[BRACKETED] = np.hypot((1 - WEIGHTS)*OTHER_ERRORS[L], WEIGHTS*OTHER_ERRORS[R])
+    return VALUES, ERRORS
+
+
+def band_arrays(source, target, mode, band):
+    # Sorted julian dates, magnitudes and errors of the good frames of a star through one filter
+    arrays = source.concatenated(target=target, mode=mode, filter=band)
+    GOOD = (arrays["flags"] == 0) & np.isfinite(arrays["julian_dates"]) & np.isfinite(arrays["mags"])
+    ORDER = np.argsort(arrays["julian_dates"][GOOD], kind="stable")
+    return tuple(np.asarray(arrays[name][GOOD][ORDER], dtype=float) for name in ("julian_dates", "mags", "errors"))
+
+
+@instrumentation.timed()
+def color_curves(source, target, mode, tolerance=DEFAULT_TOLERANCE/1440, interpolate=True):
+    # B-V and V-R with their errors on the times of the V frames of a star, tolerance in days
+    bands = {band: band_arrays(source, target, mode, band) for band in {band for _, first, second in COLOR_INDICES for band in (first, second)}}
+    TIMES, _, _ = bands[REFERENCE_BAND]
+    instrumentation.count("frames", len(TIMES))
+    curves = {"julian_dates": TIMES}
+    for name, first, second in COLOR_INDICES:
+        FIRST, FIRST_ERRORS = align(TIMES, *bands[first], tolerance, interpolate)
+        SECOND, SECOND_ERRORS = align(TIMES, *bands[second], tolerance, interpolate)
+        curves[name] = FIRST - SECOND
+        curves[name + " error"] = np.hypot(FIRST_ERRORS, SECOND_ERRORS)
+    return curves
+
+
+def star_modes(source):
+    # (target, mode) of every star that was observed through the reference band and at least one other
+    observed = {}
+    for entry in source.entries:
+        observed.setdefault((entry["target"], entry["mode"]), set()).add(entry["filter"])
+    return [key for key, bands in sorted(observed.items()) if REFERENCE_BAND in bands and len(bands) > 1]
+
+
+def weighted_mean(VALUES, ERRORS):
+    # Weighted mean and its error, the unweighted median and the standard error if the errors are unknown
+    FINITE = np.isfinite(VALUES)
+    VALUES, ERRORS = VALUES[FINITE], ERRORS[FINITE]
+    if not len(VALUES):
+        return np.nan, np.nan
+    if np.all(np.isfinite(ERRORS) & (ERRORS > 0)):
+        WEIGHTS = 1/ERRORS**2
+        return np.sum(WEIGHTS*VALUES)/np.sum(WEIGHTS), 1/np.sqrt(np.sum(WEIGHTS))
+    return np.median(VALUES), np.std(VALUES)/np.sqrt(len(VALUES))
+
+
+def write_curves(rows, file_path):
+    columns = ["target", "mode", "julian_date"] + [name + suffix for name, _, _ in COLOR_INDICES for suffix in ("", " error")]
+    with open(file_path, "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(columns)
+        for target, mode, curves in rows:
+            VALUES = np.column_stack([curves["julian_dates"]] + [curves[name + suffix] for name, _, _ in COLOR_INDICES for suffix in ("", " error")])
+            writer.writerows([target, mode] + row for row in VALUES.tolist())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="B-V and V-R color curves from the filter sequences in the archive")
+    parser.add_argument("--archive", default=archive.ARCHIVE_DIR, help="archive written by archive.py")
+    parser.add_argument("--target", nargs="*", help="only these stars (default: every star with V and another filter)")
+    parser.add_argument("--mode", nargs="*", help="only these modes, e.g. astroimagej or auto_aperture")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="in minutes")
+    parser.add_argument("--no-interpolation", action="store_true", help="always take the nearest frame of the other band")
+    parser.add_argument("--output", help="CSV file for the color curves")
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    instrumentation.configure(args)
+
+    source = archive.Archive(args.archive)
+    rows = []
+    print("{:<16} {:<20} {:>7} {:>16} {:>16}".format("target", "mode", "frames", "B-V", "V-R"))
+    for target, mode in star_modes(source):
+        if (args.target and target not in args.target) or (args.mode and mode not in args.mode):
+            continue
+        curves = color_curves(source, target, mode, args.tolerance/1440, not args.no_interpolation)
+        rows.append((target, mode, curves))
+        means = ["{:.3f} ± {:.3f}".format(*weighted_mean(curves[name], curves[name + " error"])) for name, _, _ in COLOR_INDICES]
+        print("{:<16} {:<20} {:>7} {:>16} {:>16}".format(target, mode, len(curves["julian_dates"]), *means))
+    if args.output:
+        write_curves(rows, args.output)
+        print("Color curves written to {}".format(args.output))
+
+
+if __name__ == "__main__":
+    main()
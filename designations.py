@@ -0,0 +1,273 @@
+import re
+from functools import lru_cache
+import numpy as np
+from catalog_cache import load_columns
+
+# Designation index for the variable star catalog
+# Our files are named after the star the way it is written in the observing log (e.g. VWCepheiObs1, alfCepheiB),
+# while the catalog uses GCVS designations (e.g. "VW Cep", "alf Cep"). Both are normalized to the same key,
+# so a target can be looked up in a dict instead of searching the catalog.
+
+# Constellations in the order of the catalog's Constell number: (abbreviation, nominative, genitive)
+CONSTELLATIONS = [
+    ("And", "Andromeda", "Andromedae"),
+    ("Ant", "Antlia", "Antliae"),
+    ("Aps", "Apus", "Apodis"),
+    ("Aqr", "Aquarius", "Aquarii"),
+    ("Aql", "Aquila", "Aquilae"),
+    ("Ara", "Ara", "Arae"),
+    ("Ari", "Aries", "Arietis"),
+    ("Aur", "Auriga", "Aurigae"),
+    ("Boo", "Bootes", "Bootis"),
+    ("Cae", "Caelum", "Caeli"),
+    ("Cam", "Camelopardalis", "Camelopardalis"),
+    ("Cnc", "Cancer", "Cancri"),
+    ("CVn", "Canes Venatici", "Canum Venaticorum"),
+    ("CMa", "Canis Major", "Canis Majoris"),
+    ("CMi", "Canis Minor", "Canis Minoris"),
+    ("Cap", "Capricornus", "Capricorni"),
+    ("Car", "Carina", "Carinae"),
+    ("Cas", "Cassiopeia", "Cassiopeiae"),
+    ("Cen", "Centaurus", "Centauri"),
+    ("Cep", "Cepheus", "Cephei"),
+    ("Cet", "Cetus", "Ceti"),
+    ("Cha", "Chamaeleon", "Chamaeleontis"),
+    ("Cir", "Circinus", "Circini"),
+    ("Col", "Columba", "Columbae"),
+    ("Com", "Coma Berenices", "Comae Berenices"),
+    ("CrA", "Corona Australis", "Coronae Australis"),
+    ("CrB", "Corona Borealis", "Coronae Borealis"),
+    ("Crv", "Corvus", "Corvi"),
+    ("Crt", "Crater", "Crateris"),
+    ("Cru", "Crux", "Crucis"),
+    ("Cyg", "Cygnus", "Cygni"),
+    ("Del", "Delphinus", "Delphini"),
+    ("Dor", "Dorado", "Doradus"),
+    ("Dra", "Draco", "Draconis"),
+    ("Equ", "Equuleus", "Equulei"),
+    ("Eri", "Eridanus", "Eridani"),
+    ("For", "Fornax", "Fornacis"),
+    ("Gem", "Gemini", "Geminorum"),
+    ("Gru", "Grus", "Gruis"),
+    ("Her", "Hercules", "Herculis"),
+    ("Hor", "Horologium", "Horologii"),
+    ("Hya", "Hydra", "Hydrae"),
+    ("Hyi", "Hydrus", "Hydri"),
+    ("Ind", "Indus", "Indi"),
+    ("Lac", "Lacerta", "Lacertae"),
+    ("Leo", "Leo", "Leonis"),
+    ("LMi", "Leo Minor", "Leonis Minoris"),
+    ("Lep", "Lepus", "Leporis"),
+    ("Lib", "Libra", "Librae"),
+    ("Lup", "Lupus", "Lupi"),
+    ("Lyn", "Lynx", "Lyncis"),
+    ("Lyr", "Lyra", "Lyrae"),
+    ("Men", "Mensa", "Mensae"),
+    ("Mic", "Microscopium", "Microscopii"),
+    ("Mon", "Monoceros", "Monocerotis"),
+    ("Mus", "Musca", "Muscae"),
+    ("Nor", "Norma", "Normae"),
+    ("Oct", "Octans", "Octantis"),
+    ("Oph", "Ophiuchus", "Ophiuchi"),
+    ("Ori", "Orion", "Orionis"),
+    ("Pav", "Pavo", "Pavonis"),
+    ("Peg", "Pegasus", "Pegasi"),
+    ("Per", "Perseus", "Persei"),
+    ("Phe", "Phoenix", "Phoenicis"),
+    ("Pic", "Pictor", "Pictoris"),
+    ("Psc", "Pisces", "Piscium"),
+    ("PsA", "Piscis Austrinus", "Piscis Austrini"),
+    ("Pup", "Puppis", "Puppis"),
+    ("Pyx", "Pyxis", "Pyxidis"),
+    ("Ret", "Reticulum", "Reticuli"),
+    ("Sge", "Sagitta", "Sagittae"),
+    ("Sgr", "Sagittarius", "Sagittarii"),
+    ("Sco", "Scorpius", "Scorpii"),
+    ("Scl", "Sculptor", "Sculptoris"),
+    ("Sct", "Scutum", "Scuti"),
+    ("Ser", "Serpens", "Serpentis"),
+    ("Sex", "Sextans", "Sextantis"),
+    ("Tau", "Taurus", "Tauri"),
+    ("Tel", "Telescopium", "Telescopii"),
+    ("Tri", "Triangulum", "Trianguli"),
+    ("TrA", "Triangulum Australe", "Trianguli Australis"),
+    ("Tuc", "Tucana", "Tucanae"),
+    ("UMa", "Ursa Major", "Ursae Majoris"),
+    ("UMi", "Ursa Minor", "Ursae Minoris"),
+    ("Vel", "Vela", "Velorum"),
+    ("Vir", "Virgo", "Virginis"),
+    ("Vol", "Volans", "Volantis"),
+    ("Vul", "Vulpecula", "Vulpeculae"),
+]
+
+# Greek letters as the GCVS abbreviates them, together with the other spellings that show up in star names
+GREEK_LETTERS = {
+    "alf": ["alpha", "alp", "alf"],
+    "bet": ["beta", "bet"],
+    "gam": ["gamma", "gam"],
+    "del": ["delta", "del"],
+    "eps": ["epsilon", "eps"],
+    "zet": ["zeta", "zet"],
+    "eta": ["eta"],
+    "tet": ["theta", "the", "tet", "tht"],
+    "iot": ["iota", "iot"],
+    "kap": ["kappa", "kap"],
+    "lam": ["lambda", "lam"],
+    "mu": ["mu"],
+    "nu": ["nu"],
+    "ksi": ["xi", "ksi"],
+    "omi": ["omicron", "omi"],
+    "pi": ["pi"],
+    "rho": ["rho"],
+    "sig": ["sigma", "sig"],
+    "tau": ["tau"],
+    "ups": ["upsilon", "ups"],
+    "phi": ["phi"],
+    "khi": ["chi", "khi"],
+    "psi": ["psi"],
+    "ome": ["omega", "ome", "omg"],
+}
+
+# Columns that are attached to a light curve when its target is found in the catalog
+METADATA_COLUMNS = ["GCVS", "CurveType", "Max", "MinI", "MinII", "Period [d]", "DI [h]", "DII [h]",
+                    "RAh", "RAm", "RAs", "DE-", "DEd", "DEm", "DEs"]
+
+CONSTELLATION_ABBREVIATIONS = {}
+for names in CONSTELLATIONS:
+    for name in names:
+        CONSTELLATION_ABBREVIATIONS[re.sub(r"\s+", "", name).lower()] = names[0]
+GREEK_ABBREVIATIONS = {alias: abbreviation for abbreviation, aliases in GREEK_LETTERS.items() for alias in aliases}
+
+# The constellation is always at the end of a name, with or without a space in front of it
+# Longer names come first so e.g. "Leonis Minoris" isn't matched as "Leonis" + "Minoris"
+CONSTELLATION_PATTERN = "|".join(
+    r"\s*".join(re.escape(word) for word in name.split())
+    for name in sorted({name for names in CONSTELLATIONS for name in names}, key=len, reverse=True)
+)
+NAME_REGEX = re.compile(r"^(?P<star>.*?)[\s_.]*(?P<constellation>{})$".format(CONSTELLATION_PATTERN), re.IGNORECASE)
+GREEK_REGEX = re.compile(r"^(?P<letter>[a-z]+)\.?\s*(?P<index>\d*)$")
+VARIABLE_NUMBER_REGEX = re.compile(r"^v\s*0*(?P<number>\d+)$", re.IGNORECASE)
+# Parts of our file names that are not part of the star's name
+FILE_SUFFIX_REGEX = re.compile(r"(Obs\d*|\d+ref)$", re.IGNORECASE)
+FILTER_LETTERS = "UBVRI"
+
+
+def normalize_star(star):
+    # Bring the part of the name in front of the constellation into the form the GCVS uses
+    star = star.strip()
+    greek = GREEK_REGEX.match(star.lower())
+    # Argelander designations have at most two letters and are upper case, so "MU Cas" isn't "mu Cas"
+    is_argelander_like = star.isupper() and len(greek.group("letter")) <= 2 if greek else False
+    if greek and greek.group("letter") in GREEK_ABBREVIATIONS and not is_argelander_like:
+        return GREEK_ABBREVIATIONS[greek.group("letter")] + greek.group("index")
+    number = VARIABLE_NUMBER_REGEX.match(star)
+    if number:
+        return "V{}".format(number.group("number"))
+    star = re.sub(r"\s+", "", star)
+    # Single letters keep their case, as lower case letters are Bayer designations (e.g. "u Her" isn't "U Her")
+    if len(star) == 1:
+        return star
+    # Argelander designations (RT, VW, ...) are always upper case
+    return star.upper()
+
+
+def split_designation(name):
+    # Returns (star, constellation abbreviation) or None if there is no constellation at the end of the name
+    match = NAME_REGEX.match(name.strip())
+    if match is None or match.group("star").strip() == "":
+        return None
+    constellation = CONSTELLATION_ABBREVIATIONS[re.sub(r"\s+", "", match.group("constellation")).lower()]
+    return normalize_star(match.group("star")), constellation
+
+
+def normalize_designation(name):
+    # e.g. "VW Cephei", "vwcep" and "VW  Cep" all become "VW Cep", "alpha Cep" becomes "alf Cep"
+    parts = split_designation(name)
+    if parts is None:
+        return None
+    return "{} {}".format(*parts)
+
+
+def designation_from_file_name(file_name):
+    # e.g. "VWCepheiObs1" -> "VW Cep", "alfCepheiB" -> "alf Cep", "lightcurves/binary_stars/RSVulObs1.tbl" -> "RS Vul"
+    stem = re.split(r"[\\/]", file_name)[-1].split(".")[0]
+    stem = FILE_SUFFIX_REGEX.sub("", stem)
+    designation = normalize_designation(stem)
+    # Files of the same star taken through different filters end in the filter letter
+    if designation is None and len(stem) > 1 and stem[-1] in FILTER_LETTERS:
+        designation = normalize_designation(stem[:-1])
+    return designation
+
+
+class DesignationIndex:
+    # Maps the normalized designation of every catalog entry to its row in the catalog
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self.rows = {}
+        for row, name in enumerate(catalog["GCVS"]):
+            if name is None:
+                continue
+            designation = normalize_designation(str(name))
+            if designation is not None:
+                self.rows.setdefault(designation, row)
+        # The catalog also numbers every star within its constellation
+        self.numbers = {(int(constell), int(number)): row for row, (constell, number) in enumerate(zip(catalog["Constell"], catalog["Number"]))}
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, name):
+        return self.lookup(name) is not None
+
+    def lookup(self, name):
+        # Row of the catalog entry for a star name, or None if it isn't in the catalog
+        designation = normalize_designation(name)
+        if designation is None:
+            designation = designation_from_file_name(name)
+        return self.rows.get(designation)
+
+    def lookup_number(self, constell, number):
+        return self.numbers.get((int(constell), int(number)))
+
+    def metadata(self, name):
+        # The catalog columns in METADATA_COLUMNS for a star, as plain python values
+        row = self.lookup(name)
+        if row is None:
+            return None
+        metadata = {}
+        for column in METADATA_COLUMNS:
+            value = self.catalog[column][row]
+            metadata[column] = value.item() if isinstance(value, np.generic) else value
+        return metadata
+
+
+@lru_cache(maxsize=None)
+def default_index():
+    # The index over the catalog of this repository, built once per process and shared by every lookup
+    return DesignationIndex(load_columns(["GCVS", "Constell", "Number"] + METADATA_COLUMNS[1:]))
+
+
+def target_metadata(file_name):
+    # Catalog metadata for the target of a light curve file, or None if the target isn't in the catalog
+    designation = designation_from_file_name(file_name)
+    if designation is None:
+        return None
+    return default_index().metadata(designation)
+
+
+def format_catalog_value(value, unit):
+    # Missing values are NaN (numbers) or None (text) in the catalog cache
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return "unknown"
+    return "{}{}".format(value, unit)
+
+
+def print_catalog_entry(metadata):
+    print("========== Catalog entry ==========")
+    if metadata is None:
+        print("Target not found in the catalog")
+        return
+    print("Designation: {} ({})".format(metadata["GCVS"], format_catalog_value(metadata["CurveType"], "")))
+    print("Period: {}".format(format_catalog_value(metadata["Period [d]"], "d")))
+    print("Max: {}, MinI: {}, MinII: {}".format(*(format_catalog_value(metadata[column], "mag") for column in ["Max", "MinI", "MinII"])))
+    print("Eclipse duration: {}".format(format_catalog_value(metadata["DI [h]"], "h")))
@@ -0,0 +1,171 @@
+from collections import OrderedDict
+import numpy as np
+
+# Visual downsampling of long light curves before they are plotted
+# A figure can't show more points than it has pixels, so a series is reduced to a few points per pixel column first.
+# Two methods are available:
+#  - "minmax" keeps the faintest and the brightest sample of every pixel column, so the envelope of the curve is exact
+#  - "lttb" (largest triangle three buckets) keeps the sample of every bucket that spans the largest triangle with
+#    its neighbouring buckets, which follows the shape of the curve with a single point per bucket.
+#    The buckets are all evaluated at once against the averages of their neighbours instead of one after another
+#    against the previously selected point, that's what makes it vectorized.
+# Eclipse minima are never lost: the faintest sample of every bucket that is fainter than both its neighbours is always kept.
+# To make zooming independent of the length of the series, a min/max pyramid is built once: level k holds the index of
+# the minimum and maximum of every block of 2^k samples. A view only looks at the level with a few blocks per pixel,
+# so its cost depends on the number of pixels and not on the number of samples. Views are cached per zoom level.
+
+# Candidate samples per pixel column that are taken from the pyramid before the final selection
+POINTS_PER_PIXEL = 4
+# Series shorter than this are plotted as they are
+MIN_POINTS = 2000
+CACHE_SIZE = 32
+
+
+def bucket_extremes(BUCKETS, VALUES):
+    # Index (into VALUES) of the minimum and maximum of every non-empty bucket, BUCKETS has to be sorted
+    # Sorting by (bucket, value) puts the minimum first and the maximum last in every bucket
+    ORDER = np.lexsort((VALUES, BUCKETS))
+    STARTS = np.flatnonzero(np.r_[True, np.diff(BUCKETS[ORDER]) != 0])
+    ENDS = np.r_[STARTS[1:], len(ORDER)] - 1
+    return BUCKETS[ORDER[STARTS]], ORDER[STARTS], ORDER[ENDS]
+
+
+def eclipse_extremes(BUCKETS, VALUES, preserve="max"):
+    # The faintest sample of every bucket that is fainter than the buckets next to it (local extremes of the bucket envelope)
+    # preserve="max" for magnitudes (faint is large), "min" for fluxes, None keeps nothing extra
+    if preserve is None or len(VALUES) == 0:
+        return np.empty(0, dtype=np.intp)
+    USED, MIN_INDICES, MAX_INDICES = bucket_extremes(BUCKETS, VALUES)
+    INDICES = MAX_INDICES if preserve == "max" else MIN_INDICES
+    ENVELOPE = VALUES[INDICES] if preserve == "max" else -VALUES[INDICES]
+    PADDED = np.r_[-np.inf, ENVELOPE, -np.inf]
+    LOCAL = (ENVELOPE >= PADDED[:-2]) & (ENVELOPE >= PADDED[2:])
+    return INDICES[LOCAL]
+
+
+def minmax_select(X, Y, n_pixels, preserve="max"):
+    # Indices of the minimum and maximum of every pixel column between the first and the last sample
+    if len(X) <= 2*n_pixels:
+        return np.arange(len(X))
+    span = X[-1] - X[0]
+    BUCKETS = np.minimum(((X - X[0])/span*n_pixels).astype(np.intp), n_pixels - 1) if span > 0 else np.zeros(len(X), dtype=np.intp)
+    _, MIN_INDICES, MAX_INDICES = bucket_extremes(BUCKETS, Y)
+    return np.unique(np.r_[0, MIN_INDICES, MAX_INDICES, len(X) - 1])
+
+
+def lttb_select(X, Y, n_out, preserve="max"):
+    # Indices of the samples that largest triangle three buckets keeps, the first and last sample are always kept
+    n = len(X)
+    if n <= n_out or n_out < 3:
+        return np.arange(n)
+    n_buckets = n_out - 2
+    # The samples between the first and the last one are split into buckets with the same number of samples
+    BUCKETS = np.minimum(((np.arange(1, n - 1) - 1)*n_buckets)//(n - 2), n_buckets - 1)
+    COUNTS = np.bincount(BUCKETS, minlength=n_buckets)
+    MEAN_X = np.bincount(BUCKETS, weights=X[1:-1], minlength=n_buckets)/COUNTS
+    MEAN_Y = np.bincount(BUCKETS, weights=Y[1:-1], minlength=n_buckets)/COUNTS
+    # Every bucket is compared to the average of the bucket before and after it (the first and last sample at the ends)
+    PREVIOUS_X = np.r_[X[0], MEAN_X[:-1]][BUCKETS]
+    PREVIOUS_Y = np.r_[Y[0], MEAN_Y[:-1]][BUCKETS]
+    NEXT_X = np.r_[MEAN_X[1:], X[-1]][BUCKETS]
+    NEXT_Y = np.r_[MEAN_Y[1:], Y[-1]][BUCKETS]
+    AREAS = np.abs((PREVIOUS_X - NEXT_X)*(Y[1:-1] - PREVIOUS_Y) - (PREVIOUS_X - X[1:-1])*(NEXT_Y - PREVIOUS_Y))
+    _, _, LARGEST = bucket_extremes(BUCKETS, AREAS)
+    PRESERVED = eclipse_extremes(BUCKETS, Y[1:-1], preserve)
+    return np.unique(np.r_[0, LARGEST + 1, PRESERVED + 1, n - 1])
+
+
+METHODS = {"minmax": minmax_select, "lttb": lttb_select}
+
+
+class MinMaxPyramid:
+    # Indices of the minimum and maximum of every block of 2^k samples, for every level k
+    def __init__(self, VALUES):
+        self.values = VALUES
+        self.min_levels = [np.arange(len(VALUES))]
+        self.max_levels = [self.min_levels[0]]
+        while len(self.min_levels[-1]) > 1:
+            self.min_levels.append(self.reduce(self.min_levels[-1], np.less_equal))
+            self.max_levels.append(self.reduce(self.max_levels[-1], np.greater_equal))
+
+    def reduce(self, INDICES, keep_first):
+        # Combine pairs of blocks, an odd block at the end is paired with itself
+        if len(INDICES) % 2:
+            INDICES = np.r_[INDICES, INDICES[-1]]
+        FIRST, SECOND = INDICES[0::2], INDICES[1::2]
+        return np.where(keep_first(self.values[FIRST], self.values[SECOND]), FIRST, SECOND)
+
+    def candidates(self, start, stop, n_points):
+        # Sorted indices in [start, stop) that contain the minimum and maximum of every block of the coarsest level
+        # that still has at least n_points/2 blocks in the range
+        count = stop - start
+        level = int(np.clip(np.floor(np.log2(max(count, 1)/max(n_points/2, 1))), 0, len(self.min_levels) - 1))
+        if level == 0:
+            return np.arange(start, stop)
+        first_block, last_block = start >> level, ((stop - 1) >> level) + 1
+        INDICES = np.unique(np.r_[self.min_levels[level][first_block:last_block], self.max_levels[level][first_block:last_block]])
+        # The blocks at the edges of the range can reach outside of it
+        return INDICES[(INDICES >= start) & (INDICES < stop)]
+
+
+class DownsampledSeries:
+    # A long series that is downsampled for every view of it, with the views cached per zoom level
+    def __init__(self, X, Y, preserve="max", cache_size=CACHE_SIZE):
+        X = np.asarray(X, dtype=float)
+        Y = np.asarray(Y, dtype=float)
+        FINITE = np.isfinite(X) & np.isfinite(Y)
+        ORDER = np.argsort(X[FINITE], kind="stable")
+        self.x = X[FINITE][ORDER]
+        self.y = Y[FINITE][ORDER]
+        self.preserve = preserve
+        self.pyramid = MinMaxPyramid(self.y)
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+
+    def __len__(self):
+        return len(self.x)
+
+    def view(self, x_min=None, x_max=None, n_pixels=1000, method="minmax"):
+        # X and Y of the samples to plot between x_min and x_max for a plot n_pixels wide
+        start = 0 if x_min is None else int(np.searchsorted(self.x, x_min, side="left"))
+        stop = len(self.x) if x_max is None else int(np.searchsorted(self.x, x_max, side="right"))
+        # One sample outside of the view on each side, so lines continue to the edge of the plot
+        start, stop = max(start - 1, 0), min(stop + 1, len(self.x))
+        key = (method, start, stop, n_pixels)
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+
+        CANDIDATES = self.pyramid.candidates(start, stop, POINTS_PER_PIXEL*n_pixels)
+        SELECTED = CANDIDATES[METHODS[method](self.x[CANDIDATES], self.y[CANDIDATES], n_pixels, self.preserve)]
+        result = self.x[SELECTED], self.y[SELECTED]
+        self.cache[key] = result
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return result
+
+
+def downsample(X, Y, n_pixels=1000, method="minmax", preserve="max"):
+    # One-off downsampling of a whole series, series that are short enough are returned unchanged
+    if len(X) < max(MIN_POINTS, 2*n_pixels):
+        return np.asarray(X), np.asarray(Y)
+    return DownsampledSeries(X, Y, preserve).view(n_pixels=n_pixels, method=method)
+
+
+def axes_width_pixels(ax):
+    return max(int(ax.get_window_extent().width), 1)
+
+
+def plot_downsampled(ax, X, Y, fmt="o", method="minmax", preserve="max", **kwargs):
+    # Plot a series on interactive axes, the displayed samples are replaced whenever the x range changes (zoom, pan)
+    if len(X) < MIN_POINTS:
+        return ax.plot(X, Y, fmt, **kwargs)[0]
+    series = DownsampledSeries(X, Y, preserve)
+    line, = ax.plot(*series.view(n_pixels=axes_width_pixels(ax), method=method), fmt, **kwargs)
+
+    def update(ax):
+        x_min, x_max = ax.get_xlim()
+        line.set_data(*series.view(min(x_min, x_max), max(x_min, x_max), axes_width_pixels(ax), method))
+
+    ax.callbacks.connect("xlim_changed", update)
+    return line
@@ -0,0 +1,121 @@
+import re
+import numpy as np
+from rolling import MAD_TO_STD
+from tbl_reader import read_columns
+
+# Ensemble differential photometry
+# Instead of correcting the target with a single comparison star, all the comparison stars (C2, C3, ...) of a table
+# are combined into one artificial comparison star. Every comparison is normalized by its median, the normalized
+# counts are averaged with one weight per star, and the result is what the target's counts are divided by.
+# Comparison stars that are variable themselves are rejected iteratively: each one is compared to the ensemble
+# of all the others, and the star whose ratio scatters most above its expected noise is dropped, one at a time.
+
+COMPARISON_REGEX = re.compile(r"^Source-Sky_(C\d+)$")
+# A comparison star is rejected if its (relative) scatter is this many robust standard deviations above the median
+CLIP_SIGMA = 3.0
+MAX_ITERATIONS = 10
+# Relative standard error of the robust standard deviation times the square root of the number of frames
+ROBUST_STD_ERROR = 1.166
+
+
+def comparison_apertures(columns):
+    # e.g. ["Source-Sky_T1", "Source-Sky_C2", "Source-Sky_C3"] -> ["C2", "C3"]
+    return [match.group(1) for match in map(COMPARISON_REGEX.match, columns) if match]
+
+
+def comparison_columns(file_path):
+    # The source count and SNR columns of every comparison star in a table
+    apertures = comparison_apertures(read_columns(file_path))
+    return apertures, ["Source-Sky_{}".format(aperture) for aperture in apertures], ["Source_SNR_{}".format(aperture) for aperture in apertures]
+
+
+def comparison_matrices(values, apertures):
+    # Stack the source counts and SNRs of the comparison stars into (frames x stars) matrices
+    # Without comparison stars the matrices have no columns, and the counts are left as they are
+    if not apertures:
+        n_frames = len(next(iter(values.values()), []))
+        return np.empty((n_frames, 0)), None
+    COUNTS = np.column_stack([values["Source-Sky_{}".format(aperture)] for aperture in apertures])
+    SNR = None
+    if all("Source_SNR_{}".format(aperture) in values for aperture in apertures):
+        SNR = np.column_stack([values["Source_SNR_{}".format(aperture)] for aperture in apertures])
+    return COUNTS, SNR
+
+
+def robust_std(VALUES, axis=0):
+    MEDIANS = np.nanmedian(VALUES, axis=axis, keepdims=True)
+    return MAD_TO_STD*np.nanmedian(np.abs(VALUES - MEDIANS), axis=axis)
+
+
+def leave_one_out_scatter(NORMALIZED, WEIGHTS):
+    # Robust scatter of every star divided by the weighted ensemble of all the other used stars
+    # The ensemble without star i is (weighted sum - weight_i*star_i)/(total weight - weight_i), for all the stars at once
+    WEIGHTED_SUM = NORMALIZED @ WEIGHTS
+    total_weight = np.sum(WEIGHTS)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        OTHERS = (WEIGHTED_SUM[:, None] - NORMALIZED*WEIGHTS)/(total_weight - WEIGHTS)
+        return robust_std(NORMALIZED/OTHERS, axis=0)
+
+
+def leave_one_out_noise(NOISE, WEIGHTS):
+    # Expected scatter of every star divided by the weighted ensemble of all the other used stars: its own noise and
+    # the noise of the ensemble it's divided by, sqrt(noise_i^2 + sum_j(weight_j^2*noise_j^2)/sum_j(weight_j)^2) over j != i.
+    # With inverse variance weights the noise of the ensemble is 1/sqrt(sum_j(noise_j^-2))
+    WEIGHTED_VARIANCE = (WEIGHTS*NOISE)**2
+    with np.errstate(invalid="ignore", divide="ignore"):
+        OTHERS_VARIANCE = (np.sum(WEIGHTED_VARIANCE) - WEIGHTED_VARIANCE)/(np.sum(WEIGHTS) - WEIGHTS)**2
+    return np.sqrt(NOISE**2 + OTHERS_VARIANCE)
+
+
+def ensemble_normalization(COUNTS, SNR=None, weighting="snr", clip_sigma=CLIP_SIGMA, max_iterations=MAX_ITERATIONS):
+    # Returns the artificial comparison star normalized to 1 (one value per frame), the weight of every star
+    # and which stars were used. The target counts divided by the normalization are corrected for transparency changes.
+    # weighting="snr" weighs the stars by their median SNR squared (i.e. inverse variance from photon noise),
+    # weighting="variance" by the inverse variance of their ratio to the rest of the ensemble
+    COUNTS = np.atleast_2d(np.asarray(COUNTS, dtype=float).T).T
+    if COUNTS.shape[1] == 0:
+        # No comparison stars, the counts aren't corrected
+        return np.ones(COUNTS.shape[0]), np.empty(0), np.zeros(0, dtype=bool)
+    NORMALIZED = COUNTS/np.nanmedian(COUNTS, axis=0)
+    n_frames, n_stars = NORMALIZED.shape
+    # The photon noise of every star relative to its counts, a bright star is expected to scatter less than a faint one
+    # Without SNR columns the noise is estimated from the counts alone (pure photon noise)
+    NOISE = 1/np.sqrt(np.abs(np.nanmedian(COUNTS, axis=0)))
+    if SNR is not None:
+        NOISE = 1/np.nanmedian(np.atleast_2d(np.asarray(SNR, dtype=float).T).T, axis=0)
+    if weighting == "snr" and SNR is not None:
+        WEIGHTS = 1/NOISE**2
+    else:
+        WEIGHTS = np.ones(n_stars)
+    USED = np.isfinite(WEIGHTS) & (WEIGHTS > 0)
+
+    # At least three stars are needed to tell which one is the odd one out
+    for _ in range(max_iterations if n_stars >= 3 else 0):
+        SCATTER = leave_one_out_scatter(NORMALIZED[:, USED], WEIGHTS[USED])
+        if weighting == "variance":
+            WEIGHTS[USED] = 1/np.maximum(SCATTER, 1e-12)**2
+        # Scatter in units of the expected noise, so only stars that are noisier than they should be are rejected
+        # The expected noise includes the ensemble of the other stars, which dominates the ratio of the brightest star
+        EXCESS = SCATTER/leave_one_out_noise(NOISE[USED], WEIGHTS[USED])
+        # A star that scatters as much as expected is never rejected, however similar the other stars are
+        limit = max(np.median(EXCESS) + clip_sigma*robust_std(EXCESS), 1 + clip_sigma*ROBUST_STD_ERROR/np.sqrt(n_frames))
+        # Only the worst star is rejected per iteration, a variable star also raises the scatter of the stars it's
+        # compared with (the bright ones the most) until it's out of the ensemble
+        worst = np.argmax(EXCESS)
+        if not EXCESS[worst] > limit or np.count_nonzero(USED) < 3:
+            break
+        USED[np.flatnonzero(USED)[worst]] = False
+
+    FINAL_WEIGHTS = np.where(USED, WEIGHTS, 0.0)
+    # Frames where a star has no valid measurement are averaged over the remaining stars only
+    VALID = np.isfinite(NORMALIZED)
+    FRAME_WEIGHTS = VALID*FINAL_WEIGHTS
+    with np.errstate(invalid="ignore", divide="ignore"):
+        NORMALIZATION = np.sum(np.where(VALID, NORMALIZED, 0.0)*FRAME_WEIGHTS, axis=1)/np.sum(FRAME_WEIGHTS, axis=1)
+    return NORMALIZATION, FINAL_WEIGHTS/np.sum(FINAL_WEIGHTS), USED
+
+
+def print_ensemble(apertures, WEIGHTS, USED):
+    print("========== Comparison ensemble ==========")
+    for aperture, weight, used in zip(apertures, WEIGHTS, USED):
+        print("{}: weight {:.3f}{}".format(aperture, weight, "" if used else " (rejected as variable)"))
@@ -0,0 +1,105 @@
+import numpy as np
+
+# Low precision ephemeris of the sun and the rotation of the earth, without any network access or data files
+# The position of the sun follows the Astronomical Almanac's low precision formulae (good to about 0.01° between 1950
+# and 2050), the sidereal time is the IAU 1982 expression truncated after the linear term (good to about 0.1 s).
+# The barycentre of the solar system is offset from the sun by the pull of Jupiter and Saturn on circular orbits
+# (good to a few 0.001 AU, i.e. a few seconds of light time), which is all that's needed for heliocentric and
+# barycentric julian dates to about 10 s.
+# Every function takes arrays of full julian dates and works on all of them at once.
+
+J2000 = 2451545.0
+# Julian date of 1970-01-01 0h UT, for converting dates to julian dates
+UNIX_EPOCH = 2440587.5
+# Speed of light in AU per day
+LIGHT_SPEED = 173.1446327
+# TT - UTC in seconds: 32.184 s plus the 37 leap seconds of TAI - UTC since 2017
+TT_MINUS_UTC = 69.184
+# Mass (as a fraction of the sun's), semi-major axis (AU), mean longitude at J2000 and its rate (degrees per day)
+PLANETS = {
+    "jupiter": (1/1047.349, 5.2026, 34.39644, 0.08308677),
+    "saturn": (1/3497.898, 9.5549, 49.95424, 0.03347025),
+}
+
+
+def days_since_j2000(JULIAN_DATES):
+    return np.asarray(JULIAN_DATES, dtype=float) - J2000
+
+
+def sun_ecliptic(JULIAN_DATES):
+    # Ecliptic longitude (radians), distance (AU) and obliquity of the ecliptic (radians) of the sun
+    n = days_since_j2000(JULIAN_DATES)
+    MEAN_LONGITUDE = np.radians(280.460 + 0.9856474*n)
+    MEAN_ANOMALY = np.radians(357.528 + 0.9856003*n)
+    LONGITUDE = MEAN_LONGITUDE + np.radians(1.915*np.sin(MEAN_ANOMALY) + 0.020*np.sin(2*MEAN_ANOMALY))
+    DISTANCE = 1.00014 - 0.01671*np.cos(MEAN_ANOMALY) - 0.00014*np.cos(2*MEAN_ANOMALY)
+    OBLIQUITY = np.radians(23.439 - 0.0000004*n)
+    return LONGITUDE, DISTANCE, OBLIQUITY
+
+
+def sun_equatorial(JULIAN_DATES):
+    # Right ascension and declination of the sun in radians
+    LONGITUDE, _, OBLIQUITY = sun_ecliptic(JULIAN_DATES)
+    RA = np.arctan2(np.cos(OBLIQUITY)*np.sin(LONGITUDE), np.cos(LONGITUDE)) % (2*np.pi)
+    DEC = np.arcsin(np.sin(OBLIQUITY)*np.sin(LONGITUDE))
+    return RA, DEC
+
+
+def ecliptic_to_equatorial(X, Y, Z, OBLIQUITY):
+    return X, np.cos(OBLIQUITY)*Y - np.sin(OBLIQUITY)*Z, np.sin(OBLIQUITY)*Y + np.cos(OBLIQUITY)*Z
+
+
+def sun_vector(JULIAN_DATES):
+    # Geocentric equatorial position of the sun in AU, one row per julian date
+    LONGITUDE, DISTANCE, OBLIQUITY = sun_ecliptic(JULIAN_DATES)
+    return np.column_stack(ecliptic_to_equatorial(DISTANCE*np.cos(LONGITUDE), DISTANCE*np.sin(LONGITUDE), 0, OBLIQUITY))
+
+
+def sun_barycentric_vector(JULIAN_DATES):
+    # Equatorial position of the sun relative to the barycentre of the solar system in AU
+    n = days_since_j2000(JULIAN_DATES)
+    X = np.zeros(n.shape)
+    Y = np.zeros(n.shape)
+    for mass, semi_major_axis, longitude, rate in PLANETS.values():
+        MEAN_LONGITUDE = np.radians(longitude + rate*n)
+        X -= mass*semi_major_axis*np.cos(MEAN_LONGITUDE)
+        Y -= mass*semi_major_axis*np.sin(MEAN_LONGITUDE)
+    _, _, OBLIQUITY = sun_ecliptic(JULIAN_DATES)
+    return np.column_stack(ecliptic_to_equatorial(X, Y, 0, OBLIQUITY))
+
+
+def tdb_minus_utc(JULIAN_DATES):
+    # In seconds, TDB differs from TT by a periodic term of 1.7 ms along the orbit of the earth
+    MEAN_ANOMALY = np.radians(357.528 + 0.9856003*days_since_j2000(JULIAN_DATES))
+    return TT_MINUS_UTC + 0.001657*np.sin(MEAN_ANOMALY + 0.01671*np.sin(MEAN_ANOMALY))
+
+
+def star_vector(ra, dec):
+    # Unit vector towards a star at (ra, dec) in radians
+    return np.array([np.cos(dec)*np.cos(ra), np.cos(dec)*np.sin(ra), np.sin(dec)])
+
+
+def heliocentric_correction(JULIAN_DATES, ra, dec):
+    # Days to add to (UTC) julian dates to get heliocentric julian dates: the light time along the direction of
+    # the star between the earth and the sun
+    return -(sun_vector(JULIAN_DATES) @ star_vector(ra, dec))/LIGHT_SPEED
+
+
+def barycentric_correction(JULIAN_DATES, ra, dec):
+    # Days to add to UTC julian dates to get BJD_TDB: the light time between the earth and the barycentre plus the
+    # difference of the time scales
+    EARTH = sun_barycentric_vector(JULIAN_DATES) - sun_vector(JULIAN_DATES)
+    return (EARTH @ star_vector(ra, dec))/LIGHT_SPEED + tdb_minus_utc(JULIAN_DATES)/86400
+
+
+def local_sidereal_time(JULIAN_DATES, longitude_deg):
+    # Local mean sidereal time in radians for a longitude in degrees east
+    GMST_HOURS = 18.697374558 + 24.06570982441908*days_since_j2000(JULIAN_DATES)
+    return np.radians(GMST_HOURS*15 + longitude_deg) % (2*np.pi)
+
+
+def altitude_sin(RA, DEC, LST, latitude_deg):
+    # Sine of the altitude of objects at (RA, DEC) for the given local sidereal times, all in radians
+    # The arrays are broadcast against each other, e.g. RA[:, None] and LST[None, :] for objects x times
+    latitude = np.radians(latitude_deg)
+    return np.sin(latitude)*np.sin(DEC) + np.cos(latitude)*np.cos(DEC)*np.cos(LST - RA)
@@ -4,62 +4,71 @@
 # Display the entries that meet the user defined constraints
 # Export the filtered entries as a new .csv file
 
-import pandas as pd
+import numpy as np
+from catalog_cache import export_rows, load_catalog
+from catalog_filter import filter_catalog, print_rejection_counts
+from sky_coords import SkyIndex, catalog_coordinates, select_curve_types
 
-# Define rough filter values
-MIN_DECLINATION_VALUE_DEG = -10
-MAX_DECLINATION_VALUE_DEG = 10
-# Representing RA values using base 10 is (of course) a sin, BUT determining if one is bigger than the other is still possible
-MIN_RA_VALUE = 160000.0
-MAX_RA_VALUE = 230000.0
-MAX_PERIOD_VALUE = 15.0
-MIN_BRIGHTNESS = 8.0
+# Entries that are missing information are excluded before the actual filter constraints are applied
+# Unknown periods are stored as 0 in the catalog (missing once loaded from the catalog cache), both fail this constraint
+EXCLUSION_CONSTRAINTS = [
+    ("invalid period", "Period [d]", ">", 0),
+]
+
+# Define rough filter values as (name, column, operator, value), an entry is kept if it satisfies every constraint
+# The coordinates are compared in decimal degrees (declination) and decimal hours (RA)
+FILTER_CONSTRAINTS = [
+    ("declination", "DE [deg]", ">", -10),
+    ("declination", "DE [deg]", "<", 10),
+    ("right ascension", "RA [h]", ">=", 16.0),
+    ("right ascension", "RA [h]", "<=", 23.0),
+    ("period", "Period [d]", "<=", 15.0),
+    ("brightness", "MinI", "<=", 8.0),
+    ("brightness", "MinII", "<=", 8.0),
+]
 
 
 def main():
-    with open("CATALOGF_edited_final.CSV", encoding="UTF-8-sig") as catalog:
-        # Create a pandas dataframe object from the .csv file
-        catalog_df = pd.read_csv(catalog)
-        # Automatically exclude some entries before the user inputs are filtered
-        catalog_df = exclude_insufficient_entries(catalog_df)
-        catalog_df = filter_dataframe(catalog_df)
-        catalog_df.to_csv('candidates.csv', index=False)
+    # Load the catalog from the binary cache, which gets (re)compiled from the .csv file when necessary
+    catalog_df = load_catalog()
+    # Automatically exclude some entries before the user inputs are filtered
+    catalog_df = exclude_insufficient_entries(catalog_df)
+    catalog_df = filter_dataframe(catalog_df)
+    # The cache cleans the values for filtering, the exported rows keep the values of the catalog file
+    export_rows(catalog_df.index, 'candidates.csv')
 
 # Exclude entries that are missing period informations
-def exclude_insufficient_entries(catalog_df):
-    for index, row in catalog_df.iterrows():
-        # O is the placeholder for an unknown period
-        if row["Period [d]"] == 0:
-            print("Removing index {} due to invalid period".format(index))
-            # Remove this entry from the dataframe
-            catalog_df = catalog_df.drop(index=index, axis=0)  
+def exclude_insufficient_entries(catalog_df, constraints=EXCLUSION_CONSTRAINTS):
+    total_rows = len(catalog_df)
+    catalog_df, rejection_counts = filter_catalog(catalog_df, constraints)
+    print_rejection_counts(rejection_counts, total_rows)
     return catalog_df
 
-# Use the filter constraints defined at the start of the file to filter through the dataframe
-def filter_dataframe(catalog_df):
-    for index, row in catalog_df.iterrows():
-        # Check every entry for declination, min_ra, max_ra, min_period, max_period and min_brightness
-        # Connect the sign and value for the declination degree value to make comparing it easier
-        row_declination_value_deg = int(row["DE-"] + str(row["DEd"]))
-        # Convert the RA values of the row into one value that can be compared with the RA_VALUES defined at the top of the file
-        row_ra_value = row["RAh"]*10000 + row["RAm"]*100 + row["RAs"]
-        print(row_ra_value)
-        if row_declination_value_deg <= MIN_DECLINATION_VALUE_DEG or row_declination_value_deg >= MAX_DECLINATION_VALUE_DEG:
-            print("Removing index {} due to constraint declination".format(index))
-            catalog_df = catalog_df.drop(index=index, axis=0)
-        # Check right ascension
-        elif row_ra_value < MIN_RA_VALUE or row_ra_value > MAX_RA_VALUE:
-            print("Removing index {} due to constraint right ascension".format(index))
-            catalog_df = catalog_df.drop(index=index, axis=0) 
-        # Check period
-        elif row["Period [d]"] > MAX_PERIOD_VALUE:
-            print("Removing index {} due to constraint period".format(index))
-            catalog_df = catalog_df.drop(index=index, axis=0)
-        # Check brightness
-        elif row["MinI"] > MIN_BRIGHTNESS or row["MinII"] > MIN_BRIGHTNESS:
-            print("Removing index {} due to constraint brightness".format(index))
-            catalog_df = catalog_df.drop(index=index, axis=0)
+# Add the declination in degrees and the RA in hours as columns, including the arcminutes/arcseconds and minutes/seconds
+def add_coordinate_columns(catalog_df):
+    RA_RAD, DEC_RAD = catalog_coordinates(catalog_df)
+    catalog_df = catalog_df.assign(**{
+        "DE [deg]": np.degrees(DEC_RAD),
+        "RA [h]": np.degrees(RA_RAD)/15,
+    })
     return catalog_df
+
+# Use the filter constraints defined at the start of the file to filter through the dataframe
+def filter_dataframe(catalog_df, constraints=FILTER_CONSTRAINTS):
+    total_rows = len(catalog_df)
+    catalog_df = add_coordinate_columns(catalog_df)
+    catalog_df, rejection_counts = filter_catalog(catalog_df, constraints)
+    print_rejection_counts(rejection_counts, total_rows)
+    # The helper columns are not part of the catalog and shouldn't end up in the exported file
+    return catalog_df.drop(columns=["DE [deg]", "RA [h]"])
+
+# Find all the entries of the given light curve types within radius_deg of a field centre
+# Building the index is the expensive part, so when planning several fields pass the same SkyIndex every time
+def candidates_in_field(catalog_df, ra_deg, dec_deg, radius_deg, curve_types=("EA", "EB"), sky_index=None):
+    if sky_index is None:
+        sky_index = SkyIndex.from_catalog(catalog_df)
+    indices = select_curve_types(catalog_df, sky_index.cone(ra_deg, dec_deg, radius_deg), curve_types)
+    return catalog_df.iloc[indices]
         
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
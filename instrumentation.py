@@ -0,0 +1,214 @@
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, the maximum resident memory is left out there
+    resource = None
+
+# Timers, memory and counters for the stages of a reduction, written to a trace file
+# A stage is timed with a context manager or a decorator:
+#     with instrumentation.stage("read_tbl", file=file_path) as timer:
+#         ...
+#         timer.count("rows", len(VALUES))
+#     @instrumentation.timed("moving_average")
+# Tracing is off unless LIGHTCURVE_TRACE is set to the path of the trace file (or a script's --trace option is used).
+# When it's off, stage() returns a shared object that does nothing and timed functions are called directly,
+# so the instrumented code costs a check of a global variable.
+# A file ending in .jsonl gets one JSON object per stage, any other file is a Chrome trace ("Trace Event Format")
+# that can be opened in chrome://tracing or https://ui.perfetto.dev. Both are appended to one line per event, so the
+# worker processes of a batch run can write to the same file. The Chrome trace is left as an unterminated JSON array,
+# which the trace viewers accept, so an interrupted run still leaves a readable trace.
+# With LIGHTCURVE_TRACE_MEMORY=1 the peak memory allocated by every stage is measured with tracemalloc too,
+# which slows the allocations down noticeably. The maximum resident memory of the process is always recorded.
+
+TRACE_ENVIRONMENT_VARIABLE = "LIGHTCURVE_TRACE"
+MEMORY_ENVIRONMENT_VARIABLE = "LIGHTCURVE_TRACE_MEMORY"
+# ru_maxrss is in kilobytes on Linux (in bytes on macOS, where this overestimates it)
+MAXRSS_UNIT = 1024
+
+
+class Tracer:
+    def __init__(self, trace_file, memory=False):
+        self.trace_file = trace_file
+        self.chrome = not trace_file.endswith(".jsonl")
+        self.memory = memory
+        self.local = threading.local()
+        self.file_descriptor = None
+        self.pid = None
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def open(self):
+        # Opened on the first event of every process, a forked worker doesn't share the descriptor of its parent
+        if self.pid == os.getpid():
+            return self.file_descriptor
+        directory = os.path.dirname(self.trace_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if self.chrome:
+            # The process that creates the file starts the JSON array
+            try:
+                file_descriptor = os.open(self.trace_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_APPEND, 0o644)
+                os.write(file_descriptor, b"[\n")
+                os.close(file_descriptor)
+            except FileExistsError:
+                pass
+        self.file_descriptor = os.open(self.trace_file, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self.pid = os.getpid()
+        return self.file_descriptor
+
+    def stack(self):
+        if not hasattr(self.local, "stack"):
+            self.local.stack = []
+        return self.local.stack
+
+    def write(self, timer):
+        if self.chrome:
+            event = {
+                "name": timer.name, "cat": "stage", "ph": "X", "ts": timer.start_us, "dur": timer.seconds*1e6,
+                "pid": os.getpid(), "tid": threading.get_ident(), "args": dict(timer.args, **timer.counters),
+            }
+        else:
+            event = dict(timer.args, stage=timer.name, start=timer.start_us/1e6, seconds=timer.seconds, pid=os.getpid(), **timer.counters)
+        # A single write per event, appends of one line don't interleave with the lines of other processes
+        line = json.dumps(event, default=repr) + (",\n" if self.chrome else "\n")
+        os.write(self.open(), line.encode())
+
+    def close(self):
+        if self.file_descriptor is not None and self.pid == os.getpid():
+            os.close(self.file_descriptor)
+        self.file_descriptor = self.pid = None
+
+
+class StageTimer:
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+        self.counters = {}
+        # Peak of the stages nested in this one, they reset tracemalloc's peak
+        self.nested_peak = 0
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def __enter__(self):
+        stack = self.tracer.stack()
+        if self.tracer.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if stack:
+                stack[-1].nested_peak = max(stack[-1].nested_peak, peak)
+            self.start_memory = current
+            tracemalloc.reset_peak()
+        stack.append(self)
+        self.start_us = time.time_ns()/1000
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.seconds = time.perf_counter() - self.start
+        stack = self.tracer.stack()
+        stack.pop()
+        if exc_info[0] is not None:
+            self.args["error"] = exc_info[0].__name__
+        if self.tracer.memory:
+            peak = max(tracemalloc.get_traced_memory()[1], self.nested_peak)
+            # Memory allocated on top of what was allocated when the stage started
+            self.counters["peak_bytes"] = peak - self.start_memory
+            if stack:
+                stack[-1].nested_peak = max(stack[-1].nested_peak, peak)
+        if resource is not None:
+            self.counters["max_rss_bytes"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*MAXRSS_UNIT
+        self.tracer.write(self)
+        return False
+
+
+class NullTimer:
+    # What stage() returns while tracing is off
+    def count(self, name, value=1):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_TIMER = NullTimer()
+_tracer = None
+
+
+def enable(trace_file, memory=False):
+    # Also sets the environment variables, so worker processes that are started later trace into the same file
+    global _tracer
+    disable()
+    _tracer = Tracer(trace_file, memory)
+    os.environ[TRACE_ENVIRONMENT_VARIABLE] = trace_file
+    os.environ[MEMORY_ENVIRONMENT_VARIABLE] = "1" if memory else "0"
+    return _tracer
+
+
+def disable():
+    global _tracer
+    if _tracer is not None:
+        _tracer.close()
+    _tracer = None
+    os.environ.pop(TRACE_ENVIRONMENT_VARIABLE, None)
+
+
+def enabled():
+    return _tracer is not None
+
+
+def stage(name, **args):
+    # Context manager that times the code in it, args are written to the trace with the timing
+    if _tracer is None:
+        return NULL_TIMER
+    return StageTimer(_tracer, name, args)
+
+
+def count(name, value=1):
+    # Add to a counter of the innermost running stage
+    if _tracer is None:
+        return
+    stack = _tracer.stack()
+    if stack:
+        stack[-1].count(name, value)
+
+
+def timed(name=None):
+    # Decorator that times every call of a function as a stage, named after the function by default
+    def decorator(function):
+        stage_name = name or function.__qualname__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _tracer is None:
+                return function(*args, **kwargs)
+            with StageTimer(_tracer, stage_name, {}):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def add_arguments(parser):
+    # The --trace and --trace-memory options of the scripts
+    parser.add_argument("--trace", metavar="FILE", help="write a trace of the stages to FILE (.jsonl for JSON lines, Chrome trace otherwise)")
+    parser.add_argument("--trace-memory", action="store_true", help="also measure the peak memory of every stage (slower)")
+
+
+def configure(args):
+    if args.trace:
+        enable(args.trace, args.trace_memory)
+
+
+# Tracing that is switched on by the environment, also in worker processes that import this module
+if os.environ.get(TRACE_ENVIRONMENT_VARIABLE):
+    _tracer = Tracer(os.environ[TRACE_ENVIRONMENT_VARIABLE], os.environ.get(MEMORY_ENVIRONMENT_VARIABLE, "0") == "1")
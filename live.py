@@ -0,0 +1,236 @@
+import argparse
+import json
+import os
+import sys
+import time
+import numpy as np
+import calibration
+import instrumentation
+from ensemble import comparison_apertures
+from rolling import TrailingWindow
+from tbl_reader import EXPTIME_COLUMN, TIME_COLUMN, aperture_columns
+
+# Follow mode for a measurement table that AstroImageJ is still writing to
+# The table is polled, and only the bytes appended since the last poll are read and parsed. A line that is only
+# partially written is left for the next poll. Every new frame updates the light curve in O(1):
+#  - the flux of the target from its own columns
+#  - the ensemble of comparison stars, normalized by their median over the first frames of the night and weighted
+#    by their mean SNR squared (rejecting variable comparison stars needs the whole night, see ensemble.py)
+#  - the magnitude with the calibration of the night, looked up once
+#  - the mean and standard deviation over the last frames (a centred window would need frames from the future)
+# The frames are printed as JSON lines or drawn into a plot that is refreshed after every poll.
+# Usage: python live.py lightcurves/binary_stars/[FILE].tbl [--json] [--interval 10]
+
+POLL_INTERVAL = 10.0
+# Frames used for the reference level of every comparison star, after that the level is fixed
+WARMUP_FRAMES = 20
+ROLLING_WINDOW_SIZE = 20
+
+
+class TableTail:
+    # Reads the lines that were appended to a tab separated table since the last call of poll
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.offset = 0
+        self.columns = None
+
+    def poll(self):
+        # Returns the complete new lines split into their fields, the header line is stored in self.columns
+        if not os.path.isfile(self.file_path):
+            return []
+        with open(self.file_path, "rb") as file:
+            size = os.fstat(file.fileno()).st_size
+            if size < self.offset:
+                # The table was written again from scratch (e.g. AstroImageJ was restarted)
+                self.offset = 0
+                self.columns = None
+            file.seek(self.offset)
+            data = file.read(size - self.offset)
+        end = data.rfind(b"\n")
+        if end < 0:
+            return []
+        self.offset += end + 1
+        lines = data[:end + 1].decode("utf-8").splitlines()
+        if self.columns is None and lines:
+            self.columns = lines.pop(0).rstrip("\r").split("\t")
+        return [line.rstrip("\r").split("\t") for line in lines if line.strip()]
+
+
+class GrowingArray:
+    # Float array that is appended to in amortized O(1), by doubling its capacity when it's full
+    def __init__(self, capacity=256):
+        self.data = np.empty(capacity)
+        self.size = 0
+
+    def append(self, value):
+        if self.size == len(self.data):
+            self.data = np.concatenate((self.data, np.empty(len(self.data))))
+        self.data[self.size] = value
+        self.size += 1
+
+    def values(self):
+        return self.data[:self.size]
+
+
+class IncrementalEnsemble:
+    # The ensemble normalization of ensemble.py, updated one frame at a time
+    def __init__(self, n_stars, warmup_frames=WARMUP_FRAMES):
+        self.warmup = np.full((warmup_frames, n_stars), np.nan)
+        self.frames = 0
+        self.reference = np.full(n_stars, np.nan)
+        self.snr_sum = np.zeros(n_stars)
+        self.snr_count = np.zeros(n_stars)
+
+    def update(self, COUNTS, SNR=None):
+        # Returns the normalization of this frame (1 for a frame at the reference level)
+        if self.frames < len(self.warmup):
+            self.warmup[self.frames] = COUNTS
+            with np.errstate(all="ignore"):
+                self.reference = np.nanmedian(self.warmup[:self.frames + 1], axis=0)
+        self.frames += 1
+        if SNR is not None:
+            VALID = np.isfinite(SNR)
+            self.snr_sum[VALID] += SNR[VALID]**2
+            self.snr_count[VALID] += 1
+        with np.errstate(all="ignore"):
+            WEIGHTS = self.snr_sum/self.snr_count if SNR is not None else np.ones(len(COUNTS))
+            NORMALIZED = COUNTS/self.reference
+            VALID = np.isfinite(NORMALIZED) & np.isfinite(WEIGHTS) & (WEIGHTS > 0)
+            return float(np.sum(NORMALIZED[VALID]*WEIGHTS[VALID])/np.sum(WEIGHTS[VALID])) if VALID.any() else np.nan
+
+
+class LiveLightCurve:
+    def __init__(self, file_path, aperture="T1", window_size=ROLLING_WINDOW_SIZE, warmup_frames=WARMUP_FRAMES):
+        self.tail = TableTail(file_path)
+        self.aperture = aperture
+        self.window_size = window_size
+        self.warmup_frames = warmup_frames
+        self.indices = None
+        self.reset()
+
+    def reset(self):
+        # Forget all the frames, e.g. when the table was written again from scratch
+        self.window = TrailingWindow(self.window_size)
+        self.ensemble = None
+        self.calibration = None
+        self.times = GrowingArray()
+        self.mags = GrowingArray()
+        self.means = GrowingArray()
+
+    def resolve_columns(self, columns):
+        # Called for the first header and for every rewritten table, whose frames replace the ones seen so far
+        self.reset()
+        position = {column: i for i, column in enumerate(columns)}
+        apertures = comparison_apertures(columns)
+        self.indices = {
+            "columns": columns,
+            "time": position[TIME_COLUMN],
+            "exptime": position[EXPTIME_COLUMN],
+            "target": [position[column] for column in aperture_columns(self.aperture)],
+            "counts": [position["Source-Sky_{}".format(aperture)] for aperture in apertures],
+            "snr": [position.get("Source_SNR_{}".format(aperture)) for aperture in apertures],
+        }
+        self.ensemble = IncrementalEnsemble(len(apertures), self.warmup_frames)
+
+    def add_frame(self, fields):
+        values = lambda indices: np.array([float(fields[i]) for i in indices])
+        julian_date = float(fields[self.indices["time"]])
+        source_counts, sky_per_pixel, n_sky_pixels = values(self.indices["target"])
+        normalization = self.ensemble.update(values(self.indices["counts"]), values(self.indices["snr"]) if None not in self.indices["snr"] else None)
+        # Background subtracted flux in ADU/s, once with and once without the correction by the comparison stars
+        background_counts = sky_per_pixel*n_sky_pixels
+        exp_time = float(fields[self.indices["exptime"]])
+        flux = float((source_counts - background_counts)/exp_time)
+        adjusted_flux = float((source_counts/normalization - background_counts)/exp_time)
+        if self.calibration is None:
+            self.calibration = calibration.lookup("astroimagej", None, calibration.night_of(julian_date))
+        with np.errstate(all="ignore"):
+            mag = float(calibration.apply_calibration(-2.5*np.log10(adjusted_flux), self.calibration))
+        self.window.push(mag)
+        self.times.append(julian_date)
+        self.mags.append(mag)
+        self.means.append(self.window.mean())
+        return {
+            "jd": julian_date,
+            "flux": flux,
+            "adjusted_flux": adjusted_flux,
+            "normalization": normalization,
+            "mag": mag,
+            "rolling_mean": float(self.window.mean()),
+            "rolling_std": self.window.std(),
+        }
+
+    def poll(self):
+        # Process the frames that were appended since the last poll, returns one dict per new frame
+        with instrumentation.stage("poll") as timer:
+            lines = self.tail.poll()
+            if self.tail.columns is None:
+                return []
+            # Also after the table was written again from scratch, its columns may have changed
+            if self.indices is None or self.indices["columns"] is not self.tail.columns:
+                self.resolve_columns(self.tail.columns)
+            timer.count("frames", len(lines))
+            return [self.add_frame(fields) for fields in lines]
+
+
+def json_safe(value):
+    return None if isinstance(value, float) and not np.isfinite(value) else value
+
+
+def follow_json(lightcurve, interval, once=False):
+    while True:
+        for frame in lightcurve.poll():
+            sys.stdout.write(json.dumps({key: json_safe(value) for key, value in frame.items()}) + "\n")
+        sys.stdout.flush()
+        if once:
+            return
+        time.sleep(interval)
+
+
+def follow_plot(lightcurve, interval, once=False):
+    from matplotlib import pyplot as plt
+
+    plt.ion()
+    fig, ax = plt.subplots()
+    ax.set_title("Live LC for {}".format(os.path.basename(lightcurve.tail.file_path)))
+    ax.set_xlabel("Julian Date -2400000")
+    ax.set_ylabel("mag")
+    ax.ticklabel_format(useOffset=False)
+    ax.invert_yaxis()
+    points, = ax.plot([], [], "o")
+    smoothed, = ax.plot([], [])
+    while plt.fignum_exists(fig.number):
+        if lightcurve.poll():
+            points.set_data(lightcurve.times.values(), lightcurve.mags.values())
+            smoothed.set_data(lightcurve.times.values(), lightcurve.means.values())
+            ax.relim()
+            ax.autoscale_view()
+        if once:
+            return fig
+        plt.pause(interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Follow an AstroImageJ measurement table while it's being written")
+    parser.add_argument("file", help="the .tbl file to follow")
+    parser.add_argument("--json", action="store_true", help="print every new frame as a JSON line instead of plotting")
+    parser.add_argument("--interval", type=float, default=POLL_INTERVAL, help="seconds between two polls")
+    parser.add_argument("--window", type=int, default=ROLLING_WINDOW_SIZE, help="frames in the rolling mean")
+    parser.add_argument("--aperture", default="T1")
+    parser.add_argument("--once", action="store_true", help="process what is in the table now and exit")
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    instrumentation.configure(args)
+
+    lightcurve = LiveLightCurve(args.file, args.aperture, args.window)
+    try:
+        if args.json:
+            follow_json(lightcurve, args.interval, args.once)
+        else:
+            follow_plot(lightcurve, args.interval, args.once)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
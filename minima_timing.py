@@ -0,0 +1,255 @@
+import argparse
+import csv
+import glob
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from scipy.signal import find_peaks
+
+from designations import designation_from_file_name, target_metadata
+import paths
+from rolling import rolling_median
+from time_correction import corrected_times, target_coordinates
+
+# Times of minimum of eclipsing binaries
+# Eclipses are found automatically as the faint peaks of the (smoothed) magnitude curve and every eclipse is timed with
+#  - Kwee & van Woerden (1956): the time about which the light curve is most symmetric
+#  - a parabola fitted to the magnitudes of the eclipse, with a bootstrap uncertainty
+# The windows of all the eclipses of a night are padded into one (eclipses x samples) array,
+# so both methods time all the minima with array operations. Nights are handled by a pool of worker processes.
+# The timings are compared to the ephemeris (epoch + cycle*period) and written to an O-C table.
+# Minima are timed in BJD_TDB (see time_correction.py) when the coordinates of the target are known, the light time
+# across the orbit of the earth would otherwise shift them by up to 8 minutes over a season.
+# Usage: python minima_timing.py [files ...] [--epoch T0] [--period P] [--output minima_timings.csv]
+
+DEFAULT_FILES = paths.lightcurve_path("binary_stars", "*.tbl")
+DEFAULT_OUTPUT_FILE = "minima_timings.csv"
+# Half width of the window around a minimum as a fraction of the period, or in days if the period is unknown
+WINDOW_FRACTION = 0.08
+DEFAULT_HALF_WIDTH = 0.03
+# A minimum has to be at least this deep (in mag) to be timed
+MIN_DEPTH = 0.05
+# Both branches of a minimum need this many samples, otherwise it is only partially covered
+MIN_SAMPLES_PER_SIDE = 8
+KVW_GRID_POINTS = 41
+# The parabola is fitted to the samples within this fraction of the depth from the bottom of the eclipse
+PARABOLA_DEPTH_FRACTION = 0.5
+BOOTSTRAP_SAMPLES = 200
+
+
+def find_eclipse_windows(TIMES, MAGS, period=None, half_width=None, min_depth=MIN_DEPTH):
+    # Start and end index (exclusive) of the samples around every fully covered minimum
+    if half_width is None:
+        half_width = WINDOW_FRACTION*period if period else DEFAULT_HALF_WIDTH
+    if len(TIMES) < 2*MIN_SAMPLES_PER_SIDE:
+        return []
+    SMOOTHED = rolling_median(MAGS, times=TIMES, width=half_width)
+    cadence = np.median(np.diff(TIMES))
+    # Primary and secondary minima are at least about half a period apart
+    separation = 0.4*period if period else half_width
+    # Minima are the maxima of the magnitude
+    PEAKS, _ = find_peaks(SMOOTHED, distance=max(int(separation/cadence), 1), prominence=min_depth)
+    STARTS = np.searchsorted(TIMES, TIMES[PEAKS] - half_width, side="left")
+    ENDS = np.searchsorted(TIMES, TIMES[PEAKS] + half_width, side="right")
+    # Drop minima at the start or end of the night of which only one branch was observed
+    COVERED = (PEAKS - STARTS >= MIN_SAMPLES_PER_SIDE) & (ENDS - PEAKS > MIN_SAMPLES_PER_SIDE)
+    COVERED &= (TIMES[PEAKS] - TIMES[STARTS] >= half_width/2) & (TIMES[ENDS - 1] - TIMES[PEAKS] >= half_width/2)
+    return list(zip(STARTS[COVERED], ENDS[COVERED]))
+
+
+def pad_windows(TIMES, MAGS, windows):
+    # Stack the windows into (minima x samples) arrays, the times are relative to the centre of every window
+    # MASK is False for the padding
+    length = max((end - start for start, end in windows), default=0)
+    CENTRES = np.array([(TIMES[start] + TIMES[end - 1])/2 for start, end in windows])
+    X = np.zeros((len(windows), length))
+    Y = np.zeros((len(windows), length))
+    MASK = np.zeros((len(windows), length), dtype=bool)
+    for row, (start, end) in enumerate(windows):
+        X[row, :end - start] = TIMES[start:end] - CENTRES[row]
+        Y[row, :end - start] = MAGS[start:end]
+        MASK[row, :end - start] = True
+    return CENTRES, X, Y, MASK
+
+
+def parabola_vertices(X, Y, WEIGHTS):
+    # Weighted least squares parabola through every row (the leading axes are batch axes), returns the time of its vertex
+    # The normal equations of all the fits are solved at once
+    # Scale the times to about +-1, otherwise the normal equations are badly conditioned
+    scale = np.max(np.abs(X)) or 1.0
+    X = X/scale
+    POWERS = [np.sum(WEIGHTS*X**k, axis=-1) for k in range(5)]
+    MOMENTS = [np.sum(WEIGHTS*X**k*Y, axis=-1) for k in range(3)]
+    A = np.stack([np.stack(POWERS[i:i + 3], axis=-1) for i in range(3)], axis=-2)
+    B = np.stack(MOMENTS, axis=-1)
+    # Degenerate fits (too few samples) get NaN instead of raising
+    SINGULAR = np.abs(np.linalg.det(A)) < 1e-12
+    A[SINGULAR] = np.eye(3)
+    COEFFICIENTS = np.linalg.solve(A, B[..., None])[..., 0]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        VERTICES = -COEFFICIENTS[..., 1]/(2*COEFFICIENTS[..., 2])*scale
+    VERTICES[SINGULAR] = np.nan
+    return VERTICES
+
+
+def parabola_timings(X, Y, MASK, bootstrap_samples=BOOTSTRAP_SAMPLES, seed=0):
+    # Times of minimum (relative to the window centres) and their bootstrap standard deviations
+    # An eclipse is only shaped like a parabola close to its bottom, so only the deepest part of every window is fitted
+    Y_MIN = np.where(MASK, Y, np.inf).min(axis=1, keepdims=True)
+    Y_MAX = np.where(MASK, Y, -np.inf).max(axis=1, keepdims=True)
+    WEIGHTS = (MASK & (Y >= Y_MAX - PARABOLA_DEPTH_FRACTION*(Y_MAX - Y_MIN))).astype(float)
+    # The bootstrap uses Poisson weights, which resamples all the minima at once without drawing indices per window
+    VERTICES = parabola_vertices(X, Y, WEIGHTS)
+    rng = np.random.default_rng(seed)
+    BOOTSTRAP_WEIGHTS = rng.poisson(1.0, (bootstrap_samples,) + MASK.shape)*WEIGHTS
+    BOOTSTRAP_VERTICES = parabola_vertices(X, Y, BOOTSTRAP_WEIGHTS)
+    return VERTICES, np.nanstd(BOOTSTRAP_VERTICES, axis=0)
+
+
+def interpolate_rows(X, Y, MASK, GRID):
+    # np.interp for every row at once: the rows are put one after another on a single axis by offsetting them
+    span = 2*(np.max(np.abs(X[MASK])) if MASK.any() else 1.0) + 1
+    OFFSETS = np.arange(len(X))[:, None]*span
+    return np.interp((GRID + OFFSETS).ravel(), (X + OFFSETS)[MASK], Y[MASK]).reshape(GRID.shape)
+
+
+def kwee_van_woerden(X, Y, MASK, n_points=KVW_GRID_POINTS):
+    # Kwee & van Woerden (1956) for every row: the light curve is interpolated to n_points evenly spaced samples,
+    # mirrored about every trial time and the sum of squared differences S(T) of the two branches is computed.
+    # A parabola through the smallest S(T) and its neighbours gives the time of minimum and its error.
+    X_MIN = np.where(MASK, X, np.inf).min(axis=1)
+    X_MAX = np.where(MASK, X, -np.inf).max(axis=1)
+    STEP = (X_MAX - X_MIN)/(n_points - 1)
+    GRID = X_MIN[:, None] + STEP[:, None]*np.arange(n_points)
+    CURVES = interpolate_rows(X, Y, MASK, GRID)
+
+    # Every trial time uses the same number of mirrored pairs
+    pairs = (n_points - 1)//4
+    CENTRES = np.arange(pairs, n_points - pairs)
+    OFFSETS = np.arange(1, pairs + 1)
+    DIFFERENCES = CURVES[:, CENTRES[:, None] + OFFSETS] - CURVES[:, CENTRES[:, None] - OFFSETS]
+    S = np.sum(DIFFERENCES**2, axis=2)/pairs
+
+    rows = np.arange(len(X))
+    BEST = np.clip(np.argmin(S, axis=1), 1, len(CENTRES) - 2)
+    S_MINUS, S_ZERO, S_PLUS = S[rows, BEST - 1], S[rows, BEST], S[rows, BEST + 1]
+    # S(T) = a*T^2 + b*T + c around the trial time of the smallest S
+    A = (S_PLUS + S_MINUS - 2*S_ZERO)/(2*STEP**2)
+    B = (S_PLUS - S_MINUS)/(2*STEP)
+    C = S_ZERO
+    with np.errstate(invalid="ignore", divide="ignore"):
+        VERTICES = GRID[rows, CENTRES[BEST]] - B/(2*A)
+        # Number of independent pairs of the interpolated light curve
+        z = (2*pairs + 1)/4
+        ERRORS = np.sqrt((4*A*C - B**2)/(4*A**2*(z - 1)))
+    return VERTICES, ERRORS
+
+
+def time_minima(TIMES, MAGS, windows):
+    # Returns one dict per window with the timings of both methods
+    if not windows:
+        return []
+    CENTRES, X, Y, MASK = pad_windows(TIMES, MAGS, windows)
+    KVW_TIMES, KVW_ERRORS = kwee_van_woerden(X, Y, MASK)
+    PARABOLA_TIMES, PARABOLA_ERRORS = parabola_timings(X, Y, MASK)
+    DEPTHS = np.array([np.max(MAGS[start:end]) - np.min(MAGS[start:end]) for start, end in windows])
+    return [
+        {"kvw": CENTRES[i] + KVW_TIMES[i], "kvw_error": KVW_ERRORS[i],
+         "parabola": CENTRES[i] + PARABOLA_TIMES[i], "parabola_error": PARABOLA_ERRORS[i],
+         "depth": DEPTHS[i], "samples": int(MASK[i].sum())}
+        for i in range(len(windows))
+    ]
+
+
+def time_night(file_path, period=None):
+    # Find and time all the minima in a .tbl file, this is what the worker processes run
+    from plot_binary_astroimagej import calculate_flux_from_file, flux_to_magnitude
+
+    JULIAN_DATES, FLUX_PER_SECOND, _ = calculate_flux_from_file(file_path)
+    MAGS = flux_to_magnitude(FLUX_PER_SECOND)
+    coordinates = target_coordinates(file_path)
+    time_scale = "JD_UTC"
+    if coordinates is not None:
+        _, JULIAN_DATES = corrected_times(JULIAN_DATES, *coordinates)
+        time_scale = "BJD_TDB"
+    FINITE = np.isfinite(JULIAN_DATES) & np.isfinite(MAGS)
+    ORDER = np.argsort(JULIAN_DATES[FINITE], kind="stable")
+    TIMES, MAGS = JULIAN_DATES[FINITE][ORDER], MAGS[FINITE][ORDER]
+    timings = time_minima(TIMES, MAGS, find_eclipse_windows(TIMES, MAGS, period))
+    for timing in timings:
+        timing["night"] = os.path.splitext(os.path.basename(file_path))[0]
+        timing["time_scale"] = time_scale
+    return timings
+
+
+def observed_minus_calculated(TIMINGS, epoch, period):
+    # Cycle number (half cycles are secondary minima) and O-C in days for every time of minimum
+    CYCLES = np.round(2*(np.asarray(TIMINGS) - epoch)/period)/2
+    return CYCLES, TIMINGS - (epoch + CYCLES*period)
+
+
+def time_files(file_paths, period=None, workers=None):
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        nights = executor.map(time_night, file_paths, [period]*len(file_paths))
+        return [timing for night in nights for timing in night]
+
+
+def o_c_table(timings, epoch, period, method="kvw"):
+    # Adds the cycle, type of minimum and O-C (in days) of the chosen method to every timing
+    if not timings:
+        return timings
+    CYCLES, O_C = observed_minus_calculated(np.array([timing[method] for timing in timings]), epoch, period)
+    for timing, cycle, o_c in zip(timings, CYCLES, O_C):
+        timing.update({"cycle": float(cycle), "type": "primary" if cycle == np.floor(cycle) else "secondary", "o_c": float(o_c)})
+    return timings
+
+
+def write_table(timings, file_path):
+    columns = ["target", "night", "kvw", "kvw_error", "parabola", "parabola_error", "depth", "samples", "cycle", "type", "o_c", "time_scale"]
+    with open(file_path, "w", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=columns, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the eclipse minima in AstroImageJ tables and compare them to the ephemeris")
+    parser.add_argument("files", nargs="*", help="tables to process (default: {})".format(DEFAULT_FILES))
+    parser.add_argument("--period", type=float, default=None, help="period in days (default: the catalog period of every target)")
+    parser.add_argument("--epoch", type=float, default=None, help="epoch of primary minimum in BJD_TDB-2400000 (default: the first timed minimum)")
+    parser.add_argument("--method", choices=["kvw", "parabola"], default="kvw", help="timing used for the O-C values")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--output", default=DEFAULT_OUTPUT_FILE)
+    args = parser.parse_args()
+
+    file_paths = args.files or sorted(glob.glob(DEFAULT_FILES))
+    # Every target gets its own ephemeris, so the files are grouped by target first
+    targets = {}
+    for file_path in file_paths:
+        targets.setdefault(designation_from_file_name(file_path) or file_path, []).append(file_path)
+
+    table = []
+    for target, target_files in targets.items():
+        period = args.period
+        if period is None:
+            metadata = target_metadata(target_files[0])
+            period = metadata["Period [d]"] if metadata is not None else None
+        if period is None or not np.isfinite(period):
+            print("{}: no period known, skipping".format(target))
+            continue
+        timings = sorted(time_files(target_files, period, args.workers), key=lambda timing: timing[args.method])
+        if not timings:
+            print("{}: no fully covered minima found".format(target))
+            continue
+        epoch = args.epoch if args.epoch is not None else timings[0][args.method]
+        for timing in o_c_table(timings, epoch, period, args.method):
+            timing["target"] = target
+            table.append(timing)
+        print("{}: timed {} minima".format(target, len(timings)))
+
+    write_table(table, args.output)
+    print("O-C table written to {}".format(args.output))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+import glob
+import json
+import os
+import numpy as np
+import paths
+
+# Merge repeated observations (nights) of the same target into one light curve
+# Every night is shifted to a common zero point before it is merged, because the conditions (and with them the
+# magnitude offset) change from night to night. The merged samples are kept sorted by time with duplicates removed.
+# Nights are appended incrementally: a new night is merged into the existing arrays, the old nights aren't touched again.
+# The store is saved as a .npz file per target, so adding a night doesn't mean reducing all the other ones again.
+
+MERGED_DIR = paths.lightcurve_path("merged")
+# Samples closer together than this (in days, ~10ms) are the same frame
+DEDUP_TOLERANCE = 1e-7
+# The zero point of a night is this percentile of its magnitudes, i.e. the level close to maximum light
+# (the median would depend on how much of the night was spent in eclipse)
+ZERO_POINT_PERCENTILE = 10
+
+
+def zero_point(MAGS, percentile=ZERO_POINT_PERCENTILE):
+    return float(np.nanpercentile(MAGS, percentile))
+
+
+class MergedLightCurve:
+    def __init__(self, target):
+        self.target = target
+        self.times = np.empty(0)
+        self.mags = np.empty(0)
+        # Index into self.nights of the night every sample comes from
+        self.night_ids = np.empty(0, dtype=np.int32)
+        # One dict per night with its name, the applied offset and the number of merged samples
+        self.nights = []
+        self.reference_level = None
+
+    def __len__(self):
+        return len(self.times)
+
+    def night_names(self):
+        return [night["name"] for night in self.nights]
+
+    def append_night(self, name, TIMES, MAGS, offset=None):
+        # Merge a night into the store, returns False if a night with this name was merged before
+        # The offset that is added to the magnitudes defaults to the one that brings the night to the zero point of the first night
+        if name in self.night_names():
+            return False
+        TIMES = np.asarray(TIMES, dtype=float)
+        MAGS = np.asarray(MAGS, dtype=float)
+        FINITE = np.isfinite(TIMES) & np.isfinite(MAGS)
+        ORDER = np.argsort(TIMES[FINITE], kind="stable")
+        TIMES = TIMES[FINITE][ORDER]
+        MAGS = MAGS[FINITE][ORDER]
+        if offset is None:
+            level = zero_point(MAGS) if len(MAGS) else 0.0
+            if self.reference_level is None:
+                self.reference_level = level
+            offset = self.reference_level - level
+
+        # Drop samples that are already in the store (e.g. the same frames exported twice) and duplicates within the night
+        POSITIONS = np.searchsorted(self.times, TIMES)
+        KEEP = np.ones(len(TIMES), dtype=bool)
+        if len(self.times):
+            BEFORE = self.times[np.clip(POSITIONS - 1, 0, len(self.times) - 1)]
+            AFTER = self.times[np.clip(POSITIONS, 0, len(self.times) - 1)]
+            KEEP &= (np.abs(TIMES - BEFORE) > DEDUP_TOLERANCE) & (np.abs(TIMES - AFTER) > DEDUP_TOLERANCE)
+        KEEP[1:] &= np.diff(TIMES) > DEDUP_TOLERANCE
+
+        # One insert for the whole night, which is a single pass over the existing arrays
+        night_id = len(self.nights)
+        self.times = np.insert(self.times, POSITIONS[KEEP], TIMES[KEEP])
+        self.mags = np.insert(self.mags, POSITIONS[KEEP], MAGS[KEEP] + offset)
+        self.night_ids = np.insert(self.night_ids, POSITIONS[KEEP], night_id)
+        self.nights.append({"name": name, "offset": float(offset), "samples": int(np.count_nonzero(KEEP))})
+        return True
+
+    def save(self, file_path):
+        os.makedirs(os.path.dirname(file_path) or ".", exist_ok=True)
+        header = json.dumps({"target": self.target, "nights": self.nights, "reference_level": self.reference_level})
+        # np.savez appends .npz to the name, write to a temporary file first so an interrupted save doesn't corrupt the store
+        temporary_path = file_path + ".tmp.npz"
+        np.savez(temporary_path, times=self.times, mags=self.mags, night_ids=self.night_ids, header=np.array(header))
+        os.replace(temporary_path, file_path)
+
+    @classmethod
+    def load(cls, file_path):
+        with np.load(file_path) as data:
+            header = json.loads(str(data["header"]))
+            merged = cls(header["target"])
+            merged.times = data["times"]
+            merged.mags = data["mags"]
+            merged.night_ids = data["night_ids"]
+        merged.nights = header["nights"]
+        merged.reference_level = header["reference_level"]
+        return merged
+
+    def phases(self, epoch, period):
+        return phase_fold(self.times, epoch, period)
+
+    def binned(self, epoch, period, n_bins=100):
+        return phase_bin(self.phases(epoch, period), self.mags, n_bins)
+
+
+def phase_fold(TIMES, epoch, period):
+    # Phase between 0 and 1 of every sample, phase 0 is at the epoch (e.g. the time of primary minimum)
+    PHASES = (np.asarray(TIMES, dtype=float) - epoch)/period
+    return PHASES - np.floor(PHASES)
+
+
+def phase_bin(PHASES, VALUES, n_bins=100):
+    # Mean, standard deviation and number of samples in n_bins equal phase bins, all computed with bincount
+    # Empty bins are NaN
+    BINS = np.minimum((PHASES*n_bins).astype(np.intp), n_bins - 1)
+    COUNTS = np.bincount(BINS, minlength=n_bins)
+    SUMS = np.bincount(BINS, weights=VALUES, minlength=n_bins)
+    SQUARES = np.bincount(BINS, weights=VALUES**2, minlength=n_bins)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        MEANS = SUMS/COUNTS
+        STDS = np.sqrt(np.clip(SQUARES/COUNTS - MEANS**2, 0, None))
+    CENTERS = (np.arange(n_bins) + 0.5)/n_bins
+    return CENTERS, MEANS, STDS, COUNTS
+
+
+def store_path(target):
+    return os.path.join(MERGED_DIR, "{}.npz".format(target))
+
+
+def load_or_create(target):
+    file_path = store_path(target)
+    if os.path.isfile(file_path):
+        return MergedLightCurve.load(file_path)
+    return MergedLightCurve(target)
+
+
+def update_store(target, directory=paths.lightcurve_path("binary_stars")):
+    # Merge all the nights of a target (files named [target]Obs[N].tbl) that aren't in its store yet
+    # The nights go through the same cached reduction as the plots (calibrated per night), the frames the quality
+    # filter rejected are left out
+    from plot_binary_astroimagej import reduce_file
+
+    merged = load_or_create(target)
+    known_nights = set(merged.night_names())
+    for file_path in sorted(glob.glob(os.path.join(directory, "{}Obs*.tbl".format(target)))):
+        name = os.path.splitext(os.path.basename(file_path))[0]
+        if name in known_nights:
+            continue
+        arrays = reduce_file(file_path)
+        merged.append_night(name, arrays["JULIAN_DATES"], np.where(arrays["REJECTED_BY"] == 0, arrays["MAGS"], np.nan))
+        print("Merged {}".format(name))
+    merged.save(store_path(target))
+    return merged
+
+
+def main():
+    from matplotlib import pyplot as plt
+    from designations import target_metadata
+    from downsampling import plot_downsampled
+
+    target = input("Specify the target whose nights should be merged (files: {}): ".format(paths.lightcurve_path("binary_stars", "[INPUT]Obs*.tbl")))
+    merged = update_store(target)
+    if len(merged) == 0:
+        print("No observations found.")
+        return
+    print("{} samples from {} nights".format(len(merged), len(merged.nights)))
+
+    metadata = target_metadata(target)
+    if metadata is None or not np.isfinite(metadata["Period [d]"]):
+        print("No catalog period, can't fold the light curve.")
+        return
+    period = metadata["Period [d]"]
+    # Without a published epoch, phase 0 is put at the faintest sample
+    epoch = merged.times[np.argmax(merged.mags)]
+    CENTERS, MEANS, STDS, _ = merged.binned(epoch, period)
+
+    fig, ax = plt.subplots()
+    ax.set_title("Phase folded LC for {} (P = {}d)".format(target, period))
+    ax.set_xlabel("Phase")
+    ax.set_ylabel("mag")
+    # A merged season can have millions of samples, only what fits on the screen is drawn
+    plot_downsampled(ax, merged.phases(epoch, period), merged.mags, ".", alpha=0.3)
+    ax.errorbar(CENTERS, MEANS, yerr=STDS, fmt="o", color="red")
+    ax.invert_yaxis()
+    plt.show()
+
+
+if __name__ == "__main__":
+    main()
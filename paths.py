@@ -0,0 +1,19 @@
+import os
+
+# Locations of the data, the catalog and the figures
+# The scripts used to expect to be run from the repository with the figures in ../Figures. Every location can now be
+# moved with an environment variable (cli.py sets them from its options), which also reaches the worker processes.
+# The variables are read when a module is imported, so they have to be set before importing the modules that use them.
+
+LIGHTCURVE_ROOT = os.environ.get("LIGHTCURVE_ROOT", "lightcurves")
+FIGURE_DIR = os.environ.get("LIGHTCURVE_FIGURES", os.path.join("..", "Figures"))
+CATALOG_FILE = os.environ.get("LIGHTCURVE_CATALOG", "CATALOGF_edited_final.CSV")
+
+
+def lightcurve_path(*parts):
+    # e.g. lightcurve_path("binary_stars", "RSVulObs1.tbl")
+    return os.path.join(LIGHTCURVE_ROOT, *parts)
+
+
+def figure_path(*parts):
+    return os.path.join(FIGURE_DIR, *parts)
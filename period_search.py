@@ -0,0 +1,218 @@
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from os import path
+import numpy as np
+import paths
+
+# Period search for the binary light curves
+# Three periodograms are evaluated over a grid of trial frequencies (in 1/d):
+#  - Lomb-Scargle: fits a sine wave at every frequency, good for the near sinusoidal EW light curves
+#  - Phase dispersion minimization (PDM): how well the phase folded light curve lines up, for any shape of light curve
+#  - Box search (BLS): looks for a periodic dip, for the short eclipses of EA light curves
+# Every periodogram works on blocks of (frequencies x samples) with at most CHUNK_ELEMENTS entries,
+# so memory stays bounded for any grid size, and the grid can be split across worker processes.
+
+CHUNK_ELEMENTS = 2**22
+# Relative width of the frequency grid around a known period
+DEFAULT_RELATIVE_WIDTH = 0.2
+DEFAULT_OVERSAMPLING = 10
+DEFAULT_PDM_BINS = 10
+DEFAULT_BOX_BINS = 200
+# Durations of the eclipses tried by the box search as fractions of the period
+DEFAULT_BOX_DURATIONS = (0.02, 0.05, 0.1, 0.15)
+
+
+def frequency_grid(TIMES, period_guess=None, min_period=None, max_period=None, relative_width=DEFAULT_RELATIVE_WIDTH, oversampling=DEFAULT_OVERSAMPLING, n_frequencies=None):
+    # Trial frequencies in 1/d
+    # With a period_guess (e.g. the catalog period) the grid covers period_guess*(1 -/+ relative_width),
+    # otherwise it runs from 1/max_period (default: the length of the observations) to 1/min_period (default: twice the median cadence)
+    TIMES = np.asarray(TIMES, dtype=float)
+    baseline = np.ptp(TIMES)
+    if period_guess is not None:
+        min_period = period_guess*(1 - relative_width)
+        max_period = period_guess*(1 + relative_width)
+    if max_period is None:
+        max_period = baseline
+    if min_period is None:
+        min_period = 2*np.median(np.diff(np.sort(TIMES)))
+    f_min, f_max = 1/max_period, 1/min_period
+    if n_frequencies is None:
+        # The peaks of a periodogram are about 1/baseline wide, they have to be sampled several times
+        step = 1/(oversampling*baseline)
+        n_frequencies = max(int(np.ceil((f_max - f_min)/step)) + 1, 2)
+    return np.linspace(f_min, f_max, n_frequencies)
+
+
+def frequency_chunks(n_frequencies, n_samples):
+    # Slices of the frequency grid that keep the (frequencies x samples) blocks below CHUNK_ELEMENTS
+    chunk_size = max(CHUNK_ELEMENTS//max(n_samples, 1), 1)
+    return [slice(start, min(start + chunk_size, n_frequencies)) for start in range(0, n_frequencies, chunk_size)]
+
+
+def phase_factors(TIMES, FREQUENCIES):
+    # exp(2*pi*i*f*t) for every frequency and sample
+    # On an evenly spaced grid every row is the previous one times exp(2*pi*i*df*t),
+    # a complex multiplication is a lot cheaper than evaluating a sine and a cosine
+    steps = np.diff(FREQUENCIES)
+    if len(FREQUENCIES) > 2 and np.allclose(steps, steps[0], rtol=1e-9, atol=0):
+        Z = np.empty((len(FREQUENCIES), len(TIMES)), dtype=complex)
+        Z[0] = np.exp(2j*np.pi*FREQUENCIES[0]*TIMES)
+        Z[1:] = np.exp(2j*np.pi*steps[0]*TIMES)
+        return np.cumprod(Z, axis=0, out=Z)
+    return np.exp(2j*np.pi*np.outer(FREQUENCIES, TIMES))
+
+
+def lomb_scargle_chunk(TIMES, VALUES, FREQUENCIES):
+    # Normalized Lomb-Scargle power (between 0 and 1) with the time offset tau that makes the sine and cosine terms orthogonal
+    Y = VALUES - np.mean(VALUES)
+    n = len(Y)
+    Z = phase_factors(TIMES, FREQUENCIES)
+    # Real parts are the cosine sums, imaginary parts the sine sums
+    ZY = Z @ Y.astype(complex)
+    Z2 = np.einsum("ij,ij->i", Z, Z)
+    YC, YS = ZY.real, ZY.imag
+    C2, S2 = Z2.real, Z2.imag
+    # Rotate the sums by omega*tau instead of evaluating the trigonometric functions again
+    TWO_OMEGA_TAU = np.arctan2(S2, C2)
+    COS_TAU = np.cos(TWO_OMEGA_TAU/2)
+    SIN_TAU = np.sin(TWO_OMEGA_TAU/2)
+    YC_TAU = YC*COS_TAU + YS*SIN_TAU
+    YS_TAU = YS*COS_TAU - YC*SIN_TAU
+    CC_TAU = (n + C2*np.cos(TWO_OMEGA_TAU) + S2*np.sin(TWO_OMEGA_TAU))/2
+    SS_TAU = n - CC_TAU
+    return (YC_TAU**2/CC_TAU + YS_TAU**2/SS_TAU)/np.sum(Y**2)
+
+
+def binned_sums(TIMES, VALUES, FREQUENCIES, n_bins):
+    # Number of samples, sum and sum of squares of the values in every phase bin, for every frequency (arrays of frequencies x bins)
+    PHASES = np.outer(FREQUENCIES, TIMES)
+    PHASES -= np.floor(PHASES)
+    BINS = np.minimum((PHASES*n_bins).astype(np.intp), n_bins - 1)
+    # Give every (frequency, bin) pair its own index so one bincount handles the whole block
+    BINS += (np.arange(len(FREQUENCIES))*n_bins)[:, None]
+    BINS = BINS.ravel()
+    size = len(FREQUENCIES)*n_bins
+    WEIGHTS = np.broadcast_to(VALUES, PHASES.shape).ravel()
+    COUNTS = np.bincount(BINS, minlength=size).reshape(-1, n_bins)
+    SUMS = np.bincount(BINS, weights=WEIGHTS, minlength=size).reshape(-1, n_bins)
+    SQUARES = np.bincount(BINS, weights=WEIGHTS**2, minlength=size).reshape(-1, n_bins)
+    return COUNTS, SUMS, SQUARES
+
+
+def pdm_chunk(TIMES, VALUES, FREQUENCIES, n_bins=DEFAULT_PDM_BINS):
+    # Theta statistic of Stellingwerf (1978): pooled variance within the phase bins divided by the total variance
+    # Values close to 0 mean the folded light curve is tight, around 1 means no periodicity
+    Y = VALUES - np.mean(VALUES)
+    COUNTS, SUMS, SQUARES = binned_sums(TIMES, Y, FREQUENCIES, n_bins)
+    USED = COUNTS > 1
+    WITHIN = np.where(USED, SQUARES - SUMS**2/np.maximum(COUNTS, 1), 0.0).sum(axis=1)
+    DEGREES_OF_FREEDOM = np.where(USED, COUNTS, 0).sum(axis=1) - USED.sum(axis=1)
+    return (WITHIN/np.maximum(DEGREES_OF_FREEDOM, 1))/np.var(Y, ddof=1)
+
+
+def box_search_chunk(TIMES, VALUES, FREQUENCIES, n_bins=DEFAULT_BOX_BINS, durations=DEFAULT_BOX_DURATIONS):
+    # Box least squares on phase binned data (Kovacs, Zucker & Mazeh 2002)
+    # For every frequency the strongest dip over all box positions and durations is kept, VALUES has to be flux like (eclipses are lower)
+    Y = VALUES - np.mean(VALUES)
+    n = len(Y)
+    COUNTS, SUMS, _ = binned_sums(TIMES, Y, FREQUENCIES, n_bins)
+    POWER = np.zeros(len(FREQUENCIES))
+    for duration in durations:
+        width = min(max(int(round(duration*n_bins)), 1), n_bins - 1)
+        # Append the first bins again, so boxes that wrap around phase 0 are included, then sum every box with a cumulative sum
+        WRAPPED_COUNTS = np.concatenate((np.zeros((len(FREQUENCIES), 1)), np.cumsum(np.concatenate((COUNTS, COUNTS[:, :width]), axis=1), axis=1)), axis=1)
+        WRAPPED_SUMS = np.concatenate((np.zeros((len(FREQUENCIES), 1)), np.cumsum(np.concatenate((SUMS, SUMS[:, :width]), axis=1), axis=1)), axis=1)
+        R = WRAPPED_COUNTS[:, width:width + n_bins] - WRAPPED_COUNTS[:, :n_bins]
+        S = WRAPPED_SUMS[:, width:width + n_bins] - WRAPPED_SUMS[:, :n_bins]
+        VALID = (R > 0) & (R < n) & (S < 0)
+        SIGNAL = np.where(VALID, S**2/np.where(VALID, R*(n - R), 1), 0.0)
+        POWER = np.maximum(POWER, SIGNAL.max(axis=1))
+    return POWER
+
+
+METHODS = {
+    "lomb_scargle": lomb_scargle_chunk,
+    "pdm": pdm_chunk,
+    "box": box_search_chunk,
+}
+
+
+def evaluate_shard(method, TIMES, VALUES, FREQUENCIES, options):
+    # Evaluate a periodogram over part of the frequency grid, one memory bounded chunk after another
+    chunk_function = METHODS[method]
+    RESULT = np.empty(len(FREQUENCIES))
+    for chunk in frequency_chunks(len(FREQUENCIES), len(TIMES)):
+        RESULT[chunk] = chunk_function(TIMES, VALUES, FREQUENCIES[chunk], **options)
+    return RESULT
+
+
+def periodogram(method, TIMES, VALUES, FREQUENCIES, workers=1, **options):
+    # Evaluate one of METHODS over the whole frequency grid, split across worker processes if workers > 1
+    if method not in METHODS:
+        raise ValueError("Unknown period search method {}, use one of {}".format(method, ", ".join(METHODS)))
+    TIMES = np.asarray(TIMES, dtype=float)
+    VALUES = np.asarray(VALUES, dtype=float)
+    FREQUENCIES = np.asarray(FREQUENCIES, dtype=float)
+    # Every sample that isn't finite would turn the sums of a whole chunk into NaN
+    FINITE = np.isfinite(TIMES) & np.isfinite(VALUES)
+    TIMES, VALUES = TIMES[FINITE], VALUES[FINITE]
+    # Times relative to the start keep the phases precise
+    TIMES = TIMES - TIMES.min()
+    if workers is None or workers <= 1 or len(FREQUENCIES) < 2*workers:
+        return evaluate_shard(method, TIMES, VALUES, FREQUENCIES, options)
+    SHARDS = np.array_split(FREQUENCIES, workers)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return np.concatenate(list(executor.map(partial(evaluate_shard, method, TIMES, VALUES, options=options), SHARDS)))
+
+
+def best_period(FREQUENCIES, POWER, method):
+    # PDM has its best period at the minimum of theta, the other methods at the maximum of the power
+    index = np.argmin(POWER) if method == "pdm" else np.argmax(POWER)
+    return 1/FREQUENCIES[index], POWER[index]
+
+
+def search_periods(TIMES, VALUES, period_guess=None, methods=tuple(METHODS), workers=1, **grid_options):
+    # Run all the methods over the same grid, returns the grid and a dict of method -> (periodogram, best period, best value)
+    FREQUENCIES = frequency_grid(TIMES, period_guess=period_guess, **grid_options)
+    results = {}
+    for method in methods:
+        POWER = periodogram(method, TIMES, VALUES, FREQUENCIES, workers=workers)
+        results[method] = (POWER, *best_period(FREQUENCIES, POWER, method))
+    return FREQUENCIES, results
+
+
+def main():
+    from matplotlib import pyplot as plt
+    from designations import target_metadata
+    from plot_binary_astroimagej import calculate_flux
+
+    # Let the user decide which file to analyze
+    file_name = input("Specify the name of the lightcurve to be analyzed (path will be: {}): ".format(paths.lightcurve_path("binary_stars", "[INPUT].tbl")))
+    if not path.isfile(paths.lightcurve_path("binary_stars", "{}.tbl".format(file_name))):
+        print("File doesn't exist.")
+        return
+
+    JULIAN_DATES, FLUX_PER_SECOND, _ = calculate_flux(file_name)
+    # Seed the grid with the catalog period if the target is in the catalog
+    metadata = target_metadata(file_name)
+    period_guess = None
+    if metadata is not None and np.isfinite(metadata["Period [d]"]):
+        period_guess = metadata["Period [d]"]
+        print("Catalog period: {}d".format(period_guess))
+    FREQUENCIES, results = search_periods(JULIAN_DATES, FLUX_PER_SECOND, period_guess=period_guess)
+
+    print("========== Period search ==========")
+    fig, axes = plt.subplots(len(results), 1, sharex=True)
+    for ax, (method, (POWER, period, value)) in zip(axes, results.items()):
+        print("{}: best period {}d ({})".format(method, period, value))
+        ax.plot(1/FREQUENCIES, POWER)
+        ax.axvline(period, linestyle="--", color="green")
+        ax.set_ylabel(method)
+    axes[-1].set_xlabel("Period [d]")
+    # Near sinusoidal (EW) light curves have two similar minima per period, so Lomb-Scargle tends to find half of the period
+    print("Note: for EW type light curves the Lomb-Scargle peak is usually at half the orbital period")
+    plt.show()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+import argparse
+import csv
+import datetime
+from dataclasses import dataclass
+import numpy as np
+import pandas as pd
+import ephemeris
+from designations import normalize_designation
+from sky_coords import catalog_coordinates
+
+# Observability planner for the candidates get_candidates.py selects
+# For a site and a range of nights, the altitude of every candidate is computed on a time grid as one array
+# (candidates x timesteps). Only the timesteps when the sun is far enough below the horizon are part of the grid,
+# and the altitude comes from sin(alt) = sin(lat)sin(dec) + cos(lat)cos(dec)cos(LST - RA), with the cosine of the
+# difference expanded so the grid only needs cos(LST) and sin(LST) once. A candidate is observable at a timestep if
+# it's higher than the minimum altitude.
+# The catalog has the period and the eclipse duration (DI [h]), but no epoch of minimum, so without an epoch the
+# chance to catch an eclipse is estimated: a night in which a star is observable for L days can contain a whole
+# eclipse of duration D starting in (L - D) days, which is (L - D)/P eclipses on average. Candidates with a known epoch
+# (e.g. from the minima timings of minima_timing.py) get their predicted eclipses checked one by one instead.
+# The candidates are ranked by their (expected or predicted) observable eclipses, and every night gets the candidate
+# with the best chance of an eclipse in that night.
+# Usage: python planner.py [--start 2023-09-01] [--nights 30] [--epochs minima_timings.csv]
+
+CANDIDATES_FILE = "candidates.csv"
+DEFAULT_NIGHTS = 30
+
+
+@dataclass(frozen=True)
+class Site:
+    name: str
+    # Degrees north and east
+    latitude: float
+    longitude: float
+
+
+DEFAULT_SITE = Site("Kantonsschule Glarus", 47.04, 9.07)
+STEP_MINUTES = 5
+# 30° is an airmass of 2
+MIN_ALTITUDE = 30.0
+# Nautical twilight, the sky is dark enough for bright targets
+SUN_ALTITUDE_LIMIT = -12.0
+# Eclipse duration as a fraction of the period for the entries without DI [h]
+DEFAULT_ECLIPSE_FRACTION = 0.1
+# Candidates that are put into one (candidates x timesteps) array at a time, so the memory stays bounded
+CHUNK_SIZE = 2048
+
+
+@dataclass
+class Plan:
+    # The dark timesteps (full julian dates) and the night every one of them belongs to
+    times: np.ndarray
+    nights: np.ndarray
+    night_dates: list
+    # Hours every candidate is observable in every night (candidates x nights)
+    hours: np.ndarray
+    # Lowest airmass every candidate reaches in the dark (inf if it never rises above the minimum altitude)
+    best_airmass: np.ndarray
+    # Whole eclipses every candidate can be expected to show in every night (candidates x nights)
+    expected_eclipses: np.ndarray
+    # Times of minimum that are observable from start to end, as (candidate, time of minimum), for candidates with an epoch
+    predicted_eclipses: list
+
+
+def julian_date(date):
+    # Julian date of 0h UT of a datetime.date
+    return ephemeris.UNIX_EPOCH + (date - datetime.date(1970, 1, 1)).days
+
+
+def dark_grid(start_date, n_nights, site=DEFAULT_SITE, step_minutes=STEP_MINUTES, sun_altitude=SUN_ALTITUDE_LIMIT):
+    # The timesteps between local noon of the start date and local noon after the last night when the sun is
+    # below sun_altitude, together with the night (counted from 0) of every timestep
+    local_noon = julian_date(start_date) + 0.5 - site.longitude/360
+    TIMES = local_noon + np.arange(0, n_nights, step_minutes/1440)
+    SUN_RA, SUN_DEC = ephemeris.sun_equatorial(TIMES)
+    LST = ephemeris.local_sidereal_time(TIMES, site.longitude)
+    DARK = ephemeris.altitude_sin(SUN_RA, SUN_DEC, LST, site.latitude) < np.sin(np.radians(sun_altitude))
+    return TIMES[DARK], np.floor(TIMES[DARK] - local_noon).astype(np.intp)
+
+
+def eclipse_durations(catalog):
+    # Duration of the primary eclipse in days, from DI [h] or a fixed fraction of the period
+    PERIODS = np.asarray(catalog["Period [d]"], dtype=float)
+    DURATIONS = np.asarray(catalog["DI [h]"], dtype=float)/24 if "DI [h]" in catalog else np.full(len(PERIODS), np.nan)
+    # 999 is the catalog's placeholder for an unknown duration, in case the catalog wasn't loaded from the cache
+    UNKNOWN = ~np.isfinite(DURATIONS) | (DURATIONS >= 999/24)
+    return np.where(UNKNOWN, DEFAULT_ECLIPSE_FRACTION*PERIODS, DURATIONS)
+
+
+def observable(RA, DEC, TIMES, site=DEFAULT_SITE, min_altitude=MIN_ALTITUDE):
+    # (candidates x timesteps) mask of the candidates above min_altitude and the highest sin(altitude) of every candidate
+    # cos(LST - RA) = cos(LST)cos(RA) + sin(LST)sin(RA), so the products are formed in single precision only once
+    LST = ephemeris.local_sidereal_time(TIMES, site.longitude)
+    latitude = np.radians(site.latitude)
+    A = (np.sin(latitude)*np.sin(DEC)).astype(np.float32)[:, None]
+    B = (np.cos(latitude)*np.cos(DEC)).astype(np.float32)[:, None]
+    SIN_ALTITUDES = A + B*(np.cos(LST).astype(np.float32)*np.cos(RA).astype(np.float32)[:, None] + np.sin(LST).astype(np.float32)*np.sin(RA).astype(np.float32)[:, None])
+    return SIN_ALTITUDES > np.sin(np.radians(min_altitude)), SIN_ALTITUDES.max(axis=1, initial=-1)
+
+
+def predict_eclipses(OBSERVABLE, TIMES, step, EPOCHS, PERIODS, DURATIONS):
+    # Candidate index and time of every predicted minimum whose whole eclipse is observable
+    # The eclipse has to be observable at every timestep it spans, and those timesteps have to be consecutive
+    # (the grid only contains the dark timesteps, so a gap means the eclipse runs into daylight)
+    FIRST = np.ceil((TIMES[0] + DURATIONS/2 - EPOCHS)/PERIODS).astype(np.intp)
+    LAST = np.floor((TIMES[-1] - DURATIONS/2 - EPOCHS)/PERIODS).astype(np.intp)
+    COUNTS = np.maximum(LAST - FIRST + 1, 0)
+    CANDIDATES = np.repeat(np.arange(len(EPOCHS)), COUNTS)
+    CYCLES = FIRST[CANDIDATES] + np.arange(COUNTS.sum()) - np.repeat(np.cumsum(COUNTS) - COUNTS, COUNTS)
+    MINIMA = EPOCHS[CANDIDATES] + CYCLES*PERIODS[CANDIDATES]
+    START = np.searchsorted(TIMES, MINIMA - DURATIONS[CANDIDATES]/2, side="left")
+    END = np.searchsorted(TIMES, MINIMA + DURATIONS[CANDIDATES]/2, side="right")
+    N_STEPS = END - START
+    CUMULATIVE = np.concatenate((np.zeros((len(OBSERVABLE), 1), dtype=np.int32), np.cumsum(OBSERVABLE, axis=1, dtype=np.int32)), axis=1)
+    ALL_OBSERVABLE = CUMULATIVE[CANDIDATES, END] - CUMULATIVE[CANDIDATES, START] == N_STEPS
+    CONSECUTIVE = (N_STEPS > 0) & (TIMES[np.maximum(END - 1, 0)] - TIMES[np.minimum(START, len(TIMES) - 1)] < (N_STEPS + 0.5)*step)
+    COVERED = ALL_OBSERVABLE & CONSECUTIVE & (N_STEPS*step >= DURATIONS[CANDIDATES] - step)
+    return CANDIDATES[COVERED], MINIMA[COVERED]
+
+
+def plan(catalog, start_date, n_nights=DEFAULT_NIGHTS, site=DEFAULT_SITE, min_altitude=MIN_ALTITUDE,
+         sun_altitude=SUN_ALTITUDE_LIMIT, step_minutes=STEP_MINUTES, epochs=None):
+    # epochs maps a catalog row to its epoch of primary minimum (full julian date)
+    TIMES, NIGHTS = dark_grid(start_date, n_nights, site, step_minutes, sun_altitude)
+    step = step_minutes/1440
+    RA, DEC = catalog_coordinates(catalog)
+    PERIODS = np.asarray(catalog["Period [d]"], dtype=float)
+    DURATIONS = eclipse_durations(catalog)
+    n = len(RA)
+    # Every night is a contiguous run of timesteps, reduceat sums over them
+    NIGHT_STARTS = np.searchsorted(NIGHTS, np.arange(n_nights))
+    HAS_TIMESTEPS = NIGHT_STARTS < np.r_[NIGHT_STARTS[1:], len(NIGHTS)]
+    hours = np.zeros((n, n_nights))
+    best_airmass = np.full(n, np.inf)
+    predicted = []
+    epochs = epochs or {}
+    for start in range(0, n, CHUNK_SIZE):
+        stop = min(start + CHUNK_SIZE, n)
+        OBSERVABLE, MAX_SIN_ALTITUDES = observable(RA[start:stop], DEC[start:stop], TIMES, site, min_altitude)
+        if len(TIMES):
+            hours[start:stop, HAS_TIMESTEPS] = np.add.reduceat(OBSERVABLE, NIGHT_STARTS[HAS_TIMESTEPS], axis=1, dtype=np.int32)*step_minutes/60
+        with np.errstate(divide="ignore"):
+            best_airmass[start:stop] = np.where(MAX_SIN_ALTITUDES > np.sin(np.radians(min_altitude)), 1/MAX_SIN_ALTITUDES, np.inf)
+        ROWS = np.array([row for row in epochs if start <= row < stop], dtype=np.intp)
+        if len(ROWS) and len(TIMES):
+            EPOCHS = np.array([epochs[row] for row in ROWS])
+            CANDIDATES, MINIMA = predict_eclipses(OBSERVABLE[ROWS - start], TIMES, step, EPOCHS, PERIODS[ROWS], DURATIONS[ROWS])
+            predicted.extend(zip(ROWS[CANDIDATES].tolist(), MINIMA.tolist()))
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        EXPECTED = np.clip(hours/24 - DURATIONS[:, None], 0, None)/PERIODS[:, None]
+    EXPECTED[~np.isfinite(EXPECTED)] = 0
+    night_dates = [start_date + datetime.timedelta(days=night) for night in range(n_nights)]
+    return Plan(TIMES, NIGHTS, night_dates, hours, best_airmass, EXPECTED, sorted(predicted, key=lambda item: item[1]))
+
+
+def eclipse_scores(result, epoch_rows=()):
+    # Observable eclipses of every candidate in every night (candidates x nights): the predicted ones for the candidates
+    # with an epoch, the expected ones for all the others
+    NIGHTLY = result.expected_eclipses.copy()
+    NIGHTLY[list(epoch_rows)] = 0
+    for row, minimum in result.predicted_eclipses:
+        NIGHTLY[row, result.nights[np.searchsorted(result.times, minimum)]] += 1
+    return NIGHTLY
+
+
+def rank(result, epoch_rows=()):
+    # Candidate rows from best to worst (most observable eclipses first, then the lowest airmass) and their eclipses
+    SCORES = eclipse_scores(result, epoch_rows).sum(axis=1)
+    return np.lexsort((result.best_airmass, -SCORES)), SCORES
+
+
+def schedule(result, epoch_rows=()):
+    # The candidate with the most observable eclipses in every night, as (date, row, eclipses)
+    NIGHTLY = eclipse_scores(result, epoch_rows)
+    ROWS = np.argmax(NIGHTLY, axis=0) if len(NIGHTLY) else np.zeros(len(result.night_dates), dtype=np.intp)
+    return [(date, int(row), float(NIGHTLY[row, night])) for night, (date, row) in enumerate(zip(result.night_dates, ROWS)) if len(NIGHTLY) and NIGHTLY[row, night] > 0]
+
+
+def read_epochs(file_path, catalog):
+    # Epochs of primary minimum per catalog row from a minima timing table (see minima_timing.py), the latest one per target
+    rows = {normalize_designation(str(name)): row for row, name in enumerate(catalog["GCVS"]) if isinstance(name, str)}
+    epochs = {}
+    with open(file_path, newline="") as file:
+        for timing in csv.DictReader(file):
+            row = rows.get(normalize_designation(timing["target"]))
+            if row is None or timing.get("type", "primary") != "primary" or not timing["kvw"]:
+                continue
+            # The timings are in J.D.-2400000 like the tables they come from
+            epochs[row] = max(epochs.get(row, -np.inf), float(timing["kvw"]) + 2400000)
+    return epochs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Plan the observations of the candidates: when they're up in the dark and when they can be caught in eclipse")
+    parser.add_argument("--candidates", default=CANDIDATES_FILE, help="candidates written by get_candidates.py")
+    parser.add_argument("--start", type=datetime.date.fromisoformat, default=datetime.date.today(), help="date of the first night (YYYY-MM-DD)")
+    parser.add_argument("--nights", type=int, default=DEFAULT_NIGHTS)
+    parser.add_argument("--latitude", type=float, default=DEFAULT_SITE.latitude, help="degrees north")
+    parser.add_argument("--longitude", type=float, default=DEFAULT_SITE.longitude, help="degrees east")
+    parser.add_argument("--min-altitude", type=float, default=MIN_ALTITUDE, help="degrees")
+    parser.add_argument("--sun-altitude", type=float, default=SUN_ALTITUDE_LIMIT, help="the sky is dark when the sun is below this altitude (degrees)")
+    parser.add_argument("--epochs", help="minima timing table (minima_timing.py) with epochs of primary minimum")
+    parser.add_argument("--top", type=int, default=20, help="number of ranked candidates to print")
+    args = parser.parse_args()
+
+    catalog_df = pd.read_csv(args.candidates)
+    site = Site(DEFAULT_SITE.name, args.latitude, args.longitude)
+    epochs = read_epochs(args.epochs, catalog_df) if args.epochs else None
+    result = plan(catalog_df, args.start, args.nights, site, args.min_altitude, args.sun_altitude, epochs=epochs)
+    ORDER, SCORES = rank(result, epochs or ())
+
+    NAMES = catalog_df["GCVS"].astype(str).str.strip().to_numpy()
+    print("========== Ranking ({} nights from {}) ==========".format(args.nights, args.start))
+    print("{:<12} {:>9} {:>8} {:>12} {:>12} {:>10}".format("target", "period", "nights", "hours", "airmass", "eclipses"))
+    for row in ORDER[:args.top]:
+        print("{:<12} {:>9.4f} {:>8} {:>12.1f} {:>12.2f} {:>10.2f}".format(
+            NAMES[row], catalog_df["Period [d]"].iloc[row], int(np.count_nonzero(result.hours[row])), result.hours[row].sum(), result.best_airmass[row], SCORES[row]))
+    print("========== Schedule ==========")
+    for date, row, eclipses in schedule(result, epochs or ()):
+        print("{}: {} ({:.2f} eclipses)".format(date, NAMES[row], eclipses))
+    for row, minimum in result.predicted_eclipses:
+        print("Predicted eclipse of {} at JD {:.4f}".format(NAMES[row], minimum))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,52 +1,89 @@
-from matplotlib import pyplot as plt
 import numpy as np
 from os import path
-import pandas as pd
+import calibration
+import paths
+import time_correction
+from designations import print_catalog_entry, target_metadata
+from ensemble import CLIP_SIGMA, MAX_ITERATIONS, comparison_columns, comparison_matrices, ensemble_normalization
+import instrumentation
+import product_cache
+import quality
+from rolling import rolling_mean
+from tbl_reader import load_lightcurve
+
+# matplotlib is only imported by the functions that plot, reducing a file (e.g. from cli.py) doesn't need it
 
 MOVING_AVERAGE_WINDOW_SIZE = 20
 
-def adjust_t1_source_counts(SOURCE_COUNTS_T1, SOURCE_COUNTS_C2):
-    ADJUSTED_SOURCE_COUNTS_T1 = [SOURCE_COUNTS_T1[0]]
-    median_ref_count = np.median(SOURCE_COUNTS_C2)
-    for i in range(len(SOURCE_COUNTS_T1)):
-        # Correct the source counts by comparing the target star to the reference and assuming the reference star's brightness is constant
-        ref_normalized = (SOURCE_COUNTS_C2[i])/(median_ref_count)
-        ADJUSTED_SOURCE_COUNTS_T1.append(SOURCE_COUNTS_T1[i]*(1/ref_normalized))
-    return ADJUSTED_SOURCE_COUNTS_T1
+def adjust_t1_source_counts(SOURCE_COUNTS_T1, COMPARISON_COUNTS, COMPARISON_SNR=None):
+    # Correct the source counts by comparing the target star to the ensemble of reference stars and assuming their brightness is constant
+    # COMPARISON_COUNTS has one column per reference star (a single reference star can also be passed as one array)
+    # A table without reference stars can't be corrected, its counts are returned as they are
+    if np.size(COMPARISON_COUNTS) == 0:
+        return SOURCE_COUNTS_T1
+    REF_NORMALIZED, _, _ = ensemble_normalization(COMPARISON_COUNTS, COMPARISON_SNR)
+    return SOURCE_COUNTS_T1/REF_NORMALIZED
         
 
 def calculate_flux(file_name):
-    with open("lightcurves/binary_stars/{}.tbl".format(file_name)) as file:
-        file_df = pd.read_table(file, delim_whitespace=True)
-        
-        # Extract the necessary informations from the file
-        # The timestamp
-        JULIAN_DATES = file_df["J.D.-2400000"].to_list()
-        # The total ADU count over all the pixels in the aperture of the target and the reference
-        SOURCE_COUNTS_T1 = file_df["Source-Sky_T1"].to_list()
-        SOURCE_COUNTS_C2 = file_df["Source-Sky_C2"].to_list()
-        SOURCE_COUNTS = adjust_t1_source_counts(SOURCE_COUNTS_T1, SOURCE_COUNTS_C2)
-        # The amount of ADUs per pixel which is background
-        BACKGROUND_PER_PIXEL_VALUES = file_df["Sky/Pixel_T1"].to_list()
-        # The amount of pixels inside the aperture (useful to calculate total background counts)
-        N_SKY_PIXELS = file_df["N_Sky_Pixels_T1"].to_list()
-        # The exposure time used for the frames
-        EXP_TIME = file_df["EXPTIME"].iloc[0]
-        file.close()
-    
-    # Calculate the total background counts for each frame
-    BACKGROUND_COUNTS = list(map(lambda pixel_value, num_pixels: pixel_value*num_pixels, BACKGROUND_PER_PIXEL_VALUES, N_SKY_PIXELS))
-    # Then subtract the background value from every counts value
-    SOURCE_COUNTS_BG_SUBTRACTED = list(map(lambda raw_value, bg_value: raw_value-bg_value, SOURCE_COUNTS, BACKGROUND_COUNTS))
-    SOURCE_COUNTS_BG_SUBTRACTED_RAW = list(map(lambda raw_value, bg_value: raw_value-bg_value, SOURCE_COUNTS_T1, BACKGROUND_COUNTS))
-    # Go through each source count and divide by the exposure time to get the flux in ADU/s
-    FLUX_PER_SECOND = list(map(lambda count: count/EXP_TIME, SOURCE_COUNTS_BG_SUBTRACTED))
-    FLUX_PER_SECOND_RAW = list(map(lambda count: count/EXP_TIME, SOURCE_COUNTS_BG_SUBTRACTED_RAW))
-    return JULIAN_DATES, FLUX_PER_SECOND, FLUX_PER_SECOND_RAW
-
-def plot_magnitude_lightcurve(JULIAN_DATES, FLUX_PER_SECOND, file_name):
-    # Then use the coefficients to get from flux to mag
-    MAGS = list(map(lambda flux_value: -2.5*np.log10(flux_value/16468819), FLUX_PER_SECOND))
+    return calculate_flux_from_file(paths.lightcurve_path("binary_stars", "{}.tbl".format(file_name)))
+
+@instrumentation.timed("flux")
+def calculate_flux_from_file(file_path):
+    # Read the target aperture together with the source counts of all the reference stars
+    apertures, count_columns, snr_columns = comparison_columns(file_path)
+    lightcurve = load_lightcurve(file_path, aperture="T1", extra_columns=count_columns + snr_columns)
+    COMPARISON_COUNTS, COMPARISON_SNR = comparison_matrices(lightcurve.columns, apertures)
+    instrumentation.count("frames", len(lightcurve))
+    instrumentation.count("comparison_stars", len(apertures))
+    SOURCE_COUNTS = adjust_t1_source_counts(lightcurve.source_counts, COMPARISON_COUNTS, COMPARISON_SNR)
+    # Background subtracted flux in ADU/s, once with and once without the correction by the reference stars
+    FLUX_PER_SECOND = lightcurve.adjusted_flux(SOURCE_COUNTS)
+    FLUX_PER_SECOND_RAW = lightcurve.flux
+    return lightcurve.julian_dates, FLUX_PER_SECOND, FLUX_PER_SECOND_RAW
+
+def flux_to_magnitude(FLUX_PER_SECOND, night=None):
+    # The zero point comes from the reference stars (see calibration.py), the one of the night if it was calibrated
+    return calibration.flux_to_magnitude(FLUX_PER_SECOND, night=night)
+
+def reduce_file(file_path):
+    # Flux, magnitudes, quality flags and moving averages of a table
+    # Every step is cached (see product_cache.py), so only the steps whose parameters changed are computed again
+    # REJECTED_BY tells which frames the quality filter rejected (see quality.py), the moving averages only use the good
+    # frames and are NaN for the others
+    # HJD and BJD_TDB (see time_correction.py) are added when the coordinates of the target are known. They come last,
+    # so a change of the coordinates doesn't compute the magnitudes again
+    criteria = quality.QualityCriteria()
+
+    def magnitudes(arrays):
+        night = calibration.night_of(arrays["JULIAN_DATES"][0])
+        return {"MAGS": flux_to_magnitude(arrays["FLUX_PER_SECOND"], night), "MAGS_RAW": flux_to_magnitude(arrays["FLUX_PER_SECOND_RAW"], night)}
+
+    def smoothed(arrays):
+        GOOD = arrays["REJECTED_BY"] == 0
+        SMOOTHED_MAGS = np.full(len(GOOD), np.nan)
+        SMOOTHED_MAGS_RAW = np.full(len(GOOD), np.nan)
+        SMOOTHED_MAGS[GOOD] = moving_average(arrays["MAGS"][GOOD])
+        SMOOTHED_MAGS_RAW[GOOD] = moving_average(arrays["MAGS_RAW"][GOOD])
+        return {"SMOOTHED_MAGS": SMOOTHED_MAGS, "SMOOTHED_MAGS_RAW": SMOOTHED_MAGS_RAW}
+
+    stages = [
+        ("binary_flux", {"aperture": "T1", "clip_sigma": CLIP_SIGMA, "max_iterations": MAX_ITERATIONS},
+            lambda arrays: dict(zip(("JULIAN_DATES", "FLUX_PER_SECOND", "FLUX_PER_SECOND_RAW"), calculate_flux_from_file(file_path)))),
+        ("magnitudes", {"calibration": calibration.load_calibration("astroimagej")}, magnitudes),
+        ("quality", criteria.params(),
+            lambda arrays: {"REJECTED_BY": quality.quality_flags(quality.read_quality_columns(file_path), arrays["MAGS"], criteria=criteria)}),
+        ("smoothed", {"window_size": MOVING_AVERAGE_WINDOW_SIZE}, smoothed),
+    ]
+    time_stage = time_correction.time_stage(file_path)
+    if time_stage is not None:
+        stages.append(time_stage)
+    return product_cache.default_cache().run(file_path, stages)
+
+def plot_magnitude_lightcurve(JULIAN_DATES, MAGS, SMOOTHED_MAGS, file_name):
+    from matplotlib import pyplot as plt
+    import rendering
+
     # Then plot the lightcurve
     fig, ax = plt.subplots()
     ax.set_title("Magnitude LC for sequence {}".format(file_name))
@@ -57,17 +94,15 @@ def plot_magnitude_lightcurve(JULIAN_DATES, FLUX_PER_SECOND, file_name):
 
     ax.plot(JULIAN_DATES, MAGS, "o")
     # Also plot the moving average to make the diagram more readable
-    SMOOTHED_MAGS = moving_average(MAGS)
     print(np.median(SMOOTHED_MAGS))
     ax.plot(JULIAN_DATES, SMOOTHED_MAGS)
     ax.invert_yaxis()
     # Safe the figure in the correct folder and with a figure size that doesn't save a potato quality image
-    fig.savefig("../Figures/images_results/magastroimagej_{}.png".format(file_name), dpi=fig.get_dpi()*5)
-    return MAGS, SMOOTHED_MAGS
+    rendering.save_figure(fig, paths.figure_path("images_results", "magastroimagej_{}".format(file_name)))
 
-def plot_raw_magnitude_lightcurve(JULIAN_DATES, FLUX_PER_SECOND_RAW, file_name):
-    # Then use the coefficients to get from flux to mag
-    MAGS = list(map(lambda flux_value: -2.5*np.log10(flux_value/16468819), FLUX_PER_SECOND_RAW))
+def plot_raw_magnitude_lightcurve(JULIAN_DATES, MAGS_RAW, SMOOTHED_MAGS_RAW, file_name):
+    from matplotlib import pyplot as plt
+    import rendering
 
     # Then plot the lightcurve
     fig, ax = plt.subplots()
@@ -77,13 +112,12 @@ def plot_raw_magnitude_lightcurve(JULIAN_DATES, FLUX_PER_SECOND_RAW, file_name):
     ax.ticklabel_format(useOffset=False)
     ax.locator_params(axis="x", tight=True, nbins=6)
 
-    ax.plot(JULIAN_DATES, MAGS, "o")
+    ax.plot(JULIAN_DATES, MAGS_RAW, "o")
     # Also plot the moving average to make the diagram more readable
-    SMOOTHED_MAGS = moving_average(MAGS)
-    ax.plot(JULIAN_DATES, SMOOTHED_MAGS)
+    ax.plot(JULIAN_DATES, SMOOTHED_MAGS_RAW)
     ax.invert_yaxis()
     # Safe the figure in the correct folder and with a figure size that doesn't save a potato quality image
-    fig.savefig("../Figures/images_results/magastroimagej_{}.png".format(file_name), dpi=fig.get_dpi()*5)
+    rendering.save_figure(fig, paths.figure_path("images_results", "magastroimagej_{}".format(file_name)))
 
 
 def print_stats(MAGS, SMOOTHED_MAGS):
@@ -98,28 +132,29 @@ def print_stats(MAGS, SMOOTHED_MAGS):
     print("Average deviation: {}mag".format(np.average(DEVS_FROM_MEAN)))
     print("Standard deviation: {}mag".format(np.std(DEVS_FROM_MEAN)))
 
+@instrumentation.timed()
 def moving_average(array):
-    window = np.ones(int(MOVING_AVERAGE_WINDOW_SIZE))/float(MOVING_AVERAGE_WINDOW_SIZE)
-    processed = np.convolve(array, window, 'same')
-    # Remove the first few and last few elements of the array as for these values the convolution windows isn't filled
-    processed = processed[MOVING_AVERAGE_WINDOW_SIZE//2:len(processed)-MOVING_AVERAGE_WINDOW_SIZE//2]
-    # Fill up the list again
-    for _ in range(MOVING_AVERAGE_WINDOW_SIZE//2):
-        processed = np.insert(processed, 0, processed[0])
-        processed = np.insert(processed, len(processed)-1, processed[len(processed)-1])    
-    return processed
+    # Windows at the start and end of the sequence only average over the samples that are available
+    return rolling_mean(array, MOVING_AVERAGE_WINDOW_SIZE)
 
 def main():
+    from matplotlib import pyplot as plt
+
     # Let the user decide which file to plot
-    file_name = input("Specify the name of the lightcurve to be analyzed (path will be: lightcurves/binary_stars/[INPUT].tbl): ")
+    file_name = input("Specify the name of the lightcurve to be analyzed (path will be: {}): ".format(paths.lightcurve_path("binary_stars", "[INPUT].tbl")))
 
     try:
         # Check if file exists
-        assert path.isfile("lightcurves/binary_stars/{}.tbl".format(file_name))
-        JULIAN_DATES, FLUX_PER_SECOND, FLUX_PER_SECOND_RAW = calculate_flux(file_name)
-        MAGS, SMOOTHED_MAGS = plot_magnitude_lightcurve(JULIAN_DATES, FLUX_PER_SECOND, file_name)
-        plot_raw_magnitude_lightcurve(JULIAN_DATES, FLUX_PER_SECOND_RAW, file_name)
-        print_stats(MAGS, SMOOTHED_MAGS)
+        assert path.isfile(paths.lightcurve_path("binary_stars", "{}.tbl".format(file_name)))
+        # Look up the target in the catalog, so the period and minima are available without copying them by hand
+        print_catalog_entry(target_metadata(file_name))
+        arrays = reduce_file(paths.lightcurve_path("binary_stars", "{}.tbl".format(file_name)))
+        # Only the frames that passed the quality filter are plotted and go into the stats
+        quality.print_quality_report(quality.rejection_counts(arrays["REJECTED_BY"]), len(arrays["REJECTED_BY"]))
+        GOOD = arrays["REJECTED_BY"] == 0
+        plot_magnitude_lightcurve(arrays["JULIAN_DATES"][GOOD], arrays["MAGS"][GOOD], arrays["SMOOTHED_MAGS"][GOOD], file_name)
+        plot_raw_magnitude_lightcurve(arrays["JULIAN_DATES"][GOOD], arrays["MAGS_RAW"][GOOD], arrays["SMOOTHED_MAGS_RAW"][GOOD], file_name)
+        print_stats(arrays["MAGS"][GOOD], arrays["SMOOTHED_MAGS"][GOOD])
 
         plt.show()
     
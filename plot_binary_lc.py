@@ -1,27 +1,37 @@
 from matplotlib import pyplot as plt
-import numpy as np
 from os import path
-import csv
+import calibration
+from designations import print_catalog_entry, target_metadata
+import paths
+import product_cache
+import rendering
+from rolling import smoothing_stage
+from siril_reader import siril_stage
 
 JULIAN_DATE_PREFIX = 0
 MOVING_AVERAGE_WINDOW_SIZE = 20
 
+def reduce_file(file_path):
+    # Relative magnitudes, magnitudes and their moving averages, every step is cached (see product_cache.py)
+    # Siril's .dat files as well as their comma separated copies can be read directly
+    def magnitudes(arrays):
+        # Convert the relMag values with the calibration of the Siril reference measurements (see calibration.py)
+        return {"MAGS": calibration.relmag_to_magnitude(arrays["RELMAGS"], night=calibration.night_of(arrays["JULIAN_DATES"][0]))}
+
+    stages = [
+        siril_stage(file_path),
+        smoothing_stage("RELMAGS", MOVING_AVERAGE_WINDOW_SIZE, "SMOOTHED_RELMAGS"),
+        ("magnitudes", {"calibration": calibration.load_calibration("auto_aperture")}, magnitudes),
+        smoothing_stage("MAGS", MOVING_AVERAGE_WINDOW_SIZE),
+    ]
+    return product_cache.default_cache().run(file_path, stages)
+
 def plot_lightcurves(file_path):
-    with open("lightcurves/binary_stars/{}".format(file_path), encoding="UTF-8-sig") as file:
-        file_reader = csv.reader(file)
-        # Extract the values from the .csv files
-        JULIAN_DATES = []
-        RELMAGS = []
-        MAGS = []
-        for i, entry in enumerate(file_reader):
-            # Determine the julian date prefix with the first entry
-            if i == 0:
-                JULIAN_DATE_PREFIX = int(entry[0].split(".")[0])
-            # Subtract the julian date prefix from every julian date as this prefix is the same for every value in the csv
-            JULIAN_DATES.append(float(entry[0]) - JULIAN_DATE_PREFIX)
-            RELMAGS.append(float(entry[1]))
-        
-        file.close()
+    arrays = reduce_file(paths.lightcurve_path("binary_stars", file_path))
+    # Subtract the julian date prefix from every julian date as this prefix is the same for every value in the file
+    JULIAN_DATE_PREFIX = int(arrays["JULIAN_DATES"][0])
+    JULIAN_DATES = arrays["JULIAN_DATES"] - JULIAN_DATE_PREFIX
+    RELMAGS = arrays["RELMAGS"]
 
     # First, plot the lightcurve with the relative magnitude as the y-axis
     fig, ax = plt.subplots()
@@ -31,16 +41,11 @@ def plot_lightcurves(file_path):
     ax.invert_yaxis()
     ax.plot(JULIAN_DATES, RELMAGS, "o")
     # To smooth out the values, plot a moving average
-    SMOOTHED_RELMAGS = moving_average(RELMAGS, MOVING_AVERAGE_WINDOW_SIZE)
-    ax.plot(JULIAN_DATES, SMOOTHED_RELMAGS, linewidth=3)
+    ax.plot(JULIAN_DATES, arrays["SMOOTHED_RELMAGS"], linewidth=3)
     # Safe the figure in the correct folder and with a figure size that doesn't save a potato quality image
-    fig.savefig("../Figures/images_results/relMag_{}.png".format(file_path), dpi=fig.get_dpi()*5)
+    rendering.save_figure(fig, paths.figure_path("images_results", "relMag_{}".format(file_path)))
 
-    # Adjust each relMag value.
-    for relmag in RELMAGS:
-        # Calculate the conversion coefficient that has to be applied to get from relMag to mag
-        conversion_coeff = -0.1595*relmag - 3.047
-        MAGS.append(relmag*conversion_coeff)
+    MAGS = arrays["MAGS"]
 
     # Plot the adjusted light curve
     fig, ax = plt.subplots()
@@ -50,24 +55,13 @@ def plot_lightcurves(file_path):
     ax.invert_yaxis()
     ax.plot(JULIAN_DATES, MAGS, "o")
     # To smooth out the values, plot a moving average
-    SMOOTHED_MAGS = moving_average(MAGS, MOVING_AVERAGE_WINDOW_SIZE)
+    SMOOTHED_MAGS = arrays["SMOOTHED_MAGS"]
     ax.plot(JULIAN_DATES, SMOOTHED_MAGS, linewidth=3)
     # Safe the figure in the correct folder and with a figure size that doesn't save a potato quality image
-    fig.savefig("../Figures/images_results/Mag_{}.png".format(file_path), dpi=fig.get_dpi()*5)
+    rendering.save_figure(fig, paths.figure_path("images_results", "Mag_{}".format(file_path)))
 
     return MAGS, SMOOTHED_MAGS
 
-def moving_average(array, window_size):
-    window = np.ones(int(window_size))/float(window_size)
-    processed = np.convolve(array, window, 'same')
-    # Remove the first few and last few elements of the array as for these values the convolution windows wasn't filled
-    processed = processed[window_size//2:len(processed)-window_size//2]
-    # Fill up the list again
-    for i in range(window_size//2):
-        processed = np.insert(processed, 0, processed[0])
-        processed = np.insert(processed, len(processed)-1, processed[len(processed)-1])    
-    return processed
-
 def print_stats(MAGS, SMOOTHED_MAGS):
     print("========== MAG stats ==========")
     print("Max value: {}mag".format(max(MAGS)))
@@ -78,11 +72,13 @@ def print_stats(MAGS, SMOOTHED_MAGS):
 
 def main():
     # Let the user decide which file to plot
-    file_path = input("Specify the name of the lightcurve to be analyzed (path will be: lightcurves/binary_stars/[INPUT]): ")
+    file_path = input("Specify the name of the lightcurve to be analyzed (path will be: {}): ".format(paths.lightcurve_path("binary_stars", "[INPUT]")))
 
     try:
         # Check if file exists
-        assert path.isfile("lightcurves/binary_stars/{}".format(file_path))
+        assert path.isfile(paths.lightcurve_path("binary_stars", file_path))
+        # Look up the target in the catalog, so the period and minima are available without copying them by hand
+        print_catalog_entry(target_metadata(file_path))
         MAGS, SMOOTHED_MAGS = plot_lightcurves(file_path)
         print_stats(MAGS, SMOOTHED_MAGS)
 
@@ -1,26 +1,21 @@
 from matplotlib import pyplot as plt
 import numpy as np
 from os import path
-import csv
+import paths
+import product_cache
+from siril_reader import siril_stage
 
 JULIAN_DATE_PREFIX = 0
 
 def plot_lightcurve(file_name):
     global JULIAN_DATE_PREFIX
-    with open("lightcurves/ref_stars/auto_aperture/{}".format(file_name), encoding="UTF-8-sig") as file:
-        file_reader = csv.reader(file)
-        # Extract the values from the .csv files
-        JULIAN_DATES = []
-        RELMAGS = []
-        for i, entry in enumerate(file_reader):
-            # Determine the julian date prefix with the first entry
-            if i == 0:
-                JULIAN_DATE_PREFIX = int(entry[0].split(".")[0])
-            # Subtract the julian date prefix from every julian date as this prefix is the same for every value in the csv
-            JULIAN_DATES.append(float(entry[0]) - JULIAN_DATE_PREFIX)
-            RELMAGS.append(float(entry[1]))
-        
-        file.close()
+    # Siril's .dat files as well as their comma separated copies can be read directly, an unchanged file comes from the cache
+    file_path = paths.lightcurve_path("ref_stars", "auto_aperture", file_name)
+    arrays = product_cache.default_cache().run(file_path, [siril_stage(file_path)])
+    # Subtract the julian date prefix from every julian date as this prefix is the same for every value in the file
+    JULIAN_DATE_PREFIX = int(arrays["JULIAN_DATES"][0])
+    JULIAN_DATES = arrays["JULIAN_DATES"] - JULIAN_DATE_PREFIX
+    RELMAGS = arrays["RELMAGS"]
 
     # Calculate the median and average
     RELMAG_MEDIAN = np.median(RELMAGS)
@@ -44,7 +39,7 @@ def plot_lightcurve(file_name):
 def plot_adjusted_lightcurve(truemag, RELMAG_MEDIAN, JULIAN_DATES, RELMAGS, file_name):
     # Convert all the relative magnitudes to apparent magnitudes
     COEFF = truemag/RELMAG_MEDIAN
-    MAGS = list(map(lambda x: COEFF*x, RELMAGS))
+    MAGS = COEFF*RELMAGS
 
     # Plot the values again, this time only show the median
     fig, ax = plt.subplots()
@@ -60,14 +55,14 @@ def plot_adjusted_lightcurve(truemag, RELMAG_MEDIAN, JULIAN_DATES, RELMAGS, file
 
 def main():
     # Let the user decide which file to plot
-    file_name = input("Specify the name of the lightcurve to be analyzed (path will be: lightcurves/ref_stars/auto_aperture/[INPUT]): ")
+    file_name = input("Specify the name of the lightcurve to be analyzed (path will be: {}): ".format(paths.lightcurve_path("ref_stars", "auto_aperture", "[INPUT]")))
     # Allow the user to enter the actual magnitude of the star to calculate the conversion coefficient
     truemag = input("Magnitude the star actually has: ")
     truemag = float(truemag)
 
     try:
         # Check if file exists
-        assert path.isfile("lightcurves/ref_stars/auto_aperture/{}".format(file_name))
+        assert path.isfile(paths.lightcurve_path("ref_stars", "auto_aperture", file_name))
         JULIAN_DATES, RELMAGS, RELMAG_MEDIAN = plot_lightcurve(file_name)
         plot_adjusted_lightcurve(truemag, RELMAG_MEDIAN, JULIAN_DATES, RELMAGS, file_name)
 
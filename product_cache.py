@@ -0,0 +1,143 @@
+import glob
+import hashlib
+import json
+import os
+from functools import lru_cache
+import numpy as np
+from catalog_cache import file_digest, read_json, source_signature, write_json
+import instrumentation
+
+# Content-addressed cache for the products derived from the light curves (flux, magnitudes, smoothed magnitudes, ...)
+# A reduction is a chain of stages. The key of a stage is the hash of the input file's content, the name and the
+# parameters of the stage and the key of the stage before it, so changing a parameter only invalidates that stage and
+# the ones after it, and changing the file invalidates all of them. Every stage stores all the arrays known up to it
+# as an uncompressed .npz file, so a reduction starts from the last stage that is still cached and only computes the rest.
+# The file hashes are remembered together with the mtime and size of the files, unchanged files aren't read again.
+# The cache is bounded in size: entries are touched when they are used and the least recently used ones are deleted.
+
+CACHE_DIR = ".product_cache"
+FILE_INDEX = "files.json"
+MAX_CACHE_BYTES = 512*1024**2
+# Eviction deletes entries until the cache is this much of its maximum size, so it doesn't run on every store
+EVICTION_TARGET = 0.8
+# Bump when the computation of a stage changes without its parameters changing
+CACHE_VERSION = 2
+
+
+def params_digest(params):
+    # Parameters can be anything JSON can represent, numpy scalars and other objects are represented by their repr
+    text = json.dumps(params, sort_keys=True, default=lambda value: value.item() if isinstance(value, np.generic) else repr(value))
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+class ProductCache:
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    def entry_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + ".npz")
+
+    def read_file_index(self):
+        return read_json(os.path.join(self.cache_dir, FILE_INDEX), {})
+
+    def write_file_index(self, index):
+        # Several processes can write the index at the same time, the last one wins and the others only hash again
+        os.makedirs(self.cache_dir, exist_ok=True)
+        write_json(os.path.join(self.cache_dir, FILE_INDEX), index)
+
+    def file_key(self, file_path):
+        # Hash of the content of a file, only computed again when its mtime or size changed (same as catalog_cache.py)
+        signature = source_signature(file_path)
+        index = self.read_file_index()
+        path_key = os.path.abspath(file_path)
+        entry = index.get(path_key)
+        if entry is not None and {"mtime_ns": entry["mtime_ns"], "size": entry["size"]} == signature:
+            return entry["sha256"]
+        digest = file_digest(file_path)
+        index[path_key] = dict(signature, sha256=digest)
+        self.write_file_index(index)
+        return digest
+
+    def stage_key(self, upstream_key, stage, params):
+        text = "{}:{}:{}:{}".format(CACHE_VERSION, upstream_key, stage, params_digest(params))
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def get(self, key):
+        path = self.entry_path(key)
+        try:
+            with np.load(path) as data:
+                arrays = {name: data[name] for name in data.files}
+        except (OSError, ValueError):
+            return None
+        # Mark the entry as recently used for the eviction
+        os.utime(path)
+        return arrays
+
+    def put(self, key, arrays):
+        path = self.entry_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # np.savez appends .npz to the name, write to a temporary file first so readers never see half an entry
+        temporary_path = "{}.{}.tmp.npz".format(path[:-len(".npz")], os.getpid())
+        np.savez(temporary_path, **arrays)
+        os.replace(temporary_path, path)
+        self.evict()
+
+    def evict(self):
+        ENTRIES = glob.glob(os.path.join(self.cache_dir, "*", "*.npz"))
+        stats = [(os.stat(path), path) for path in ENTRIES if os.path.isfile(path)]
+        total = sum(stat.st_size for stat, _ in stats)
+        if total <= self.max_bytes:
+            return
+        # Least recently used first
+        for stat, path in sorted(stats, key=lambda item: item[0].st_mtime_ns):
+            if total <= EVICTION_TARGET*self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= stat.st_size
+            except OSError:
+                pass
+
+    def run(self, file_path, stages):
+        # Run a chain of stages on a file, every stage is (name, params, compute) and compute gets the arrays of all
+        # the stages before it and returns a dict of new arrays. Returns the arrays of all the stages together.
+        keys = []
+        upstream_key = self.file_key(file_path)
+        for stage, params, _ in stages:
+            upstream_key = self.stage_key(upstream_key, stage, params)
+            keys.append(upstream_key)
+
+        # Start from the last stage that is still cached
+        arrays = {}
+        first = 0
+        for i in range(len(stages) - 1, -1, -1):
+            cached = self.get(keys[i])
+            if cached is not None:
+                arrays, first = cached, i + 1
+                break
+        # Counted in the stage that runs the reduction (if it's traced)
+        instrumentation.count("cached_stages", first)
+        for key, (stage, _, compute) in zip(keys[first:], stages[first:]):
+            with instrumentation.stage(stage):
+                arrays = dict(arrays, **compute(arrays))
+            self.put(key, arrays)
+        return arrays
+
+
+@lru_cache(maxsize=None)
+def default_cache():
+    # The cache all the scripts share, disabled with LIGHTCURVE_CACHE=0
+    if os.environ.get("LIGHTCURVE_CACHE", "1") == "0":
+        return NoCache()
+    return ProductCache(os.environ.get("LIGHTCURVE_CACHE_DIR", CACHE_DIR))
+
+
+class NoCache:
+    # Same interface without storing anything, every stage is computed
+    def run(self, file_path, stages):
+        arrays = {}
+        for stage, _, compute in stages:
+            with instrumentation.stage(stage):
+                arrays = dict(arrays, **compute(arrays))
+        return arrays
@@ -0,0 +1,124 @@
+from dataclasses import asdict, dataclass
+import numpy as np
+from ensemble import comparison_apertures
+from rolling import MAD_TO_STD, rolling_mad, rolling_median
+from tbl_reader import read_columns, read_tbl
+
+# Quality flags for the frames of a measurement table
+# AstroImageJ writes diagnostics for every frame that none of the reductions looked at: the peak pixel of every
+# aperture, the SNR of the target, the airmass and the temperature of the CCD. Each criterion below is a boolean
+# mask over the frames (True means rejected), computed on the whole columns at once. The magnitudes of the frames
+# that pass are then sigma clipped against their rolling median, with the rolling MAD as a robust standard deviation,
+# which removes single outliers (cosmic rays, satellites, ...) without touching the eclipses.
+# The result is a mask of the good frames and not filtered copies of the columns, so the arrays can be indexed with
+# it where they are needed, and a report of how many frames every criterion rejected.
+
+# AstroImageJ's saturation warning level: the Saturated column holds the peak of any aperture above it, 0 otherwise
+PEAK_LIMIT = 55000
+# Frames whose SNR is below this fraction of the rolling median SNR were taken through clouds
+MIN_RELATIVE_SNR = 0.7
+MIN_SNR = 50
+MAX_AIRMASS = 3.0
+# Frames taken before the cooling of the CCD settled, in °C from the median temperature of the sequence
+MAX_TEMPERATURE_DEVIATION = 0.5
+CLIP_SIGMA = 5.0
+WINDOW_SIZE = 21
+# Everything a frame can be rejected for, in the order the criteria are checked
+REASONS = ("saturated", "low snr", "clouds", "airmass", "ccd temperature", "invalid", "outlier")
+
+
+@dataclass
+class QualityCriteria:
+    peak_limit: float = PEAK_LIMIT
+    min_snr: float = MIN_SNR
+    min_relative_snr: float = MIN_RELATIVE_SNR
+    max_airmass: float = MAX_AIRMASS
+    max_temperature_deviation: float = MAX_TEMPERATURE_DEVIATION
+    clip_sigma: float = CLIP_SIGMA
+    window_size: int = WINDOW_SIZE
+
+    def params(self):
+        # For the keys of the product cache
+        return asdict(self)
+
+
+def quality_columns(columns, aperture="T1"):
+    # The diagnostic columns of a table that the criteria use, columns missing in the table are skipped
+    apertures = [aperture] + comparison_apertures(columns)
+    wanted = ["Saturated", "AIRMASS", "CCD-TEMP", "Source_SNR_{}".format(aperture)] + ["Peak_{}".format(name) for name in apertures]
+    return [column for column in wanted if column in columns]
+
+
+def read_quality_columns(file_path, aperture="T1"):
+    return read_tbl(file_path, quality_columns(read_columns(file_path), aperture))
+
+
+def frame_masks(values, aperture="T1", criteria=QualityCriteria()):
+    # One rejection mask per criterion, for the criteria whose columns are available
+    masks = {}
+    PEAKS = [VALUES for column, VALUES in values.items() if column.startswith("Peak_")]
+    if "Saturated" in values or PEAKS:
+        SATURATED = values["Saturated"] != 0 if "Saturated" in values else np.zeros(len(PEAKS[0]), dtype=bool)
+        for VALUES in PEAKS:
+            SATURATED |= VALUES >= criteria.peak_limit
+        masks["saturated"] = SATURATED
+    SNR = values.get("Source_SNR_{}".format(aperture))
+    if SNR is not None:
+        masks["low snr"] = ~(SNR >= criteria.min_snr)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            masks["clouds"] = SNR/rolling_median(SNR, criteria.window_size) < criteria.min_relative_snr
+    if "AIRMASS" in values:
+        masks["airmass"] = values["AIRMASS"] > criteria.max_airmass
+    if "CCD-TEMP" in values:
+        TEMPERATURES = values["CCD-TEMP"]
+        masks["ccd temperature"] = np.abs(TEMPERATURES - np.nanmedian(TEMPERATURES)) > criteria.max_temperature_deviation
+    return masks
+
+
+def sigma_clip_mask(VALUES, GOOD, window_size=WINDOW_SIZE, clip_sigma=CLIP_SIGMA):
+    # Frames among GOOD whose value is more than clip_sigma robust standard deviations from the rolling median
+    # of the good frames around it. Only the good values are gathered, the rejected frames don't affect the windows
+    OUTLIERS = np.zeros(len(VALUES), dtype=bool)
+    INDICES = np.flatnonzero(GOOD)
+    if len(INDICES) < 3:
+        return OUTLIERS
+    SELECTED = VALUES[INDICES]
+    MEDIANS = rolling_median(SELECTED, window_size)
+    SIGMAS = rolling_mad(SELECTED, window_size, scale=MAD_TO_STD)
+    OUTLIERS[INDICES] = (np.abs(SELECTED - MEDIANS) > clip_sigma*SIGMAS) & (SIGMAS > 0)
+    return OUTLIERS
+
+
+def quality_flags(values, MAGS=None, aperture="T1", criteria=QualityCriteria()):
+    # The first criterion that rejects every frame, as its index in REASONS plus one (0 for the good frames)
+    # One small integer per frame is all that has to be kept (or cached) to get both the mask and the report
+    n = len(MAGS) if MAGS is not None else len(next(iter(values.values())))
+    REJECTED_BY = np.zeros(n, dtype=np.uint8)
+    masks = frame_masks(values, aperture, criteria)
+    if MAGS is not None:
+        masks["invalid"] = ~np.isfinite(MAGS)
+    for name, REJECTED in masks.items():
+        REJECTED_BY[(REJECTED_BY == 0) & REJECTED] = REASONS.index(name) + 1
+    if MAGS is not None:
+        REJECTED_BY[sigma_clip_mask(MAGS, REJECTED_BY == 0, criteria.window_size, criteria.clip_sigma)] = REASONS.index("outlier") + 1
+    return REJECTED_BY
+
+
+def rejection_counts(REJECTED_BY):
+    # Number of frames every criterion rejected, a frame only counts for the first one that rejects it
+    COUNTS = np.bincount(REJECTED_BY, minlength=len(REASONS) + 1)
+    return {name: int(COUNTS[i + 1]) for i, name in enumerate(REASONS)}
+
+
+def quality_mask(values, MAGS=None, aperture="T1", criteria=QualityCriteria()):
+    # Returns the mask of the good frames together with the rejection counts
+    REJECTED_BY = quality_flags(values, MAGS, aperture, criteria)
+    return REJECTED_BY == 0, rejection_counts(REJECTED_BY)
+
+
+def print_quality_report(rejection_counts, total_frames, title="Quality filter"):
+    print("========== {} ==========".format(title))
+    for name, count in rejection_counts.items():
+        if count:
+            print("Rejected {} frames due to {}".format(count, name))
+    print("Kept {} of {} frames".format(total_frames - sum(rejection_counts.values()), total_frames))
@@ -0,0 +1,196 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from downsampling import downsample
+import instrumentation
+
+# Rendering of the light curve figures without user interaction
+# The figures are created with matplotlib's object oriented API instead of pyplot, so they are never registered in
+# pyplot's list of open figures and don't pile up in memory. Every process keeps one figure and reuses it:
+# the data of its artists is replaced for the next light curve instead of building a new figure every time.
+# Series that are longer than the figure is wide in pixels are downsampled first (see downsampling.py).
+# The markers are rasterized, so vector formats (pdf, svg) stay small even for thousands of samples,
+# while the axes and labels stay vector graphics.
+# Rendering many figures is done by a pool of worker processes with a bounded number of pending jobs,
+# so the light curves waiting to be rendered don't fill up the memory either.
+
+DEFAULT_DPI = 300
+DEFAULT_FORMAT = "png"
+# Jobs that may wait for a worker per worker process, submitting more blocks until a job has finished
+PENDING_PER_WORKER = 4
+
+
+@dataclass
+class FigureSpec:
+    # Everything needed to draw one light curve figure, small enough to be sent to a worker process
+    path: str
+    title: str
+    x_label: str
+    y_label: str
+    X: np.ndarray
+    Y: np.ndarray
+    # Smoothed values drawn as a line over the samples, e.g. a moving average
+    SMOOTHED: np.ndarray = None
+    # Horizontal lines as (value, linestyle, color), e.g. the median
+    hlines: list = field(default_factory=list)
+    invert_y: bool = False
+
+
+class LightCurveFigure:
+    def __init__(self):
+        self.fig = Figure()
+        FigureCanvasAgg(self.fig)
+        self.ax = self.fig.add_subplot()
+        self.ax.ticklabel_format(useOffset=False)
+        self.points, = self.ax.plot([], [], "o", rasterized=True)
+        self.smoothed, = self.ax.plot([], [])
+        self.hlines = []
+
+    def draw(self, spec, dpi=DEFAULT_DPI):
+        # Replace the data of the existing artists, nothing is created unless a figure needs more horizontal lines than before
+        self.ax.set_title(spec.title)
+        self.ax.set_xlabel(spec.x_label)
+        self.ax.set_ylabel(spec.y_label)
+        # Long series are reduced to what the figure can show at this resolution, keeping the eclipse minima
+        # (the faint end is the top of an inverted magnitude axis, the bottom of a flux axis)
+        n_pixels = int(self.fig.get_figwidth()*dpi)
+        preserve = "max" if spec.invert_y else "min"
+        self.points.set_data(*downsample(spec.X, spec.Y, n_pixels, preserve=preserve))
+        self.smoothed.set_visible(spec.SMOOTHED is not None)
+        if spec.SMOOTHED is not None:
+            self.smoothed.set_data(*downsample(spec.X, spec.SMOOTHED, n_pixels, preserve=preserve))
+        while len(self.hlines) < len(spec.hlines):
+            self.hlines.append(self.ax.axhline(0))
+        for line, (value, linestyle, color) in zip(self.hlines, spec.hlines):
+            line.set_ydata([value, value])
+            line.set_linestyle(linestyle)
+            line.set_color(color)
+            line.set_visible(True)
+        for line in self.hlines[len(spec.hlines):]:
+            line.set_visible(False)
+
+        self.ax.relim(visible_only=True)
+        self.ax.autoscale_view()
+        if self.ax.yaxis_inverted() != spec.invert_y:
+            self.ax.invert_yaxis()
+
+    def save(self, path, dpi=DEFAULT_DPI, figure_format=None):
+        self.fig.savefig(path, dpi=dpi, format=figure_format)
+
+    def close(self):
+        # Drop every reference to the figure, so it can be freed right away
+        self.fig.clear()
+        self.fig = self.ax = self.points = self.smoothed = None
+        self.hlines = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+# The figure every process reuses, created on first use
+_process_figure = None
+
+
+def process_figure():
+    global _process_figure
+    if _process_figure is None:
+        _process_figure = LightCurveFigure()
+    return _process_figure
+
+
+def figure_path(path, figure_format=DEFAULT_FORMAT):
+    # Paths are given without an extension, the format decides it
+    return "{}.{}".format(path, figure_format)
+
+
+def render(spec, dpi=DEFAULT_DPI, figure_format=DEFAULT_FORMAT):
+    # Draw and save a figure with the figure of the current process, returns the path of the written file
+    output_path = figure_path(spec.path, figure_format)
+    figure = process_figure()
+    with instrumentation.stage("draw") as timer:
+        figure.draw(spec, dpi)
+        timer.count("points", len(spec.X))
+        timer.count("drawn_points", len(figure.points.get_xdata()))
+    with instrumentation.stage("savefig", dpi=dpi, format=figure_format):
+        figure.save(output_path, dpi, figure_format)
+    return output_path
+
+
+def save_figure(fig, path, dpi=DEFAULT_DPI, figure_format=DEFAULT_FORMAT):
+    # For the interactive scripts, which still draw with pyplot: same resolution and format as the rendered figures
+    output_path = figure_path(path, figure_format)
+    fig.savefig(output_path, dpi=dpi, format=figure_format)
+    return output_path
+
+
+class RenderPool:
+    # Runs jobs (by default render) in worker processes, with at most max_pending jobs submitted but not finished
+    # With workers=0 everything runs in the current process, which is faster for a handful of figures
+    def __init__(self, workers=None, dpi=DEFAULT_DPI, figure_format=DEFAULT_FORMAT, max_pending=None):
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.dpi = dpi
+        self.figure_format = figure_format
+        self.slots = threading.BoundedSemaphore(max_pending or PENDING_PER_WORKER*max(self.workers, 1))
+        self.executor = ProcessPoolExecutor(max_workers=self.workers) if self.workers > 0 else None
+        self.futures = []
+
+    def submit(self, function, *args):
+        if self.executor is None:
+            self.futures.append(InlineResult(function, *args))
+            return self.futures[-1]
+        # Wait for a free slot before handing the job over, the slot is given back as soon as the job is done
+        self.slots.acquire()
+        try:
+            future = self.executor.submit(function, *args)
+        except BaseException:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda _: self.slots.release())
+        self.futures.append(future)
+        return future
+
+    def render(self, spec):
+        return self.submit(render, spec, self.dpi, self.figure_format)
+
+    def results(self):
+        # (result, exception) of every job in the order they were submitted
+        outcomes = []
+        for future in self.futures:
+            exception = future.exception()
+            outcomes.append((None if exception else future.result(), exception))
+        return outcomes
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class InlineResult:
+    # The part of a Future's interface RenderPool uses, for jobs that ran in the current process
+    def __init__(self, function, *args):
+        self._result = self._exception = None
+        try:
+            self._result = function(*args)
+        except Exception as e:
+            self._exception = e
+
+    def exception(self):
+        return self._exception
+
+    def result(self):
+        if self._exception is not None:
+            raise self._exception
+        return self._result
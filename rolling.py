@@ -0,0 +1,187 @@
+import numpy as np
+
+# Rolling statistics for light curves
+# Windows are either a number of samples (window_size) or a width in days (width, needs the timestamps),
+# the latter doesn't assume the frames are evenly spaced, so gaps in the sequence don't smear the statistics.
+# Means and standard deviations use cumulative sums and medians use pandas' rolling median, so all of them
+# run in (close to) linear time and none of them loops over the samples in python.
+# At the edges the windows shrink to the samples that are available (edge="shrink"),
+# or the value of the closest full window is repeated (edge="nearest").
+# pandas and scipy are imported by the functions that use them, the means and standard deviations only need numpy.
+
+# Scales the median absolute deviation to the standard deviation of a normal distribution
+MAD_TO_STD = 1.4826
+
+
+def window_bounds(n, window_size):
+    # Start (inclusive) and end (exclusive) of the window around every sample
+    # For even window sizes the window reaches one sample further back than forward, same as np.convolve(..., "same")
+    START = np.arange(n) - window_size//2
+    END = START + window_size
+    return np.clip(START, 0, n), np.clip(END, 0, n)
+
+
+def time_window_bounds(TIMES, width):
+    # Start (inclusive) and end (exclusive) of all the samples within width/2 of every sample, the timestamps have to be sorted
+    TIMES = np.asarray(TIMES, dtype=float)
+    return np.searchsorted(TIMES, TIMES - width/2, side="left"), np.searchsorted(TIMES, TIMES + width/2, side="right")
+
+
+def resolve_bounds(n, window_size, times, width):
+    if width is not None:
+        if times is None:
+            raise ValueError("Time based windows need the timestamps of the samples")
+        return time_window_bounds(times, width)
+    if window_size is None or window_size < 1:
+        raise ValueError("Either a window size of at least one sample or a window width has to be given")
+    return window_bounds(n, int(window_size))
+
+
+def fill_edges(VALUES, window_size):
+    # Repeat the first and last value for which the window was completely filled
+    n = len(VALUES)
+    head = window_size//2
+    tail = window_size - window_size//2 - 1
+    if n < window_size:
+        return VALUES
+    VALUES = VALUES.copy()
+    VALUES[:head] = VALUES[head]
+    if tail:
+        VALUES[n - tail:] = VALUES[n - tail - 1]
+    return VALUES
+
+
+def windowed_sums(VALUES, START, END):
+    # Sum over every window in O(1) per window from a cumulative sum
+    CUMSUM = np.concatenate(([0.0], np.cumsum(VALUES)))
+    return CUMSUM[END] - CUMSUM[START]
+
+
+def centered_values(VALUES, START, END):
+    # The values minus their overall mean with NaNs set to 0, and the number of valid values in every window
+    # Subtracting the overall mean first keeps the cumulative sum small, so long light curves don't lose precision.
+    # NaNs only leave out the windows they're in, like rolling_median does, instead of poisoning the whole cumulative sum
+    FINITE = np.isfinite(VALUES)
+    offset = np.mean(VALUES[FINITE]) if FINITE.any() else 0.0
+    CENTERED = np.where(FINITE, VALUES - offset, 0.0)
+    return CENTERED, offset, windowed_sums(FINITE, START, END)
+
+
+def rolling_mean(VALUES, window_size=None, times=None, width=None, edge="shrink"):
+    VALUES = np.asarray(VALUES, dtype=float)
+    START, END = resolve_bounds(len(VALUES), window_size, times, width)
+    CENTERED, offset, COUNTS = centered_values(VALUES, START, END)
+    # Windows without a single valid value are NaN
+    with np.errstate(invalid="ignore", divide="ignore"):
+        MEANS = windowed_sums(CENTERED, START, END)/COUNTS + offset
+    if edge == "nearest" and width is None:
+        MEANS = fill_edges(MEANS, int(window_size))
+    return MEANS
+
+
+def rolling_std(VALUES, window_size=None, times=None, width=None, edge="shrink"):
+    VALUES = np.asarray(VALUES, dtype=float)
+    START, END = resolve_bounds(len(VALUES), window_size, times, width)
+    CENTERED, _, COUNTS = centered_values(VALUES, START, END)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        MEANS = windowed_sums(CENTERED, START, END)/COUNTS
+        VARIANCES = windowed_sums(CENTERED**2, START, END)/COUNTS - MEANS**2
+    STDS = np.sqrt(np.clip(VARIANCES, 0, None))
+    if edge == "nearest" and width is None:
+        STDS = fill_edges(STDS, int(window_size))
+    return STDS
+
+
+def rolling_median(VALUES, window_size=None, times=None, width=None, edge="shrink"):
+    import pandas as pd
+
+    VALUES = np.asarray(VALUES, dtype=float)
+    n = len(VALUES)
+    if width is not None:
+        if times is None:
+            raise ValueError("Time based windows need the timestamps of the samples")
+        TIMES = np.asarray(times, dtype=float)
+        series = pd.Series(VALUES, index=pd.to_timedelta(TIMES - TIMES[0], unit="D"))
+        return series.rolling(pd.Timedelta(days=width), center=True, closed="both", min_periods=1).median().to_numpy()
+    if window_size is None or window_size < 1:
+        raise ValueError("Either a window size of at least one sample or a window width has to be given")
+    window_size = int(window_size)
+    # pandas only has trailing sample windows, so the values are shifted to get the same windows as window_bounds
+    # The padding is NaN, which the rolling median ignores, so the windows at the end shrink just like the ones at the start
+    shift = window_size - window_size//2 - 1
+    PADDED = np.concatenate((VALUES, np.full(shift, np.nan)))
+    MEDIANS = pd.Series(PADDED).rolling(window_size, min_periods=1).median().to_numpy()[shift:shift + n]
+    if edge == "nearest":
+        MEDIANS = fill_edges(MEDIANS, window_size)
+    return MEDIANS
+
+
+def rolling_mad(VALUES, window_size=None, times=None, width=None, edge="shrink", scale=1.0):
+    # Rolling median of the absolute deviations from the rolling median
+    # (an exact rolling MAD would need the deviations from every window's own median, which can't be done in linear time)
+    # Use scale=MAD_TO_STD to get an estimate of the standard deviation
+    VALUES = np.asarray(VALUES, dtype=float)
+    MEDIANS = rolling_median(VALUES, window_size, times, width, edge)
+    return scale*rolling_median(np.abs(VALUES - MEDIANS), window_size, times, width, edge)
+
+
+def savitzky_golay(VALUES, window_size, polyorder=2):
+    # Local polynomial fit over sample windows, the edges use a polynomial fitted to the first/last full window
+    # scipy needs an odd window that is longer than the order of the polynomial
+    from scipy.signal import savgol_filter
+
+    VALUES = np.asarray(VALUES, dtype=float)
+    window_size = int(window_size) | 1
+    window_size = min(window_size, len(VALUES) if len(VALUES) % 2 else len(VALUES) - 1)
+    if window_size <= polyorder:
+        return VALUES.copy()
+    return savgol_filter(VALUES, window_size, polyorder, mode="interp")
+
+
+def smoothing_stage(key, window_size, output_key="SMOOTHED_MAGS"):
+    # Stage for product_cache.run that adds the moving average of one of the arrays of a reduction
+    return ("smoothed", {"window_size": window_size, "input": key, "output": output_key},
+            lambda arrays: {output_key: rolling_mean(arrays[key], window_size)})
+
+
+class TrailingWindow:
+    # Mean and standard deviation of the last window_size values of a stream, updated in O(1) per value
+    # For light curves that grow while they are observed, where a centred window would need values from the future
+    # The running sums are recomputed from the window now and then, so rounding errors don't add up over a long night
+    RESUM_INTERVAL = 1000
+
+    def __init__(self, window_size):
+        self.window_size = int(window_size)
+        self.values = np.full(self.window_size, np.nan)
+        self.count = 0
+        self.n_valid = 0
+        self.sum = 0.0
+        self.sum_of_squares = 0.0
+
+    def push(self, value):
+        # The oldest value leaves the window when it's full, NaNs are stored but not counted
+        slot = self.count % self.window_size
+        old = self.values[slot]
+        if np.isfinite(old):
+            self.sum -= old
+            self.sum_of_squares -= old**2
+            self.n_valid -= 1
+        self.values[slot] = value
+        if np.isfinite(value):
+            self.sum += value
+            self.sum_of_squares += value**2
+            self.n_valid += 1
+        self.count += 1
+        if self.count % self.RESUM_INTERVAL == 0:
+            FINITE = self.values[np.isfinite(self.values)]
+            self.sum = float(np.sum(FINITE))
+            self.sum_of_squares = float(np.sum(FINITE**2))
+
+    def mean(self):
+        return self.sum/self.n_valid if self.n_valid else np.nan
+
+    def std(self):
+        if self.n_valid == 0:
+            return np.nan
+        mean = self.sum/self.n_valid
+        return float(np.sqrt(max(self.sum_of_squares/self.n_valid - mean**2, 0.0)))
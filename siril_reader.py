@@ -0,0 +1,142 @@
+import argparse
+import glob
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+import numpy as np
+from catalog_cache import file_digest, read_json, source_signature, write_json
+import instrumentation
+import paths
+
+# Reader for the light curves Siril exports
+# Siril writes a header line "# JD_UT V-C err" followed by one space separated line per frame with the julian date,
+# the magnitude of the variable relative to the comparison stars and its error. These .dat files are read directly,
+# as are the comma separated copies (.dat.csv) and the two-column .csv exports, so nothing has to be converted first.
+# For tools that still need the comma separated copies, convert_all writes them incrementally: a manifest remembers
+# the mtime, size and hash of every .dat file, and only new or changed files are converted (in parallel).
+
+SIRIL_ROOT = paths.LIGHTCURVE_ROOT
+MANIFEST_FILE = os.path.join(SIRIL_ROOT, ".siril_manifest.json")
+CONVERTED_SUFFIX = ".csv"
+
+
+@dataclass
+class SirilLightCurve:
+    # The full julian date of every frame
+    julian_dates: np.ndarray
+    # The magnitude of the target relative to the comparison stars (V-C)
+    relmags: np.ndarray
+    # The error Siril estimated for every relative magnitude, NaN for exports without errors
+    errors: np.ndarray
+
+    def __len__(self):
+        return len(self.julian_dates)
+
+    @property
+    def julian_date_prefix(self):
+        # The integer part of the first julian date, it's the same for all the frames of a night
+        return int(self.julian_dates[0]) if len(self.julian_dates) else 0
+
+    def relative_dates(self):
+        return self.julian_dates - self.julian_date_prefix
+
+
+@instrumentation.timed()
+def read_siril(file_path):
+    import pandas as pd
+
+    if file_path.endswith(".dat"):
+        file_df = pd.read_csv(file_path, sep=r"\s+", comment="#", header=None, engine="c")
+    else:
+        # The .dat.csv copies end every line with a comma, the .csv exports have a space after the comma
+        file_df = pd.read_csv(file_path, sep=",", skipinitialspace=True, header=None, encoding="UTF-8-sig", engine="c")
+    instrumentation.count("rows", len(file_df))
+    VALUES = file_df.to_numpy(dtype=np.float64)
+    ERRORS = VALUES[:, 2] if VALUES.shape[1] > 2 else np.full(len(VALUES), np.nan)
+    return SirilLightCurve(julian_dates=VALUES[:, 0], relmags=VALUES[:, 1], errors=ERRORS)
+
+
+def siril_stage(file_path):
+    # Stage for product_cache.run that reads a Siril export, so an unchanged file isn't parsed again
+    def relmags(arrays):
+        lightcurve = read_siril(file_path)
+        return {"JULIAN_DATES": lightcurve.julian_dates, "RELMAGS": lightcurve.relmags}
+
+    return ("siril", {}, relmags)
+
+
+def converted_path(file_path):
+    return file_path + CONVERTED_SUFFIX
+
+
+def convert(file_path):
+    # Write the comma separated copy of a .dat file, the values are copied as text so nothing is lost by rounding
+    # Every line ends with a comma, like the copies pandas used to write (the header has one name more than there are columns)
+    with open(file_path) as file:
+        lines = [line.split() for line in file if line.strip() and not line.startswith("#")]
+    output_path = converted_path(file_path)
+    with open(output_path, "w") as file:
+        file.writelines(",".join(values) + ",\n" for values in lines)
+    return output_path
+
+
+def read_manifest(manifest_file=MANIFEST_FILE):
+    return read_json(manifest_file, {})
+
+
+def write_manifest(manifest, manifest_file=MANIFEST_FILE):
+    write_json(manifest_file, manifest, indent=1, sort_keys=True)
+
+
+def convert_if_changed(file_path, entry):
+    # Runs in a worker: returns the new manifest entry and whether the file had to be converted
+    # A file whose mtime changed but whose content didn't (e.g. after a checkout) only gets its manifest entry updated
+    signature = source_signature(file_path)
+    digest = file_digest(file_path)
+    output_exists = os.path.isfile(converted_path(file_path))
+    if entry is not None and entry["sha256"] == digest and output_exists:
+        return dict(signature, sha256=digest), False
+    convert(file_path)
+    return dict(signature, sha256=digest), True
+
+
+def convert_all(root=SIRIL_ROOT, manifest_file=MANIFEST_FILE, workers=None):
+    # Convert the .dat files below root that are new or changed since the last run, returns the converted files
+    manifest = read_manifest(manifest_file)
+    FILES = sorted(glob.glob(os.path.join(root, "**", "*.dat"), recursive=True))
+    # Unchanged files are recognized by their mtime and size alone, without reading them
+    pending = []
+    for file_path in FILES:
+        key = os.path.relpath(file_path, root)
+        entry = manifest.get(key)
+        unchanged = entry is not None and {"mtime_ns": entry["mtime_ns"], "size": entry["size"]} == source_signature(file_path)
+        if not (unchanged and os.path.isfile(converted_path(file_path))):
+            pending.append((key, file_path, entry))
+
+    converted = []
+    if pending:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(convert_if_changed, [file_path for _, file_path, _ in pending], [entry for _, _, entry in pending])
+            for (key, file_path, _), (entry, was_converted) in zip(pending, results):
+                manifest[key] = entry
+                if was_converted:
+                    converted.append(file_path)
+    # Files that don't exist anymore are dropped from the manifest
+    known = {os.path.relpath(file_path, root) for file_path in FILES}
+    manifest = {key: entry for key, entry in manifest.items() if key in known}
+    write_manifest(manifest, manifest_file)
+    return converted
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write comma separated copies (.dat.csv) of the Siril .dat files that changed")
+    parser.add_argument("--root", default=SIRIL_ROOT, help="directory that is searched recursively for .dat files")
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes (default: number of cores)")
+    args = parser.parse_args()
+    manifest_file = os.path.join(args.root, os.path.basename(MANIFEST_FILE))
+    converted = convert_all(args.root, manifest_file, args.workers)
+    print("Converted {} files".format(len(converted)))
+
+
+if __name__ == "__main__":
+    main()
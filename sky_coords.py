@@ -0,0 +1,82 @@
+import numpy as np
+
+# Sky coordinates of the catalog entries and a spatial index to search them
+# The catalog stores RA as hours, minutes and seconds and the declination as sign, degrees, arcminutes and arcseconds
+# These are parsed once into radians for the whole catalog, after which cone and strip searches don't have to scan every row
+
+
+def catalog_coordinates(catalog):
+    # Returns RA and declination of every entry in radians
+    # The catalog can be a pandas dataframe or a dict of numpy arrays
+    RA_HOURS = np.asarray(catalog["RAh"], dtype=float) + np.asarray(catalog["RAm"], dtype=float)/60 + np.asarray(catalog["RAs"], dtype=float)/3600
+    # The sign is stored separately, as otherwise declinations between -1° and 0° would lose it
+    DE_SIGN = np.where(np.char.strip(np.asarray(catalog["DE-"], dtype=str)) == "-", -1.0, 1.0)
+    DE_DEGREES = DE_SIGN*(np.asarray(catalog["DEd"], dtype=float) + np.asarray(catalog["DEm"], dtype=float)/60 + np.asarray(catalog["DEs"], dtype=float)/3600)
+    return np.radians(RA_HOURS*15), np.radians(DE_DEGREES)
+
+
+def unit_vectors(RA_RAD, DEC_RAD):
+    # Cartesian unit vectors on the celestial sphere, one row per entry
+    cos_dec = np.cos(DEC_RAD)
+    return np.column_stack((cos_dec*np.cos(RA_RAD), cos_dec*np.sin(RA_RAD), np.sin(DEC_RAD)))
+
+
+def angular_separation(ra1, dec1, ra2, dec2):
+    # Haversine formula, all values in radians
+    sin_ddec = np.sin((dec2 - dec1)/2)
+    sin_dra = np.sin((ra2 - ra1)/2)
+    return 2*np.arcsin(np.sqrt(sin_ddec**2 + np.cos(dec1)*np.cos(dec2)*sin_dra**2))
+
+
+class SkyIndex:
+    # k-d tree over the unit vectors of the catalog entries
+    # The straight line distance between two unit vectors only depends on their angular separation,
+    # so a cone on the sky becomes a ball around the unit vector of its centre
+    def __init__(self, RA_RAD, DEC_RAD):
+        # scipy is only needed for the index, the coordinate functions above work without it
+        from scipy.spatial import cKDTree
+
+        self.ra = np.asarray(RA_RAD, dtype=float)
+        self.dec = np.asarray(DEC_RAD, dtype=float)
+        self.tree = cKDTree(unit_vectors(self.ra, self.dec))
+        # Declination strips are answered with a binary search over the sorted declinations
+        self.dec_order = np.argsort(self.dec, kind="stable")
+        self.sorted_dec = self.dec[self.dec_order]
+
+    @classmethod
+    def from_catalog(cls, catalog):
+        return cls(*catalog_coordinates(catalog))
+
+    def __len__(self):
+        return len(self.ra)
+
+    def cone(self, ra_deg, dec_deg, radius_deg):
+        # Indices of all the entries within radius_deg of the field centre, in catalog order
+        centre = unit_vectors(np.radians([ra_deg]), np.radians([dec_deg]))[0]
+        chord = 2*np.sin(np.radians(min(radius_deg, 180.0))/2)
+        return np.sort(np.asarray(self.tree.query_ball_point(centre, chord), dtype=np.intp))
+
+    def strip(self, dec_min_deg, dec_max_deg):
+        # Indices of all the entries with dec_min_deg <= declination <= dec_max_deg, in catalog order
+        lower = np.searchsorted(self.sorted_dec, np.radians(dec_min_deg), side="left")
+        upper = np.searchsorted(self.sorted_dec, np.radians(dec_max_deg), side="right")
+        return np.sort(self.dec_order[lower:upper])
+
+    def nearest(self, ra_deg, dec_deg, k=1):
+        # Indices and angular separations in degrees of the k closest entries to a position
+        # Fewer than k entries are returned if the index is smaller than that
+        k = min(k, len(self))
+        if k < 1:
+            return np.empty(0, dtype=np.intp), np.empty(0)
+        centre = unit_vectors(np.radians([ra_deg]), np.radians([dec_deg]))[0]
+        chords, indices = self.tree.query(centre, k=k)
+        chords, indices = np.atleast_1d(chords), np.atleast_1d(indices)
+        # The tree pads missing neighbours with the index len(self) and an infinite distance
+        FOUND = indices < len(self)
+        return indices[FOUND], np.degrees(2*np.arcsin(np.minimum(chords[FOUND]/2, 1.0)))
+
+
+def select_curve_types(catalog, indices, curve_types):
+    # Narrow down the result of an index query to the given GCVS light curve types (e.g. "EA", "EB")
+    CURVE_TYPES = np.char.strip(np.asarray(catalog["CurveType"], dtype=str)[indices])
+    return indices[np.isin(CURVE_TYPES, list(curve_types))]
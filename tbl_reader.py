@@ -0,0 +1,77 @@
+from dataclasses import dataclass, field
+import numpy as np
+import instrumentation
+
+# Shared reader for the measurement tables (.tbl) AstroImageJ exports
+# The tables are tab separated with one row per frame and a column per measured quantity and aperture.
+# Only the requested columns are parsed, straight into float arrays, and the flux is computed on whole arrays.
+
+TIME_COLUMN = "J.D.-2400000"
+EXPTIME_COLUMN = "EXPTIME"
+
+
+def aperture_columns(aperture):
+    # The columns needed for the flux of one aperture (T1 is the target, C2, C3, ... are the comparison stars)
+    return ["Source-Sky_{}".format(aperture), "Sky/Pixel_{}".format(aperture), "N_Sky_Pixels_{}".format(aperture)]
+
+
+def read_columns(file_path):
+    # Names of all the columns of a table, read from the header line only
+    with open(file_path) as file:
+        return file.readline().rstrip("\r\n").split("\t")
+
+
+def read_tbl(file_path, columns):
+    # Returns a dict of float64 arrays for the requested columns
+    # pandas is only imported for parsing, so scripts that only use cached products don't have to load it
+    import pandas as pd
+
+    with instrumentation.stage("read_tbl", file=file_path) as timer:
+        file_df = pd.read_csv(file_path, sep="\t", usecols=list(columns), dtype={column: np.float64 for column in columns}, engine="c")
+        timer.count("rows", len(file_df))
+        timer.count("columns", len(columns))
+        return {column: file_df[column].to_numpy() for column in columns}
+
+
+def calculate_flux(SOURCE_COUNTS, BACKGROUND_COUNTS, exp_time):
+    # Subtract the background from every counts value and divide by the exposure time to get the flux in ADU/s
+    return (SOURCE_COUNTS - BACKGROUND_COUNTS)/exp_time
+
+
+@dataclass
+class LightCurve:
+    # The timestamp (J.D.-2400000) of every frame
+    julian_dates: np.ndarray
+    # The total ADU count over all the pixels in the aperture
+    source_counts: np.ndarray
+    # The total background counts for each frame (ADUs per pixel which are background * number of pixels)
+    background_counts: np.ndarray
+    # The exposure time used for the frames
+    exp_time: float
+    # Any additional columns that were requested when loading the table
+    columns: dict = field(default_factory=dict)
+
+    def __len__(self):
+        return len(self.julian_dates)
+
+    @property
+    def flux(self):
+        return calculate_flux(self.source_counts, self.background_counts, self.exp_time)
+
+    def adjusted_flux(self, SOURCE_COUNTS):
+        # Flux of the same aperture, but starting from corrected source counts (e.g. normalized by a comparison star)
+        return calculate_flux(SOURCE_COUNTS, self.background_counts, self.exp_time)
+
+
+def load_lightcurve(file_path, aperture="T1", extra_columns=()):
+    SOURCE_COLUMN, SKY_COLUMN, N_SKY_COLUMN = aperture_columns(aperture)
+    extra_columns = [column for column in extra_columns if column not in (TIME_COLUMN, EXPTIME_COLUMN, SOURCE_COLUMN, SKY_COLUMN, N_SKY_COLUMN)]
+    values = read_tbl(file_path, [TIME_COLUMN, EXPTIME_COLUMN, SOURCE_COLUMN, SKY_COLUMN, N_SKY_COLUMN] + extra_columns)
+    return LightCurve(
+        julian_dates=values[TIME_COLUMN],
+        source_counts=values[SOURCE_COLUMN],
+        background_counts=values[SKY_COLUMN]*values[N_SKY_COLUMN],
+        # The exposure time is the same for all frames of a sequence
+        exp_time=float(values[EXPTIME_COLUMN][0]),
+        columns={column: values[column] for column in extra_columns},
+    )
@@ -0,0 +1,79 @@
+import numpy as np
+import ephemeris
+from designations import target_metadata
+import instrumentation
+from sky_coords import catalog_coordinates
+
+# Heliocentric and barycentric julian dates of the frames of a measurement table
+# AstroImageJ only fills HJD_UTC and BJD_TDB when the coordinates of the target were entered, which they weren't for
+# any of our tables, so they're computed here from the J.D.-2400000 column. The coordinates are the table's
+# RAOBJ2K/DECOBJ2K if they're there, otherwise the catalog position of the target the file is named after.
+# The corrections change by less than 0.2 s per hour, so the ephemeris is only evaluated on a grid of GRID_STEP
+# and interpolated to the frames (the interpolation is good to about 0.02 s). This keeps the cost of the correction
+# at one np.interp per array, also for archives of millions of frames.
+
+GRID_STEP = 1.0
+COORDINATE_COLUMNS = ["RAOBJ2K", "DECOBJ2K"]
+# Offset of the time column of the tables
+JULIAN_DATE_OFFSET = 2400000
+
+
+def table_coordinates(file_path):
+    # RA and declination in radians from the columns AstroImageJ writes (RA in hours), None if they're empty
+    # They're the same in every row, so only the first row is read (without parsing the whole table)
+    with open(file_path) as file:
+        columns = file.readline().rstrip("\r\n").split("\t")
+        fields = file.readline().rstrip("\r\n").split("\t")
+    if not set(COORDINATE_COLUMNS) <= set(columns) or len(fields) != len(columns):
+        return None
+    try:
+        ra_hours, dec_degrees = (float(fields[columns.index(column)]) for column in COORDINATE_COLUMNS)
+    except ValueError:
+        return None
+    if not (np.isfinite(ra_hours) and np.isfinite(dec_degrees)):
+        return None
+    return float(np.radians(ra_hours*15)), float(np.radians(dec_degrees))
+
+
+def target_coordinates(file_path):
+    # Coordinates of the target of a table in radians, None if neither the table nor the catalog has them
+    coordinates = table_coordinates(file_path)
+    if coordinates is not None:
+        return coordinates
+    metadata = target_metadata(file_path)
+    if metadata is None:
+        return None
+    RA, DEC = catalog_coordinates({column: [value] for column, value in metadata.items()})
+    return float(RA[0]), float(DEC[0])
+
+
+def interpolated(correction, JULIAN_DATES, ra, dec, grid_step=GRID_STEP):
+    # A correction function of ephemeris.py evaluated on a grid over the time span and interpolated to every date
+    start, end = np.nanmin(JULIAN_DATES), np.nanmax(JULIAN_DATES)
+    GRID = start + grid_step*np.arange(int(np.ceil((end - start)/grid_step)) + 2)
+    return np.interp(JULIAN_DATES, GRID, correction(GRID, ra, dec))
+
+
+@instrumentation.timed()
+def corrected_times(JULIAN_DATES, ra, dec, offset=JULIAN_DATE_OFFSET):
+    # HJD_UTC and BJD_TDB of the dates, with the same offset as the dates (J.D.-2400000 by default)
+    JULIAN_DATES = np.asarray(JULIAN_DATES, dtype=float)
+    instrumentation.count("frames", len(JULIAN_DATES))
+    if not np.isfinite(JULIAN_DATES).any():
+        return np.full(len(JULIAN_DATES), np.nan), np.full(len(JULIAN_DATES), np.nan)
+    FULL_DATES = JULIAN_DATES + offset
+    HJD = JULIAN_DATES + interpolated(ephemeris.heliocentric_correction, FULL_DATES, ra, dec)
+    BJD = JULIAN_DATES + interpolated(ephemeris.barycentric_correction, FULL_DATES, ra, dec)
+    return HJD, BJD
+
+
+def time_stage(file_path):
+    # Stage for product_cache.run that adds HJD and BJD_TDB to the arrays of a reduction with JULIAN_DATES,
+    # None if the coordinates of the target aren't known. The coordinates are part of the parameters, so a corrected
+    # catalog position computes the times again
+    coordinates = target_coordinates(file_path)
+    if coordinates is None:
+        return None
+    ra, dec = coordinates
+    return ("times", {"ra": ra, "dec": dec, "grid_step": GRID_STEP},
+            lambda arrays: dict(zip(("HJD", "BJD_TDB"), corrected_times(arrays["JULIAN_DATES"], ra, dec))))